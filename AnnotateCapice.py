@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import os
+from src.vcf_annotator import VcfAnnotator
+from src.logger import Logger
+from src.command_line_supporter import AnnotateArgumentSupporter
+
+
+def main():
+    """
+    Main method of the annotate script. Will write the VCF with the
+    pre-computed CAPICE scores of its variants in the INFO field.
+    """
+    arguments = AnnotateArgumentSupporter()
+    values = {}
+    for key in ['output', 'input', 'annotated', 'compression_level']:
+        value = arguments.get_argument(key)
+        if isinstance(value, list):
+            value = value[0]
+        values[key] = value
+    logger = Logger()
+    logger.set_output_dir(os.path.dirname(os.path.abspath(
+        values['annotated'])))
+    logger.log('Annotating: {}'.format(values['input']))
+    annotator = VcfAnnotator(values['output'],
+                             compression_level=values['compression_level'])
+    annotator.annotate(values['input'], values['annotated'])
+    logger.log('Annotated VCF saved in: {}'.format(values['annotated']))
+
+
+if __name__ == '__main__':
+    main()
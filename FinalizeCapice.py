@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+from src.score_index import ScoreIndexBuilder
+from src.external_sort import ExternalSorter
+from src.shard_merger import ShardMerger
+from src.logger import Logger
+from src.progress_tracker import ProgressTracker
+from src.command_line_supporter import FinalizeArgumentSupporter
+
+
+def main():
+    """
+    Main method of the finalize script. Will merge the output of the shards
+    of a sharded run, sort the chromosome output files when asked to and
+    index every chromosome output file in the output directory.
+    """
+    arguments = FinalizeArgumentSupporter()
+    output_loc = arguments.get_argument('output')
+    compression_level = arguments.get_argument('compression_level')
+    sort = arguments.get_argument('sort')
+    memory_budget = arguments.get_argument('memory_budget')
+    if isinstance(output_loc, list):
+        output_loc = str(output_loc[0])
+    if isinstance(compression_level, list):
+        compression_level = int(compression_level[0])
+    if isinstance(memory_budget, list):
+        memory_budget = int(memory_budget[0])
+    logger = Logger()
+    logger.set_output_dir(output_loc)
+    merger = ShardMerger(output_loc, compression_level=compression_level)
+    # Before any output file is rewritten, so PreComputeCapice.py never
+    # continues into the rewritten files.
+    is_done = ProgressTracker.mark_finalized(output_loc)
+    if not is_done and not merger.has_shards():
+        logger.warning('The run in {} is not done, its output can no longer'
+                       ' be continued once finalized.', output_loc)
+    if merger.has_shards():
+        logger.log('Merging the output of {} shards.'.format(
+            len(merger.shard_locs)))
+        merger.merge()
+    sorter = ExternalSorter(memory_budget=memory_budget,
+                            compression_level=compression_level)
+    builder = ScoreIndexBuilder(compression_level=compression_level)
+    for path in sorted(Path(output_loc).glob(
+            'chr*/whole_genome_SNVs_*.tsv.gz')):
+        if sort:
+            logger.log('Sorting: {}'.format(path))
+            lines, duplicates = sorter.sort(str(path))
+            logger.log('Sorted {} lines, {} exact duplicates removed.'.format(
+                lines, duplicates))
+        logger.log('Indexing: {}'.format(path))
+        index_path = builder.finalize(str(path))
+        logger.log('Index saved in: {}'.format(index_path))
+
+
+if __name__ == '__main__':
+    main()
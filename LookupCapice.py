@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+import sys
+from src.score_index import ScoreLookup
+from src.command_line_supporter import LookupArgumentSupporter
+
+
+def main():
+    """
+    Main method of the lookup script. Prints the scores of a variant or a
+    region as tsv.
+    """
+    arguments = LookupArgumentSupporter()
+    values = {}
+    for key in ['output', 'chromosome', 'position', 'end', 'ref', 'alt']:
+        value = arguments.get_argument(key)
+        if isinstance(value, list):
+            value = value[0]
+        values[key] = value
+    lookup = ScoreLookup(values['output'])
+    if values['end'] is not None:
+        found = lookup.lookup_region(values['chromosome'],
+                                     values['position'],
+                                     values['end'])
+    else:
+        found = lookup.lookup(values['chromosome'], values['position'],
+                              ref=values['ref'], alt=values['alt'])
+    lookup.close()
+    found.to_csv(sys.stdout, sep='\t', index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from src.pre_compute_capice import CalculateCapiceScores
+from src.sharding import parse_shard, get_shard_output_loc
 from src.logger import Logger
 from src.command_line_supporter import ArgumentSupporter
 
@@ -14,25 +15,95 @@ def main():
     model_loc = arguments.get_argument('model')
     output_loc = arguments.get_argument('output')
     batch_size = arguments.get_argument('batchsize')
+    pipeline = arguments.get_argument('pipeline')
+    workers = arguments.get_argument('workers')
+    compression_level = arguments.get_argument('compression_level')
+    compression_threads = arguments.get_argument('compression_threads')
+    bgzf = arguments.get_argument('bgzf')
+    output_format = arguments.get_argument('output_format')
+    model_threads = arguments.get_argument('model_threads')
+    prediction_cache = arguments.get_argument('prediction_cache')
+    metrics_format = arguments.get_argument('metrics_format')
+    log_level = arguments.get_argument('log_level')
+    memory_limit = arguments.get_argument('memory_limit')
+    regions = arguments.get_argument('regions')
+    chromosomes = arguments.get_argument('chromosomes')
+    shard = arguments.get_argument('shard')
+    profile = arguments.get_argument('profile')
     if isinstance(cadd_loc, list):
         cadd_loc = str(cadd_loc[0])
-    if isinstance(model_loc, list):
-        model_loc = str(model_loc[0])
+    if isinstance(model_loc, str):
+        model_loc = [model_loc]
     if isinstance(output_loc, list):
         output_loc = str(output_loc[0])
     if isinstance(batch_size, list):
         batch_size = int(batch_size[0])
+    if isinstance(workers, list):
+        workers = int(workers[0])
+    if isinstance(compression_level, list):
+        compression_level = int(compression_level[0])
+    if isinstance(compression_threads, list):
+        compression_threads = int(compression_threads[0])
+    if isinstance(output_format, list):
+        output_format = str(output_format[0])
+    if isinstance(model_threads, list):
+        model_threads = int(model_threads[0])
+    if isinstance(prediction_cache, list):
+        prediction_cache = int(prediction_cache[0])
+    if isinstance(metrics_format, list):
+        metrics_format = str(metrics_format[0])
+    if isinstance(log_level, list):
+        log_level = str(log_level[0])
+    if isinstance(memory_limit, list):
+        memory_limit = int(memory_limit[0])
+    if isinstance(shard, list):
+        shard = parse_shard(str(shard[0]))
+        output_loc = get_shard_output_loc(output_loc, shard)
+    if isinstance(profile, list):
+        profile = int(profile[0])
     logger = Logger()
     logger.set_output_dir(output_loc)
+    logger.set_level(log_level)
     logger.log('CADD file location: {}'.format(cadd_loc))
-    logger.log('Model file location: {}'.format(model_loc))
+    logger.log('Model file locations: {}'.format(model_loc))
     logger.log('Output directory: {}'.format(output_loc))
     logger.log('Batch size set to: {}'.format(batch_size))
+    logger.log('Pipeline mode: {}'.format(pipeline))
+    logger.log('Worker processes: {}'.format(workers))
+    logger.log('Output compression level: {}, BGZF: {}, threads: {}'.format(
+        compression_level, bgzf, compression_threads))
+    logger.log('Output format: {}'.format(output_format))
+    logger.log('Model threads: {}'.format(model_threads))
+    logger.log('Prediction cache size: {}'.format(prediction_cache))
+    logger.log('Metrics format: {}'.format(metrics_format))
+    logger.log('Memory limit: {} MB'.format(memory_limit))
+    logger.log('Regions: {}'.format(regions))
+    logger.log('Chromosomes: {}'.format(chromosomes))
+    logger.log('Shard: {}'.format(shard))
+    logger.log('Profiled batches: {}'.format(profile))
     precompute_capice = CalculateCapiceScores(filepath=cadd_loc,
                                               model_loc=model_loc,
                                               output_loc=output_loc,
-                                              batch_size=batch_size)
+                                              batch_size=batch_size,
+                                              pipeline=pipeline,
+                                              workers=workers,
+                                              compression_level=
+                                              compression_level,
+                                              compression_threads=
+                                              compression_threads,
+                                              bgzf=bgzf,
+                                              output_format=output_format,
+                                              model_threads=model_threads,
+                                              prediction_cache=
+                                              prediction_cache,
+                                              metrics_format=metrics_format,
+                                              memory_limit=memory_limit,
+                                              regions=regions,
+                                              chromosomes=chromosomes,
+                                              shard=shard,
+                                              profile=profile)
     precompute_capice.calc_capice()
+    logger.close()
 
 
 if __name__ == '__main__':
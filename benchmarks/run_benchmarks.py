@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import psutil
+import xgboost as xgb
+from benchmarks.synthetic_cadd import write_cadd_file, write_model
+from src.command_line_supporter import ArgumentSupporter
+from src.logger import Logger
+from src.pre_compute_capice import CalculateCapiceScores
+from src.run_metrics import RunMetrics
+from src.utilities.utilities import Utilities
+
+_REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BenchmarkArgumentSupporter(ArgumentSupporter):
+    """
+    Class to handle the given command line input of the benchmarks.
+    Type python3 -m benchmarks.run_benchmarks --help for more details.
+    """
+
+    @staticmethod
+    def _create_argument_parser():
+        parser = argparse.ArgumentParser(
+            prog="benchmarks.run_benchmarks",
+            description="Benchmark the stages of PreComputeCapice.py and a"
+                        " whole run on a synthetic CADD file.")
+        required = parser.add_argument_group("Required arguments")
+        optional = parser.add_argument_group("Optional arguments")
+
+        required.add_argument('-o',
+                              '--output',
+                              nargs=1,
+                              type=str,
+                              required=True,
+                              help='The directory to put the synthetic data,'
+                                   ' the output of the runs and the results'
+                                   ' in.')
+
+        optional.add_argument('-r',
+                              '--rows',
+                              nargs=1,
+                              type=int,
+                              default=200000,
+                              required=False,
+                              help='The amount of rows of the synthetic CADD'
+                                   ' file. (Default: 200000)')
+
+        optional.add_argument('-s',
+                              '--batchsize',
+                              nargs=1,
+                              type=int,
+                              default=10000,
+                              required=False,
+                              help='The batch size to run with.'
+                                   ' (Default: 10000)')
+
+        optional.add_argument('-e',
+                              '--estimators',
+                              nargs=1,
+                              type=int,
+                              default=100,
+                              required=False,
+                              help='The amount of trees of the synthetic'
+                                   ' model. (Default: 100)')
+
+        optional.add_argument('--seed',
+                              nargs=1,
+                              type=int,
+                              default=0,
+                              required=False,
+                              help='The seed of the synthetic data.'
+                                   ' (Default: 0)')
+
+        optional.add_argument('-b',
+                              '--bgzf',
+                              action='store_true',
+                              required=False,
+                              help='Write the synthetic CADD file as BGZF.')
+
+        optional.add_argument('-x',
+                              '--run-args',
+                              nargs=1,
+                              type=str,
+                              default='',
+                              required=False,
+                              help='Extra arguments for the end to end run of'
+                                   ' PreComputeCapice.py, as one quoted'
+                                   ' string, e.g. -x="-p -c 100000".')
+
+        optional.add_argument('-R',
+                              '--results',
+                              nargs=1,
+                              type=str,
+                              required=False,
+                              help='The json file to write the results to.'
+                                   ' (Default: benchmark_<time>.json in the'
+                                   ' output directory)')
+        return parser
+
+
+class StageBenchmark:
+    """
+    Class to time the stages of CalculateCapiceScores one by one: reading,
+    imputing, preprocessing, predicting, deduplicating, writing and
+    checkpointing every batch of a CADD file. Batches go through the same
+    methods as in a run, which record the seconds of every stage in the
+    timings of the batch. The growth of the RSS is measured around every
+    call, stages timed within the same call share its growth.
+    """
+    stages = RunMetrics.stages
+
+    def __init__(self, cadd_loc, model_loc, output_loc, batch_size):
+        self.calculator = CalculateCapiceScores(cadd_loc, model_loc,
+                                                output_loc, batch_size)
+        self.seconds = dict.fromkeys(self.stages, 0.0)
+        self.rows = dict.fromkeys(self.stages, 0)
+        self.rss_growth = dict.fromkeys(self.stages, 0.0)
+
+    def _measure(self, stages, function, *args):
+        before = Utilities.get_ram_usage()
+        result = function(*args)
+        growth = Utilities.get_ram_usage() - before
+        for stage in stages:
+            self.rss_growth[stage] = max(self.rss_growth[stage], growth)
+        return result
+
+    def run(self):
+        """
+        Method to run all batches through the stages.
+        :return: dict of stage and its seconds, rows, rows per second and
+        the largest growth of the RSS in MB over a batch.
+        """
+        calculator = self.calculator
+        scorer = calculator.scorer
+        reader = iter(calculator.create_reader(None, calculator.batch_size))
+        while True:
+            batch = self._measure(['read'], next, reader, None)
+            if batch is None:
+                break
+            self.rows['read'] += batch.variants_df.shape[0]
+            self._measure(['impute', 'preprocess'],
+                          scorer.impute_preprocess_batch, batch)
+            self.rows['impute'] += batch.variants_df.shape[0]
+            self.rows['preprocess'] += batch.variants_df.shape[0]
+            self._measure(['predict'], scorer.predict_batch, batch)
+            self.rows['predict'] += batch.variants_df.shape[0]
+            self._measure(['dedup', 'write'], calculator.save_batch, batch,
+                          calculator.batch_size)
+            started = time.perf_counter()
+            self._measure(['checkpoint'],
+                          calculator.progress_track.save_checkpoint,
+                          batch.position, batch.input_offsets,
+                          batch.output_rows, batch.output_sizes,
+                          batch.dedup_window, None, batch.output_checksums)
+            batch.timings['checkpoint'] = time.perf_counter() - started
+            for stage in ['dedup', 'write', 'checkpoint']:
+                self.rows[stage] += batch.rows_out
+            for stage in self.stages:
+                self.seconds[stage] += batch.timings.get(stage, 0.0)
+        calculator.output_writers.close()
+        calculator.progress_track.close()
+        return {stage: {'seconds': self.seconds[stage],
+                        'rows': self.rows[stage],
+                        'rows_per_second': self._rate(stage),
+                        'rss_growth_mb': self.rss_growth[stage]}
+                for stage in self.stages}
+
+    def _rate(self, stage):
+        if self.seconds[stage] == 0:
+            return None
+        return self.rows[stage] / self.seconds[stage]
+
+
+def _get_tree_rss(process):
+    """
+    Function to get the RSS of a process and all its children.
+    :param process: psutil Process
+    :return: float, megabytes.
+    """
+    memory_usage = 0
+    for member in [process] + process.children(recursive=True):
+        try:
+            memory_usage += member.memory_info().rss
+        except psutil.NoSuchProcess:
+            continue
+    return memory_usage / 1000000
+
+
+def run_end_to_end(cadd_loc, model_loc, output_loc, batch_size, run_args,
+                   interval=0.1):
+    """
+    Function to run PreComputeCapice.py on the CADD file in its own
+    process.
+    :param interval: seconds between two measurements of the RSS.
+    :return: dict of the seconds, rows per second and peak RSS in MB of the
+    run, the RSS of the run and its worker processes together, polled every
+    interval.
+    """
+    command = [sys.executable,
+               os.path.join(_REPOSITORY, 'PreComputeCapice.py'),
+               '-f', cadd_loc, '-m', model_loc, '-o', output_loc,
+               '-s', str(batch_size)] + run_args.split()
+    start = time.perf_counter()
+    run = subprocess.Popen(command, cwd=_REPOSITORY)
+    process = psutil.Process(run.pid)
+    peak_rss = 0.0
+    while run.poll() is None:
+        try:
+            peak_rss = max(peak_rss, _get_tree_rss(process))
+        except psutil.NoSuchProcess:
+            pass
+        time.sleep(interval)
+    seconds = time.perf_counter() - start
+    if run.returncode != 0:
+        raise subprocess.CalledProcessError(run.returncode, command)
+    return {'command': ' '.join(command[1:]), 'seconds': seconds,
+            'peak_rss_mb': peak_rss}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=_REPOSITORY,
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """
+    Main method of the benchmarks. Generates the synthetic data when it is
+    not there yet, times the stages and a whole run and saves the results.
+    """
+    arguments = BenchmarkArgumentSupporter()
+    output_loc = arguments.get_argument('output')
+    nrows = arguments.get_argument('rows')
+    batch_size = arguments.get_argument('batchsize')
+    estimators = arguments.get_argument('estimators')
+    seed = arguments.get_argument('seed')
+    bgzf = arguments.get_argument('bgzf')
+    run_args = arguments.get_argument('run_args')
+    results_loc = arguments.get_argument('results')
+    if isinstance(output_loc, list):
+        output_loc = str(output_loc[0])
+    if isinstance(nrows, list):
+        nrows = int(nrows[0])
+    if isinstance(batch_size, list):
+        batch_size = int(batch_size[0])
+    if isinstance(estimators, list):
+        estimators = int(estimators[0])
+    if isinstance(seed, list):
+        seed = int(seed[0])
+    if isinstance(run_args, list):
+        run_args = str(run_args[0])
+    if isinstance(results_loc, list):
+        results_loc = str(results_loc[0])
+    output_loc = os.path.abspath(output_loc)
+    data_loc = os.path.join(output_loc, 'data')
+    if not os.path.exists(data_loc):
+        os.makedirs(data_loc)
+    cadd_loc = os.path.join(data_loc, 'synthetic_cadd_{}_{}{}.tsv.gz'.format(
+        nrows, seed, '_bgzf' if bgzf else ''))
+    model_loc = os.path.join(data_loc, 'synthetic_model_{}_{}.dat'.format(
+        estimators, seed))
+    if not os.path.isfile(cadd_loc):
+        print('Generating {}.'.format(cadd_loc))
+        write_cadd_file(cadd_loc + '.tmp', nrows, seed=seed, bgzf=bgzf)
+        os.replace(cadd_loc + '.tmp', cadd_loc)
+    if not os.path.isfile(model_loc):
+        print('Training {}.'.format(model_loc))
+        with contextlib.redirect_stdout(io.StringIO()):
+            write_model(model_loc, cadd_loc, n_estimators=estimators,
+                        seed=seed)
+    timestamp = datetime.now().strftime("%Y_%m_%d_%H%M%S")
+    run_loc = os.path.join(output_loc, 'runs', timestamp)
+    Logger().set_output_dir(os.path.join(run_loc, 'stages'))
+    stages = StageBenchmark(cadd_loc, model_loc,
+                            os.path.join(run_loc, 'stages'),
+                            batch_size).run()
+    end_to_end = run_end_to_end(cadd_loc, model_loc,
+                                os.path.join(run_loc, 'end_to_end'),
+                                batch_size, run_args)
+    end_to_end['rows_per_second'] = nrows / end_to_end['seconds']
+    results = {'timestamp': timestamp,
+               'git_commit': _git_commit(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'pandas': pd.__version__,
+               'xgboost': xgb.__version__,
+               'rows': nrows,
+               'batch_size': batch_size,
+               'estimators': estimators,
+               'seed': seed,
+               'bgzf': bgzf,
+               'stages': stages,
+               'end_to_end': end_to_end}
+    if results_loc is None:
+        results_loc = os.path.join(output_loc,
+                                   'benchmark_{}.json'.format(timestamp))
+    with open(results_loc, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print('{:<12}{:>12}{:>16}{:>14}'.format('stage', 'seconds', 'rows/sec',
+                                            'RSS MB'))
+    for stage, result in stages.items():
+        print('{:<12}{:>12.3f}{:>16.0f}{:>+14.1f}'.format(
+            stage, result['seconds'], result['rows_per_second'] or 0,
+            result['rss_growth_mb']))
+    print('{:<12}{:>12.3f}{:>16.0f}{:>14.1f}'.format(
+        'end to end', end_to_end['seconds'], end_to_end['rows_per_second'],
+        end_to_end['peak_rss_mb']))
+    print('RSS MB is the largest growth over a batch for the stages and the'
+          ' peak for the end to end run.')
+    print('Results saved in: {}'.format(results_loc))
+
+
+if __name__ == '__main__':
+    main()
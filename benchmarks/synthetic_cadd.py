@@ -0,0 +1,218 @@
+import gzip
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from src.output_writer import BgzfOutputWriter
+from src.utilities.impute_preprocess import cadd_vars, cadd_object_vars, \
+    impute_values, impute, preprocess
+
+categorical_levels = {
+    'Ref': ['A', 'C', 'G', 'T'],
+    'Alt': ['A', 'C', 'G', 'T'],
+    'Type': ['SNV'],
+    'oAA': list('ACDEFGHIKLMNPQRSTVWY*'),
+    'nAA': list('ACDEFGHIKLMNPQRSTVWY*'),
+    'Domain': ['ncoils', 'sigp', 'lcompl', 'ndomain', 'hmmpanther'],
+    'Dst2SplType': ['ACCEPTOR', 'DONOR'],
+    'SIFTcat': ['deleterious', 'tolerated'],
+    'PolyPhenCat': ['benign', 'possibly_damaging', 'probably_damaging',
+                    'unknown'],
+    'Segway': ['D', 'F0', 'F1', 'GE0', 'GE1', 'GE2', 'GM0', 'GM1', 'GS',
+               'H3K9me1', 'L0', 'L1', 'R0', 'R1', 'R2', 'R3', 'R4', 'R5',
+               'TF0', 'TF1', 'TF2', 'TSS']
+}
+
+# Annotations of a transcript that only exist for coding transcripts, near
+# splice sites or within dbscSNV, missing together for all other rows.
+coding_columns = ['oAA', 'nAA', 'cDNApos', 'relcDNApos', 'CDSpos',
+                  'relCDSpos', 'protPos', 'relProtPos', 'Domain', 'SIFTcat',
+                  'SIFTval', 'PolyPhenCat', 'PolyPhenVal', 'Grantham']
+splice_columns = ['Dst2Splice', 'Dst2SplType']
+dbscsnv_columns = ['dbscSNV-ada_score', 'dbscSNV-rf_score']
+coding_fraction = 0.03
+splice_fraction = 0.1
+dbscsnv_fraction = 0.02
+
+# Fraction of missing values of the annotations of a position, as far as
+# it differs from the default.
+missing_fractions = {'targetScan': 0.99, 'mirSVR-Score': 0.99,
+                     'mirSVR-E': 0.99, 'mirSVR-Aln': 0.99,
+                     'motifECount': 0.95, 'motifEScoreChng': 0.95,
+                     'motifEHIPos': 0.95, 'tOverlapMotifs': 0.95,
+                     'motifDist': 0.95, 'TFBS': 0.9, 'TFBSPeaks': 0.9,
+                     'TFBSPeaksMax': 0.9, 'GerpRS': 0.6, 'GerpRSpval': 0.6,
+                     'Ref': 0.0, 'Alt': 0.0, 'Type': 0.0, 'Length': 0.0}
+default_missing_fraction = 0.02
+
+def _titles():
+    titles = ['#Chr', 'Pos', 'Ref', 'Alt', 'Type', 'Length', 'AnnoType',
+              'Consequence', 'ConsScore']
+    for column in cadd_vars:
+        if column == 'oAA':
+            titles += ['GeneID', 'FeatureID', 'GeneName', 'CCDS', 'Intron',
+                       'Exon']
+        if column not in titles:
+            titles.append(column)
+    return titles + ['RawScore', 'PHRED']
+
+
+def _numeric_values(rng, column, size):
+    center = impute_values.get(column, 0)
+    values = rng.normal(center, max(abs(center), 1), size)
+    if center >= 0 and 'PhyloP' not in column and column != 'GerpS':
+        values = np.abs(values)
+    return np.round(values, 3)
+
+
+def _column_values(rng, column, size):
+    if column in categorical_levels:
+        return rng.choice(categorical_levels[column], size).astype(object)
+    return _numeric_values(rng, column, size).astype(object)
+
+
+def generate_variants(nrows, chromosome='1', first_position=10000, seed=0):
+    """
+    Function to generate CADD shaped variants of a single chromosome. Every
+    position holds the three possible SNVs, each annotated once for one to
+    three overlapping transcripts. Rows of the same position share the
+    annotations of that position, transcript annotations are only present
+    for the fraction of coding, splice site or dbscSNV rows.
+    :param nrows: the amount of rows to generate.
+    :param chromosome: str, the chromosome of all rows.
+    :param first_position: int, the position to start at.
+    :param seed: seed of the random generator.
+    :return: pandas DataFrame with the columns of a CADD file.
+    """
+    rng = np.random.RandomState(seed)
+    nsites = nrows // 3 + 1
+    transcripts = rng.choice([1, 2, 3], nsites, p=[0.5, 0.3, 0.2])
+    rows_per_site = 3 * transcripts
+    site = np.repeat(np.arange(nsites), rows_per_site)[:nrows]
+    site_offsets = np.arange(nrows) - (np.cumsum(rows_per_site) -
+                                       rows_per_site)[site]
+    allele = site_offsets // transcripts[site]
+    transcript = site_offsets % transcripts[site]
+    positions = first_position + np.cumsum(rng.randint(1, 20, nsites))
+    ref = rng.randint(0, 4, nsites)
+    bases = np.array(categorical_levels['Ref'])
+    variants = {'#Chr': np.repeat(chromosome, nrows),
+                'Pos': positions[site],
+                'Ref': bases[ref[site]],
+                'Alt': bases[(ref[site] + 1 + allele) % 4]}
+    for column in cadd_vars:
+        if column in variants or column in coding_columns + \
+                splice_columns + dbscsnv_columns:
+            continue
+        values = _column_values(rng, column, nsites)
+        missing = rng.rand(nsites) < missing_fractions.get(
+            column, default_missing_fraction)
+        values[missing] = np.nan
+        variants[column] = values[site]
+    transcript_ids = site * 3 + transcript
+    coding = rng.rand(nsites * 3)[transcript_ids] < coding_fraction
+    near_splice = rng.rand(nsites * 3)[transcript_ids] < splice_fraction
+    in_dbscsnv = rng.rand(nsites)[site] < dbscsnv_fraction
+    for columns, present in [(coding_columns, coding),
+                             (splice_columns, near_splice),
+                             (dbscsnv_columns, in_dbscsnv)]:
+        for column in columns:
+            values = _column_values(rng, column, nrows)
+            values[~present] = np.nan
+            variants[column] = values
+    variants['AnnoType'] = np.where(coding, 'CodingTranscript', 'Transcript')
+    variants['Consequence'] = np.where(
+        coding, rng.choice(['NON_SYNONYMOUS', 'SYNONYMOUS', 'STOP_GAINED'],
+                           nrows),
+        rng.choice(['INTRONIC', 'UPSTREAM', 'DOWNSTREAM', 'REGULATORY'],
+                   nrows))
+    variants['ConsScore'] = np.where(coding, 7, 2)
+    variants['GeneID'] = pd.Series(transcript_ids // 3 // 50).map(
+        'ENSG{:011d}'.format).values
+    variants['FeatureID'] = pd.Series(transcript_ids).map(
+        'ENST{:011d}'.format).values
+    variants['GeneName'] = pd.Series(transcript_ids // 3 // 50).map(
+        'GENE{}'.format).values
+    variants['CCDS'] = np.where(coding, pd.Series(transcript_ids).map(
+        'CCDS{}.1'.format).values, np.nan)
+    variants['Intron'] = np.nan
+    variants['Exon'] = np.nan
+    variants['RawScore'] = np.round(rng.normal(0, 1, nrows), 6)
+    variants['PHRED'] = np.round(rng.gamma(2, 3, nrows), 3)
+    return pd.DataFrame(variants)[_titles()]
+
+
+def write_cadd_file(path, nrows, chromosomes=('1', '2', 'X'), seed=0,
+                    bgzf=False, chunk_size=100000):
+    """
+    Function to write a synthetic CADD file, with the rows spread evenly
+    over the chromosomes.
+    :param path: path of the gzipped tsv to write.
+    :param nrows: the total amount of rows.
+    :param chromosomes: the chromosomes to write, in order.
+    :param seed: seed of the random generator.
+    :param bgzf: write the file as BGZF instead of plain gzip.
+    :param chunk_size: the amount of rows to generate at once.
+    """
+    if bgzf:
+        # The writer appends, start from an empty file like gzip.open.
+        if os.path.isfile(path):
+            os.remove(path)
+        output = BgzfOutputWriter(path, 6)
+    else:
+        output = gzip.open(path, 'wb')
+    output.write(b'## CADD GRCh37-v1.4 (c) University of Washington,'
+                 b' Hudson-Alpha Institute for Biotechnology and Berlin'
+                 b' Institute of Health 2013-2018. All rights reserved.\n')
+    output.write(('\t'.join(_titles()) + '\n').encode('utf-8'))
+    per_chromosome = np.diff(np.linspace(0, nrows, len(chromosomes) + 1)
+                             .astype(np.int64))
+    chunk = 0
+    for chromosome, chromosome_rows in zip(chromosomes, per_chromosome):
+        position = 10000
+        for start in range(0, chromosome_rows, chunk_size):
+            variants = generate_variants(
+                min(chunk_size, chromosome_rows - start), chromosome,
+                position, seed + chunk)
+            chunk += 1
+            position = int(variants['Pos'].iloc[-1])
+            variants['dbscSNV-rf_score'] = \
+                variants['dbscSNV-rf_score'].fillna('.')
+            output.write(variants.to_csv(sep='\t', index=False,
+                                         header=False,
+                                         na_rep='NA').encode('utf-8'))
+    output.close()
+
+
+def write_model(path, cadd_path, nrows=20000, n_estimators=100, max_depth=6,
+                seed=0):
+    """
+    Function to train a small XGBoost model on the start of a synthetic
+    CADD file. The features are made by impute and preprocess the same way
+    as for training the CAPICE model, so the feature names match.
+    :param path: path to pickle the model to.
+    :param cadd_path: path of a synthetic CADD file.
+    :param nrows: the amount of rows to train on.
+    :param n_estimators: the amount of trees.
+    :param max_depth: the maximum depth of every tree.
+    :param seed: seed of the random generator.
+    """
+    rng = np.random.RandomState(seed)
+    variants = pd.read_csv(cadd_path, sep='\t', skiprows=1, nrows=nrows,
+                           dtype={column: str for column in cadd_object_vars},
+                           low_memory=False)
+    imputed = impute(variants)
+    processed = preprocess(imputed.copy(), isTrain=True)
+    features = [column for column in processed.columns
+                if column in cadd_vars or
+                column.split('_')[0] in cadd_vars]
+    risk = (processed['verPhyloP'] + 2 * processed['PolyPhenVal'] -
+            processed['SIFTval'] + rng.normal(0, 1, processed.shape[0]))
+    labels = (risk > risk.median()).astype(int)
+    model = xgb.XGBClassifier(n_estimators=n_estimators,
+                              max_depth=max_depth, n_jobs=1,
+                              random_state=seed)
+    model.fit(processed[features].astype(np.float32), labels)
+    with open(path, 'wb') as model_file:
+        pickle.dump(model, model_file)
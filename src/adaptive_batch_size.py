@@ -0,0 +1,72 @@
+from src.logger import Logger
+from src.utilities.utilities import Utilities
+
+
+class AdaptiveBatchSize:
+    """
+    Class to adapt the batch size to a memory budget. After every batch the
+    memory used per row is estimated from the growth of the RSS above the
+    RSS before the first batch. The batch size is then set to the largest
+    size that fits in the budget, but grows at most twofold per batch and
+    stops growing once growing no longer raises the throughput.
+    """
+    # Fraction of the budget to plan for, leaving room for estimation errors.
+    headroom = 0.8
+    # Growth of the rows per second a larger batch has to bring.
+    minimal_gain = 1.05
+
+    def __init__(self, batch_size, memory_limit, min_batch_size=None,
+                 max_batch_size=None):
+        self.log = Logger()
+        self.batch_size = batch_size
+        self.memory_limit = memory_limit
+        self.min_batch_size = min_batch_size or min(1000, batch_size)
+        self.max_batch_size = max_batch_size or batch_size * 64
+        self.baseline = Utilities.get_ram_usage(children=True)
+        self.mb_per_row = None
+        self.ceiling = self.max_batch_size
+        self.previous_size = None
+        self.previous_rate = None
+
+    def update(self, rows, seconds):
+        """
+        Method to pick the size of the next batches after a batch has been
+        processed.
+        :param rows: the amount of rows of the batch.
+        :param seconds: the wall time the batch took.
+        :return: int, the new batch size.
+        """
+        if rows == 0 or seconds <= 0:
+            return self.batch_size
+        usage = Utilities.get_ram_usage(children=True)
+        mb_per_row = max(usage - self.baseline, 0) / rows
+        if self.mb_per_row is None or mb_per_row > self.mb_per_row:
+            self.mb_per_row = mb_per_row
+        else:
+            # Forget an old, higher estimate slowly.
+            self.mb_per_row = 0.9 * self.mb_per_row + 0.1 * mb_per_row
+        rate = rows / seconds
+        if self.previous_size is not None and \
+                self.batch_size > self.previous_size and \
+                rate < self.previous_rate * self.minimal_gain:
+            self.ceiling = self.batch_size
+        fitting = self.max_batch_size
+        if self.mb_per_row > 0:
+            fitting = int((self.memory_limit * self.headroom -
+                           self.baseline) / self.mb_per_row)
+        if usage > self.memory_limit * self.headroom:
+            fitting = min(fitting, self.batch_size // 2)
+        new_size = min(fitting, self.batch_size * 2, self.ceiling)
+        new_size = max(self.min_batch_size,
+                       min(new_size, self.max_batch_size))
+        new_size -= new_size % self.min_batch_size
+        if new_size != self.batch_size:
+            self.log.log('Memory usage {:.0f} MB of {} MB, {:.4f} MB per'
+                         ' row at {:.0f} rows per second, changing the'
+                         ' batch size from {} to {}.', usage,
+                         self.memory_limit, self.mb_per_row, rate,
+                         self.batch_size, new_size)
+            self.previous_size = self.batch_size
+            self.previous_rate = rate
+            self.batch_size = new_size
+        return self.batch_size
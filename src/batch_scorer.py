@@ -0,0 +1,202 @@
+import inspect
+import os
+import pickle
+import time
+import numpy as np
+import xgboost as xgb
+from src.logger import Logger
+from src.prediction_cache import PredictionCache
+from src.utilities.impute_preprocess import impute, PreprocessPlan
+
+
+class ScoringModel:
+    """
+    Class to predict with a single CAPICE model. Predictions are made with
+    the raw booster of the model, on a DMatrix built straight from the
+    float32 feature matrix. With a cache size, rows with the same features
+    are scored only once.
+    """
+
+    def __init__(self, model_loc, column='prediction', threads=None,
+                 cache_size=0):
+        self.log = Logger()
+        self.column = column
+        self.model = None
+        self.model_feats = None
+        self.booster = None
+        self.missing = np.nan
+        self.predict_args = {}
+        self.threads = threads
+        self.prediction_cache = None
+        if cache_size > 0:
+            self.prediction_cache = PredictionCache(cache_size)
+        self.load_model(model_loc)
+
+    def load_model(self, model_loc):
+        try:
+            self.model = pickle.load(open(model_loc, "rb")).best_estimator_
+        except AttributeError:
+            self.model = pickle.load(open(model_loc, "rb"))
+        self.booster = self.model.get_booster()
+        self.model_feats = self.booster.feature_names
+        if getattr(self.model, 'missing', None) is not None:
+            self.missing = self.model.missing
+        self.predict_args = self._get_predict_args()
+        if self.threads is None:
+            self.threads = getattr(self.model, 'n_jobs', None)
+        if self.threads is not None:
+            self.booster.set_param('nthread', self.threads)
+
+    def _get_predict_args(self):
+        """
+        Method to predict with the trees up to the best iteration of a model
+        trained with early stopping, like predict_proba. Boosters that
+        support it get an iteration_range, older ones an ntree_limit, which
+        newer versions of XGBoost deprecate or reject.
+        :return: dict of keyword arguments for the predict of the booster.
+        """
+        if 'iteration_range' in inspect.signature(
+                self.booster.predict).parameters:
+            best_iteration = getattr(self.model, 'best_iteration', None)
+            if best_iteration is not None:
+                return {'iteration_range': (0, int(best_iteration) + 1)}
+            return {}
+        ntree_limit = getattr(self.model, 'best_ntree_limit', 0) or 0
+        if ntree_limit > 0:
+            return {'ntree_limit': ntree_limit}
+        return {}
+
+    def score(self, feature_matrix):
+        """
+        Method to predict a feature matrix through the prediction cache,
+        when there is one.
+        :param feature_matrix: numpy array with a column per model feature.
+        :return: numpy array of float32
+        """
+        if self.prediction_cache is None:
+            return self.predict(feature_matrix)
+        scored = self.prediction_cache.scored
+        predictions = self.prediction_cache.predict(feature_matrix,
+                                                    self.predict)
+        self.log.count('rows not scored thanks to the prediction cache',
+                       feature_matrix.shape[0] -
+                       (self.prediction_cache.scored - scored))
+        self._log_cache_statistics()
+        return predictions
+
+    def predict(self, feature_matrix, output_margin=False):
+        """
+        Method to predict the positive class of a preprocessed feature
+        matrix, giving the same result as predict_proba(...)[:, 1].
+        :param feature_matrix: numpy array with a column per model feature.
+        :param output_margin: return the untransformed margin instead of the
+        probability.
+        :return: numpy array of float32
+        """
+        dmatrix = xgb.DMatrix(
+            np.ascontiguousarray(feature_matrix, dtype=np.float32),
+            missing=self.missing,
+            feature_names=self.model_feats,
+            nthread=self.threads)
+        return self.booster.predict(dmatrix, output_margin=output_margin,
+                                    **self.predict_args)
+
+    def _log_cache_statistics(self):
+        statistics = self.prediction_cache.get_statistics()
+        self.log.debug('Prediction cache of {}: scored {} of {} rows, {}'
+                       ' unique rows found in the cache, {:.1%} of the rows'
+                       ' not scored.', self.column, statistics['scored'],
+                       statistics['rows'], statistics['hits'],
+                       statistics['saved'])
+
+
+class BatchScorer:
+    """
+    Class to impute, preprocess and predict a batch of CADD variants with
+    one or more CAPICE models. A batch is imputed once and preprocessed
+    once per distinct feature layout, models with the same features
+    predict on the same feature matrix. Every model writes its own
+    prediction column. Holds no file handles, so it can be created once in
+    every worker process.
+    """
+
+    def __init__(self, model_locs, features_of_interest, threads=None,
+                 cache_size=0):
+        self.log = Logger()
+        if isinstance(model_locs, str):
+            model_locs = [model_locs]
+        self.models = [
+            ScoringModel(model_loc, column, threads, cache_size)
+            for model_loc, column in zip(
+                model_locs, self.get_prediction_columns(model_locs))]
+        # Tuples of the PreprocessPlan of a feature layout and the models
+        # predicting on it.
+        self.layouts = []
+        plans = {}
+        for model in self.models:
+            layout = tuple(model.model_feats)
+            if layout not in plans:
+                plans[layout] = (PreprocessPlan(model.model_feats), [])
+                self.layouts.append(plans[layout])
+            plans[layout][1].append(model)
+        self.model = self.models[0].model
+        self.model_feats = self.models[0].model_feats
+        self.preprocess_plan = self.layouts[0][0]
+        self.features_of_interest = features_of_interest
+
+    @staticmethod
+    def get_prediction_columns(model_locs):
+        """
+        Method to name the prediction column of every model. A single model
+        writes to prediction, several models to prediction_ followed by the
+        name of their model file.
+        :param model_locs: list of paths to the pickled models.
+        :return: list of str
+        """
+        if len(model_locs) == 1:
+            return ['prediction']
+        columns = []
+        for model_loc in model_locs:
+            column = 'prediction_{}'.format(
+                os.path.basename(model_loc).split('.')[0])
+            if column in columns:
+                column = '{}_{}'.format(column, len(columns) + 1)
+            columns.append(column)
+        return columns
+
+    def score_batch(self, batch):
+        self.impute_preprocess_batch(batch)
+        return self.predict_batch(batch)
+
+    def impute_preprocess_batch(self, batch):
+        started = time.perf_counter()
+        batch.variants_df = impute(batch.variants_df, inplace=True)
+        imputed = time.perf_counter()
+        batch.feature_matrices = [plan.transform(batch.variants_df)
+                                  for plan, _ in self.layouts]
+        batch.timings['impute'] = imputed - started
+        batch.timings['preprocess'] = time.perf_counter() - imputed
+        return batch
+
+    def predict_batch(self, batch):
+        started = time.perf_counter()
+        variants_df = batch.variants_df
+        for (_, models), feature_matrix in zip(self.layouts,
+                                               batch.feature_matrices):
+            for model in models:
+                variants_df[model.column] = model.score(feature_matrix)
+        batch.variants_df = variants_df[self.features_of_interest]
+        batch.feature_matrices = None
+        batch.timings['predict'] = time.perf_counter() - started
+        return batch
+
+    def predict(self, feature_matrix, output_margin=False):
+        """
+        Method to predict a feature matrix of the layout of the first model
+        with the first model.
+        :param feature_matrix: numpy array with a column per model feature.
+        :param output_margin: return the untransformed margin instead of the
+        probability.
+        :return: numpy array of float32
+        """
+        return self.models[0].predict(feature_matrix, output_margin)
@@ -0,0 +1,361 @@
+import gzip
+import io
+import os
+import time
+import numpy as np
+import pandas as pd
+from src.utilities.impute_preprocess import cadd_vars, cadd_object_vars
+from src.utilities.bgzf import BgzfReader, is_bgzf
+from src.utilities.tabix import TabixIndex
+
+# Uncompressed bytes to read at once from a plain gzip input.
+_GZIP_CHUNK_SIZE = 1 << 20
+
+
+class CaddBatch:
+    """
+    Class to carry a single batch of CADD variants through the scoring
+    stages, together with the file positions it was read between and the
+    time every stage spent on it.
+    """
+
+    def __init__(self, variants_df, skip_rows, position):
+        self.variants_df = variants_df
+        self.skip_rows = skip_rows
+        self.position = position
+        self.input_offsets = None
+        self.feature_matrices = None
+        self.output_rows = None
+        self.output_sizes = None
+        self.output_checksums = None
+        self.dedup_window = None
+        self.compressed_offset = None
+        self.rows_out = None
+        self.timings = {}
+        self.batch_size = None
+
+
+class _GzipSource:
+    """
+    Class to read a plain gzip input in chunks. Resuming seeks to an
+    uncompressed offset, which still decompresses everything before it but
+    skips splitting and counting the lines.
+    """
+
+    def __init__(self, filepath):
+        self.file = gzip.open(filepath, 'rb')
+
+    def seek(self, input_offsets):
+        self.file.seek(input_offsets['uncompressed'])
+
+    def next_chunk(self):
+        return self.file.read(_GZIP_CHUNK_SIZE)
+
+    def virtual_offset(self, chunk_position):
+        return None
+
+    def compressed_offset(self):
+        return self.file.fileobj.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class _BgzfSource:
+    """
+    Class to read a BGZF input block by block. Resuming seeks straight to
+    the virtual offset of the checkpoint. With a stop offset the input
+    appears to end there.
+    """
+
+    def __init__(self, filepath):
+        self.reader = BgzfReader(filepath, cache_size=0)
+        self.block_offset = 0
+        self.next_offset = 0
+        self.skip = 0
+        self.stop = None
+
+    def seek(self, input_offsets):
+        virtual_offset = input_offsets['virtual']
+        self.next_offset = virtual_offset >> 16
+        self.skip = virtual_offset & 0xffff
+
+    def next_chunk(self):
+        if self.stop is not None and self.next_offset > self.stop >> 16:
+            return b''
+        self.block_offset = self.next_offset
+        data, self.next_offset = self.reader.read_block(self.block_offset)
+        if data is None:
+            return b''
+        if self.stop is not None and self.block_offset == self.stop >> 16:
+            return data[:self.stop & 0xffff]
+        return data
+
+    def virtual_offset(self, chunk_position):
+        return (self.block_offset << 16) | chunk_position
+
+    def compressed_offset(self):
+        return self.block_offset
+
+    def close(self):
+        self.reader.close()
+
+
+class CaddReader:
+    """
+    Class to stream the CADD file in consecutive batches. The gzipped archive
+    is opened only once, every batch continues where the previous one
+    stopped. After every batch the reader knows the amount of lines read,
+    the uncompressed offset and, for BGZF input, the virtual offset, so a
+    resumed run can seek straight back to that point.
+    With a region or shard filter only the variants selected by it are
+    handed on, batches without any are skipped. A BGZF input with a tabix
+    index is not read as a whole, the reader seeks from region to region
+    instead. An input range limits reading a BGZF input to the lines between
+    two virtual offsets.
+    """
+
+    def __init__(self, filepath, titles, batch_size, start=None,
+                 key_columns=None, input_offsets=None, region_filter=None,
+                 shard_filter=None, input_range=None):
+        self.filepath = filepath
+        self.titles = titles
+        self.batch_size = batch_size
+        self.start = start
+        self.input_offsets = input_offsets
+        self.usecols = None
+        self.dtypes = None
+        self.na_values = None
+        if key_columns is not None:
+            self._set_columns(key_columns)
+        self.position = 0
+        self.uncompressed_offset = 0
+        self.source = None
+        self.chunk = b''
+        self.chunk_position = 0
+        self.newlines = np.array([], dtype=np.int64)
+        self.newline_index = 0
+        self.exhausted = False
+        self.region_filter = region_filter
+        self.shard_filter = shard_filter
+        self.input_range = input_range
+        self.spans = None
+        self.span_index = 0
+        self.chromosome_ranks = {}
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.exhausted:
+            raise StopIteration
+        started = time.perf_counter()
+        if self.source is None:
+            self._open()
+        skip_rows = self.position
+        while True:
+            if self.spans is not None and \
+                    self.span_index >= len(self.spans):
+                self._stop()
+            pieces, nlines = self._take_lines(self.batch_size)
+            if nlines == 0:
+                self._stop()
+            self.position += nlines
+            variants_df = self._parse(b''.join(pieces))
+            if self.region_filter is None and self.shard_filter is None:
+                break
+            if self.spans is not None and variants_df.shape[0] > 0:
+                self._advance_spans(str(variants_df['#Chr'].iat[-1]),
+                                    int(variants_df['Pos'].iat[-1]))
+            selected = np.ones(variants_df.shape[0], dtype=bool)
+            for row_filter in [self.region_filter, self.shard_filter]:
+                if row_filter is not None:
+                    selected &= row_filter.select(variants_df)
+            variants_df = variants_df[selected].reset_index(drop=True)
+            if variants_df.shape[0] > 0:
+                break
+        batch = CaddBatch(variants_df, skip_rows, self.position)
+        batch.input_offsets = self.get_offsets()
+        batch.batch_size = self.batch_size
+        batch.compressed_offset = int(self.source.compressed_offset())
+        batch.timings['read'] = time.perf_counter() - started
+        return batch
+
+    def _stop(self):
+        self.exhausted = True
+        self.close()
+        raise StopIteration
+
+    def _set_columns(self, key_columns):
+        """
+        Method to only parse the columns the model and the output need,
+        with declared dtypes. Numeric CADD columns are parsed as float32 with
+        '.' parsed as missing, next to the default NA markers.
+        :param key_columns: list of the columns needed for the output.
+        """
+        self.usecols = []
+        self.dtypes = {}
+        self.na_values = {}
+        for column in key_columns + cadd_vars:
+            if column not in self.titles or column in self.dtypes:
+                continue
+            self.usecols.append(column)
+            if column == 'Pos':
+                self.dtypes[column] = np.int64
+            elif column in cadd_vars and column not in cadd_object_vars:
+                self.dtypes[column] = np.float32
+                self.na_values[column] = ['.']
+            else:
+                self.dtypes[column] = str
+
+    def _open(self):
+        if is_bgzf(self.filepath):
+            self.source = _BgzfSource(self.filepath)
+        else:
+            self.source = _GzipSource(self.filepath)
+        range_start = None
+        if self.input_range is not None:
+            range_start, self.source.stop = self.input_range
+        if self.start and self.input_offsets is not None and (
+                self.input_offsets.get('virtual') is not None or
+                isinstance(self.source, _GzipSource)):
+            self.source.seek(self.input_offsets)
+            self.position = self.start
+            self.uncompressed_offset = self.input_offsets['uncompressed']
+            self._next_chunk()
+        elif self.start:
+            _, self.position = self._take_lines(self.start)
+        elif range_start is not None:
+            self.source.seek({'virtual': range_start})
+            self._next_chunk()
+        else:
+            self._skip_comment_lines()
+        index_path = TabixIndex.index_path(self.filepath)
+        if self.region_filter is not None and \
+                isinstance(self.source, _BgzfSource) and \
+                os.path.isfile(index_path):
+            self._set_spans(TabixIndex(index_path))
+
+    def _set_spans(self, index):
+        """
+        Method to look up where every region starts in the input. A resumed
+        run continues with the last region starting before the checkpoint.
+        :param index: TabixIndex of the input.
+        """
+        self.chromosome_ranks = {name: rank for rank, name in
+                                 enumerate(index.names)}
+        self.spans = [(name, start, end, index.get_offset(name, start))
+                      for name, start, end in
+                      self.region_filter.spans(index.names)]
+        current_offset = self.get_offsets()['virtual']
+        for span_index, (_, _, _, offset) in enumerate(self.spans):
+            if offset is not None and offset <= current_offset:
+                self.span_index = span_index
+        self._advance_spans(None, 0)
+
+    def _advance_spans(self, chromosome, position):
+        """
+        Method to move on to the first region not read yet, seeking to
+        where it starts when that is further on in the input.
+        :param chromosome: str, chromosome of the last variant read, None
+        before anything is read.
+        :param position: int, position of the last variant read.
+        """
+        rank = self.chromosome_ranks.get(chromosome, len(
+            self.chromosome_ranks)) if chromosome is not None else -1
+        while self.span_index < len(self.spans):
+            name, _, end, offset = self.spans[self.span_index]
+            span_rank = self.chromosome_ranks[name]
+            if offset is None or rank > span_rank or (
+                    rank == span_rank and position > end):
+                self.span_index += 1
+                continue
+            if offset > self.get_offsets()['virtual']:
+                # The uncompressed offset no longer follows after a seek,
+                # resuming BGZF input only needs the virtual offset.
+                self.source.seek({'virtual': offset})
+                self._next_chunk()
+            return
+
+    def _skip_comment_lines(self):
+        while self._current_chunk() and \
+                self.chunk[self.chunk_position:self.chunk_position + 1] \
+                == b'#':
+            _, nlines = self._take_lines(1)
+            self.position += nlines
+
+    def _next_chunk(self):
+        self.chunk = self.source.next_chunk()
+        self.chunk_position = 0
+        if isinstance(self.source, _BgzfSource) and self.source.skip > 0:
+            self.chunk_position = self.source.skip
+            self.source.skip = 0
+        self.newlines = np.flatnonzero(
+            np.frombuffer(self.chunk, dtype=np.uint8) == ord('\n'))
+        self.newline_index = np.searchsorted(self.newlines,
+                                             self.chunk_position)
+        return len(self.chunk) > 0
+
+    def _current_chunk(self):
+        if self.chunk_position >= len(self.chunk):
+            return self._next_chunk()
+        return True
+
+    def _take_lines(self, nlines):
+        """
+        Method to take the next nlines lines from the input.
+        :param nlines: the amount of lines to take.
+        :return: tuple of a list of bytes holding the lines and the amount of
+        lines taken, which is lower than nlines at the end of the input.
+        """
+        pieces = []
+        taken = 0
+        while taken < nlines and self._current_chunk():
+            available = len(self.newlines) - self.newline_index
+            wanted = nlines - taken
+            if available >= wanted:
+                self.newline_index += wanted
+                end = self.newlines[self.newline_index - 1] + 1
+                taken += wanted
+            else:
+                self.newline_index = len(self.newlines)
+                end = len(self.chunk)
+                taken += int(available)
+            end = int(end)
+            pieces.append(self.chunk[self.chunk_position:end])
+            self.uncompressed_offset += end - self.chunk_position
+            self.chunk_position = end
+        if taken < nlines and len(pieces) > 0 and \
+                not pieces[-1].endswith(b'\n'):
+            # The last line of the input has no line ending.
+            taken += 1
+        return pieces, taken
+
+    def _parse(self, data):
+        return pd.read_csv(io.BytesIO(data), sep='\t',
+                           names=self.titles, usecols=self.usecols,
+                           dtype=self.dtypes, na_values=self.na_values,
+                           comment='#', low_memory=False)
+
+    def get_position(self):
+        return self.position
+
+    def get_offsets(self):
+        """
+        Method to get the offsets of the first unread byte of the input.
+        :return: dict with the uncompressed offset and, for BGZF input, the
+        virtual offset.
+        """
+        virtual_offset = None
+        if self.chunk_position < len(self.chunk):
+            virtual_offset = self.source.virtual_offset(
+                int(self.chunk_position))
+        elif isinstance(self.source, _BgzfSource):
+            virtual_offset = self.source.next_offset << 16
+        return {'uncompressed': int(self.uncompressed_offset),
+                'virtual': virtual_offset}
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+            self.source = None
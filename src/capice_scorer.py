@@ -0,0 +1,93 @@
+import threading
+import numpy as np
+import pandas as pd
+from src.batch_scorer import BatchScorer
+from src.utilities.impute_preprocess import impute, cadd_vars, \
+    cadd_object_vars
+
+
+class CapiceScorer:
+    """
+    Class to score CADD variants in memory, to use CAPICE as a library.
+    The models and their preprocessing plans are loaded once, after that
+    scoring reads or writes no files: there is no output directory,
+    progression or log file. Scoring is safe from many threads: every call
+    imputes and encodes its own copy of the variants, and only the
+    predictions of a single model are made one call at a time, since a
+    booster can not predict from several threads at once.
+    """
+
+    def __init__(self, model_locs, threads=None):
+        """
+        :param model_locs: path to a pickled CAPICE model, or a list of them.
+        :param threads: threads every model predicts with.
+        """
+        self.scorer = BatchScorer(model_locs, None, threads)
+        self.prediction_columns = [model.column for model in
+                                   self.scorer.models]
+        self.locks = {model.column: threading.Lock() for model in
+                      self.scorer.models}
+
+    def score(self, variants, columns=None):
+        """
+        Method to score CADD variants.
+        :param variants: pandas DataFrame, pyarrow RecordBatch or Table, or
+        NumPy structured array, with the CADD columns named as in the header
+        of the CADD file. Numeric columns may hold '.' for missing values.
+        :param columns: names of the columns of a NumPy array without field
+        names.
+        :return: numpy array of float32 with a prediction per variant, or,
+        with several models, a column per model in the order of
+        prediction_columns. Variants without any CADD annotation are not
+        scored and get NaN.
+        """
+        variants_df = self._to_frame(variants, columns)
+        predictions = np.full((variants_df.shape[0],
+                               len(self.prediction_columns)), np.nan,
+                              dtype=np.float32)
+        if variants_df.shape[0] > 0:
+            imputed_df = impute(variants_df, inplace=True)
+            rows = imputed_df.index.values
+            for plan, models in self.scorer.layouts:
+                feature_matrix = plan.transform(imputed_df)
+                for model in models:
+                    with self.locks[model.column]:
+                        scores = model.predict(feature_matrix)
+                    predictions[rows, self.prediction_columns.index(
+                        model.column)] = scores
+        if len(self.prediction_columns) == 1:
+            return predictions[:, 0]
+        return predictions
+
+    @staticmethod
+    def _to_frame(variants, columns=None):
+        """
+        Method to copy the CADD columns of the variants into a DataFrame with
+        the dtypes CaddReader parses them with.
+        :return: pandas DataFrame with a RangeIndex.
+        """
+        if hasattr(variants, 'to_pandas'):
+            # A pyarrow RecordBatch or Table.
+            variants = variants.to_pandas()
+        elif isinstance(variants, np.ndarray):
+            if variants.dtype.names is None and columns is None:
+                raise ValueError('The columns of a NumPy array without field'
+                                 ' names have to be given.')
+            variants = pd.DataFrame(variants, columns=columns)
+        elif not isinstance(variants, pd.DataFrame):
+            raise TypeError('Can not score variants of type {}, give a'
+                            ' DataFrame, NumPy or Arrow record batch.'.format(
+                                type(variants).__name__))
+        missing = [column for column in cadd_vars if column not in variants]
+        if len(missing) > 0:
+            raise ValueError('The variants miss the CADD columns {}.'.format(
+                missing))
+        variants_df = {}
+        for column in cadd_vars:
+            if column in cadd_object_vars:
+                variants_df[column] = variants[column].values.astype(object)
+            else:
+                variants_df[column] = pd.to_numeric(
+                    variants[column], errors='coerce').values.astype(
+                    np.float32)
+        return pd.DataFrame(variants_df, columns=cadd_vars)
@@ -30,11 +30,14 @@ class ArgumentSupporter:
 
         required.add_argument('-m',
                               '--model',
-                              nargs=1,
+                              nargs='+',
                               type=str,
                               required=True,
                               help='The location of the CAPICE'
-                                   ' model pickled file.')
+                                   ' model pickled file. Give several to'
+                                   ' score all of them in one pass, with a'
+                                   ' prediction_<model file name> column'
+                                   ' per model.')
 
         required.add_argument('-o',
                               '--output',
@@ -53,6 +56,159 @@ class ArgumentSupporter:
                               help='The chunksize for the script to'
                                    ' read the gzipped archive.'
                                    ' (Default: 10000)')
+
+        optional.add_argument('-p',
+                              '--pipeline',
+                              action='store_true',
+                              required=False,
+                              help='Run reading, preprocessing, predicting'
+                                   ' and writing concurrently in separate'
+                                   ' threads.')
+
+        optional.add_argument('-w',
+                              '--workers',
+                              nargs=1,
+                              type=int,
+                              default=1,
+                              required=False,
+                              help='The amount of worker processes to score'
+                                   ' batches on. Output is still written in'
+                                   ' input order. (Default: 1)')
+
+        optional.add_argument('-l',
+                              '--compression-level',
+                              nargs=1,
+                              type=int,
+                              default=6,
+                              required=False,
+                              help='The gzip compression level of the output'
+                                   ' files, 1 (fast) to 9 (small).'
+                                   ' (Default: 6)')
+
+        optional.add_argument('-b',
+                              '--bgzf',
+                              action='store_true',
+                              required=False,
+                              help='Write the output files as BGZF (block'
+                                   ' gzip), which can be indexed.')
+
+        optional.add_argument('-t',
+                              '--compression-threads',
+                              nargs=1,
+                              type=int,
+                              default=1,
+                              required=False,
+                              help='The amount of threads to compress BGZF'
+                                   ' blocks with, only used with -b / --bgzf.'
+                                   ' Plain gzip output is compressed in a'
+                                   ' single thread. (Default: 1)')
+
+        optional.add_argument('-F',
+                              '--output-format',
+                              nargs=1,
+                              type=str,
+                              choices=['tsv', 'parquet', 'both'],
+                              default='tsv',
+                              required=False,
+                              help='Write the output as gzipped tsv, as'
+                                   ' columnar Parquet or as both.'
+                                   ' (Default: tsv)')
+
+        optional.add_argument('-n',
+                              '--model-threads',
+                              nargs=1,
+                              type=int,
+                              default=None,
+                              required=False,
+                              help='The amount of threads XGBoost predicts'
+                                   ' a batch with, per worker process.'
+                                   ' (Default: the n_jobs of the model)')
+
+        optional.add_argument('-c',
+                              '--prediction-cache',
+                              nargs=1,
+                              type=int,
+                              default=0,
+                              required=False,
+                              help='The amount of feature rows to remember'
+                                   ' the prediction of, so rows with the same'
+                                   ' features are scored only once. 0'
+                                   ' disables the cache. (Default: 0)')
+
+        optional.add_argument('-M',
+                              '--metrics-format',
+                              nargs=1,
+                              type=str,
+                              choices=['jsonl', 'prometheus', 'both'],
+                              default='jsonl',
+                              required=False,
+                              help='Write the metrics of every batch as'
+                                   ' JSON lines to metrics.jsonl, as a'
+                                   ' Prometheus textfile'
+                                   ' capice_metrics.prom or both, in'
+                                   ' log_output. (Default: jsonl)')
+
+        optional.add_argument('-L',
+                              '--log-level',
+                              nargs=1,
+                              type=str,
+                              choices=['debug', 'info', 'warning', 'error'],
+                              default='info',
+                              required=False,
+                              help='The lowest level of the messages to'
+                                   ' write to the logfile. (Default: info)')
+
+        optional.add_argument('--memory-limit',
+                              nargs=1,
+                              type=int,
+                              default=None,
+                              required=False,
+                              help='The memory budget in MB. The batch size'
+                                   ' then starts at --batchsize and is grown'
+                                   ' or shrunk to the fastest size that fits'
+                                   ' in the budget.')
+
+        optional.add_argument('--regions',
+                              nargs='+',
+                              type=str,
+                              default=None,
+                              required=False,
+                              help='Only score the variants within these'
+                                   ' regions, given as BED files or as'
+                                   ' chr:start-end (1-based, inclusive).'
+                                   ' A BGZF input with a tabix index (.tbi)'
+                                   ' is read from region to region.')
+
+        optional.add_argument('--chromosomes',
+                              nargs='+',
+                              type=str,
+                              default=None,
+                              required=False,
+                              help='Only score the variants on these'
+                                   ' chromosomes.')
+
+        optional.add_argument('--shard',
+                              nargs=1,
+                              type=str,
+                              default=None,
+                              required=False,
+                              help='Only score shard i of N, given as i/N.'
+                                   ' Every shard writes to its own'
+                                   ' shard_i_of_N directory within the'
+                                   ' output directory, merge them with'
+                                   ' FinalizeCapice.py once all are done.')
+
+        optional.add_argument('--profile',
+                              nargs=1,
+                              type=int,
+                              default=None,
+                              required=False,
+                              help='Profile the first N batches with'
+                                   ' cProfile and tracemalloc and stop. The'
+                                   ' hotspots, top allocation sites and time'
+                                   ' per stage are written to log_output,'
+                                   ' the run can be continued without'
+                                   ' --profile afterwards.')
         return parser
 
     def get_argument(self, argument_key):
@@ -67,3 +223,170 @@ class ArgumentSupporter:
             value = None
 
         return value
+
+
+class FinalizeArgumentSupporter(ArgumentSupporter):
+    """
+    Class to handle the given command line input of FinalizeCapice.py.
+    Type python3 FinalizeCapice.py --help for more details.
+    """
+
+    @staticmethod
+    def _create_argument_parser():
+        parser = argparse.ArgumentParser(
+            prog="FinalizeCapice.py",
+            description="Python script to index the pre-computed CAPICE"
+                        " output files for fast lookups.")
+        required = parser.add_argument_group("Required arguments")
+        optional = parser.add_argument_group("Optional arguments")
+
+        required.add_argument('-o',
+                              '--output',
+                              nargs=1,
+                              type=str,
+                              required=True,
+                              help='The output directory of'
+                                   ' PreComputeCapice.py.')
+
+        optional.add_argument('-l',
+                              '--compression-level',
+                              nargs=1,
+                              type=int,
+                              default=6,
+                              required=False,
+                              help='The compression level used when gzip'
+                                   ' output has to be rewritten as BGZF.'
+                                   ' (Default: 6)')
+
+        optional.add_argument('-s',
+                              '--sort',
+                              action='store_true',
+                              required=False,
+                              help='Sort every chromosome output file on'
+                                   ' position, alleles and transcript and'
+                                   ' drop exact duplicate lines before'
+                                   ' indexing it.')
+
+        optional.add_argument('-b',
+                              '--memory-budget',
+                              nargs=1,
+                              type=int,
+                              default=1000,
+                              required=False,
+                              help='The memory to sort with in MB, parts of'
+                                   ' a file that do not fit are sorted'
+                                   ' separately and merged from disk.'
+                                   ' (Default: 1000)')
+        return parser
+
+
+class LookupArgumentSupporter(ArgumentSupporter):
+    """
+    Class to handle the given command line input of LookupCapice.py.
+    Type python3 LookupCapice.py --help for more details.
+    """
+
+    @staticmethod
+    def _create_argument_parser():
+        parser = argparse.ArgumentParser(
+            prog="LookupCapice.py",
+            description="Python script to look up pre-computed CAPICE"
+                        " scores of a variant or a region.")
+        required = parser.add_argument_group("Required arguments")
+        optional = parser.add_argument_group("Optional arguments")
+
+        required.add_argument('-o',
+                              '--output',
+                              nargs=1,
+                              type=str,
+                              required=True,
+                              help='The finalized output directory of'
+                                   ' PreComputeCapice.py.')
+
+        required.add_argument('-c',
+                              '--chromosome',
+                              nargs=1,
+                              type=str,
+                              required=True,
+                              help='The chromosome, without chr prefix.')
+
+        required.add_argument('-p',
+                              '--position',
+                              nargs=1,
+                              type=int,
+                              required=True,
+                              help='The position, or the start of the'
+                                   ' region when --end is given.')
+
+        optional.add_argument('-e',
+                              '--end',
+                              nargs=1,
+                              type=int,
+                              required=False,
+                              help='The end of the region, inclusive.')
+
+        optional.add_argument('-r',
+                              '--ref',
+                              nargs=1,
+                              type=str,
+                              required=False,
+                              help='The reference allele.')
+
+        optional.add_argument('-a',
+                              '--alt',
+                              nargs=1,
+                              type=str,
+                              required=False,
+                              help='The alternative allele.')
+        return parser
+
+
+class AnnotateArgumentSupporter(ArgumentSupporter):
+    """
+    Class to handle the given command line input of AnnotateCapice.py.
+    Type python3 AnnotateCapice.py --help for more details.
+    """
+
+    @staticmethod
+    def _create_argument_parser():
+        parser = argparse.ArgumentParser(
+            prog="AnnotateCapice.py",
+            description="Python script to annotate a VCF with pre-computed"
+                        " CAPICE scores.")
+        required = parser.add_argument_group("Required arguments")
+        optional = parser.add_argument_group("Optional arguments")
+
+        required.add_argument('-o',
+                              '--output',
+                              nargs=1,
+                              type=str,
+                              required=True,
+                              help='The finalized output directory of'
+                                   ' PreComputeCapice.py.')
+
+        required.add_argument('-i',
+                              '--input',
+                              nargs=1,
+                              type=str,
+                              required=True,
+                              help='The VCF to annotate, sorted by position'
+                                   ' within every chromosome.')
+
+        required.add_argument('-a',
+                              '--annotated',
+                              nargs=1,
+                              type=str,
+                              required=True,
+                              help='The location to write the annotated VCF'
+                                   ' to, written as BGZF when it ends with'
+                                   ' .gz.')
+
+        optional.add_argument('-l',
+                              '--compression-level',
+                              nargs=1,
+                              type=int,
+                              default=6,
+                              required=False,
+                              help='The compression level of a gzipped'
+                                   ' annotated VCF. (Default: 6)')
+        return parser
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+
+class VariantDeduplicator:
+    """
+    Class to drop variants that were already written, also across batch
+    boundaries. Every variant is reduced to a 64 bit hash of its key
+    columns. Per chromosome the hashes of the variants written within the
+    last `window` positions are kept, which, as CADD is sorted on position,
+    holds every variant a later duplicate can still be compared to while
+    memory stays bounded by the amount of variants per position.
+    """
+    key_columns = ['#Chr', 'Pos', 'Ref', 'Alt', 'GeneID', 'CCDS',
+                   'FeatureID']
+
+    def __init__(self, window=0, state=None):
+        self.window = window
+        self.windows = {}
+        if state is not None:
+            self.set_state(state)
+
+    def hash_variants(self, variants_df):
+        """
+        Method to hash the key columns of every variant. Columns are
+        normalized first, so the hashes do not depend on the dtypes the
+        variants were read with.
+        :param variants_df: pandas DataFrame
+        :return: numpy array of uint64
+        """
+        keys = {}
+        for column in self.key_columns:
+            if column == 'Pos':
+                keys[column] = variants_df[column].astype(np.int64)
+            else:
+                keys[column] = variants_df[column].astype(str)
+        return pd.util.hash_pandas_object(pd.DataFrame(keys),
+                                          index=False).values
+
+    def has_window(self, chromosome):
+        return str(chromosome) in self.windows
+
+    def drop_duplicates(self, chromosome, variants_df):
+        """
+        Method to drop the variants of a single chromosome that occur
+        earlier in the same frame or in the window of variants written
+        before.
+        :param chromosome: str, the chromosome of all variants.
+        :param variants_df: pandas DataFrame
+        :return: pandas DataFrame of the variants not seen before.
+        """
+        hashes = self.hash_variants(variants_df)
+        positions = variants_df['Pos'].values.astype(np.int64)
+        window_positions, window_hashes = self._get_window(chromosome)
+        keep = ~(pd.Series(hashes).duplicated().values |
+                 np.isin(hashes, window_hashes))
+        self._set_window(chromosome,
+                         np.concatenate([window_positions, positions[keep]]),
+                         np.concatenate([window_hashes, hashes[keep]]))
+        if keep.all():
+            return variants_df
+        return variants_df[keep]
+
+    def add(self, chromosome, variants_df):
+        """
+        Method to add variants that were written earlier to the window,
+        without deduplicating them.
+        :param chromosome: str, the chromosome of all variants.
+        :param variants_df: pandas DataFrame
+        """
+        positions = variants_df['Pos'].values.astype(np.int64)
+        window_positions, window_hashes = self._get_window(chromosome)
+        self._set_window(chromosome,
+                         np.concatenate([window_positions, positions]),
+                         np.concatenate([window_hashes,
+                                         self.hash_variants(variants_df)]))
+
+    def _get_window(self, chromosome):
+        return self.windows.get(str(chromosome), (
+            np.array([], dtype=np.int64), np.array([], dtype=np.uint64)))
+
+    def _set_window(self, chromosome, positions, hashes):
+        if len(positions) > 0:
+            inside = positions >= positions.max() - self.window
+            positions = positions[inside]
+            hashes = hashes[inside]
+        self.windows[str(chromosome)] = (positions, hashes)
+
+    def get_state(self, chromosomes=None):
+        """
+        Method to get the windows in a form that can be saved as json.
+        :param chromosomes: optional iterable of the chromosomes to get the
+        window of, all chromosomes when not given.
+        :return: dict of chromosome and its positions and hashes.
+        """
+        if chromosomes is None:
+            chromosomes = self.windows.keys()
+        state = {}
+        for chromosome in chromosomes:
+            positions, hashes = self._get_window(chromosome)
+            state[str(chromosome)] = {'positions': positions.tolist(),
+                                      'hashes': hashes.tolist()}
+        return state
+
+    def add_state(self, state):
+        """
+        Method to add saved windows to the current windows.
+        :param state: dict as returned by get_state.
+        """
+        for chromosome, window in state.items():
+            window_positions, window_hashes = self._get_window(chromosome)
+            self._set_window(chromosome, np.concatenate(
+                [window_positions,
+                 np.array(window['positions'], dtype=np.int64)]),
+                np.concatenate([window_hashes,
+                                np.array(window['hashes'],
+                                         dtype=np.uint64)]))
+
+    def set_state(self, state):
+        for chromosome, window in state.items():
+            self.windows[str(chromosome)] = (
+                np.array(window['positions'], dtype=np.int64),
+                np.array(window['hashes'], dtype=np.uint64))
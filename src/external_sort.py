@@ -0,0 +1,197 @@
+import csv
+import gzip
+import io
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from src.logger import Logger
+from src.output_writer import GzipOutputWriter, BgzfOutputWriter
+
+
+class ExternalSorter:
+    """
+    Class to sort a chromosome output file on position, alleles and
+    transcript within a memory budget, drop exact duplicate lines and
+    rewrite it as a single BGZF stream. Parts of the file that fit in the
+    budget are sorted and spilled to temporary files, which are then merged
+    k-way a batch of lines at a time: every round takes all lines up to the
+    smallest last key of the buffered parts of the spill files, so only
+    those lines have to be sorted together. Lines with the same key are
+    ordered on the whole line, which puts exact duplicates next to each
+    other and makes the order deterministic.
+    """
+    # Columns of the output to sort on: Pos, Ref, Alt and FeatureID.
+    sort_columns = [1, 2, 3, 6]
+    # Bytes of memory a byte of lines takes while it is parsed and sorted.
+    memory_per_byte = 8
+    minimal_chunk_size = 1 << 20
+
+    def __init__(self, memory_budget=1000, compression_level=6):
+        """
+        :param memory_budget: int, the memory to sort with in MB.
+        :param compression_level: the compression level of the sorted file.
+        """
+        self.log = Logger()
+        self.chunk_size = max(memory_budget * 1000000 //
+                              self.memory_per_byte, self.minimal_chunk_size)
+        self.compression_level = compression_level
+
+    def sort(self, path):
+        """
+        Method to sort an output file in place.
+        :param path: path to a whole_genome_SNVs_chr_*.tsv.gz file.
+        :return: tuple of the amount of lines written and the amount of
+        duplicated lines dropped.
+        """
+        spill_dir = path + '.sort'
+        if os.path.isdir(spill_dir):
+            shutil.rmtree(spill_dir)
+        os.makedirs(spill_dir)
+        runs = []
+        pending = None
+        duplicates = 0
+        for chunk in self._read_chunks(path, self.chunk_size):
+            if pending is not None:
+                runs.append(self._spill(spill_dir, len(runs), pending))
+            pending, dropped = self._sort_chunk(chunk)
+            duplicates += dropped
+        if len(runs) > 0:
+            runs.append(self._spill(spill_dir, len(runs), pending))
+            self.log.log('Merging {} sorted parts of {}.'.format(len(runs),
+                                                                 path))
+        temporary = path + '.sorted.tmp'
+        if os.path.isfile(temporary):
+            os.remove(temporary)
+        writer = BgzfOutputWriter(temporary, self.compression_level)
+        if len(runs) > 0:
+            lines, dropped = self._merge(runs, writer)
+            duplicates += dropped
+        elif pending is not None:
+            lines = len(pending[-1])
+            writer.write(self._join_lines(pending[-1]))
+        else:
+            lines = 0
+        writer.close()
+        os.replace(temporary, path)
+        shutil.rmtree(spill_dir)
+        return lines, duplicates
+
+    def _read_chunks(self, path, chunk_size):
+        """
+        Generator to read a gzipped output file in chunks of whole lines.
+        :param path: path to the file.
+        :param chunk_size: the amount of uncompressed bytes per chunk.
+        :return: generator of lists of numpy arrays, with the sort columns
+        followed by the lines.
+        """
+        carry = b''
+        with gzip.open(path, 'rb') as source:
+            while True:
+                data = source.read(chunk_size)
+                if len(data) == 0:
+                    break
+                data = carry + data
+                end = data.rfind(b'\n') + 1
+                carry = data[end:]
+                if end > 0:
+                    yield self._parse(data[:end])
+        if len(carry) > 0:
+            yield self._parse(carry + b'\n')
+
+    def _parse(self, data):
+        lines = np.array(data.split(b'\n')[:-1], dtype=object)
+        keys = pd.read_csv(io.BytesIO(data), sep='\t', header=None,
+                           usecols=self.sort_columns,
+                           dtype={column: str for column in
+                                  self.sort_columns[1:]},
+                           na_filter=False, quoting=csv.QUOTE_NONE)
+        return [keys[column].values for column in self.sort_columns] + \
+            [lines]
+
+    @staticmethod
+    def _sort_chunk(chunk):
+        """
+        Method to sort a chunk and drop its exact duplicate lines.
+        :param chunk: list of numpy arrays, the sort columns and the lines.
+        :return: tuple of the sorted chunk and the amount of lines dropped.
+        """
+        order = pd.DataFrame(dict(enumerate(chunk))).sort_values(
+            list(range(len(chunk)))).index.values
+        lines = chunk[-1][order]
+        keep = np.ones(len(lines), dtype=bool)
+        keep[1:] = lines[1:] != lines[:-1]
+        order = order[keep]
+        return [column[order] for column in chunk], int((~keep).sum())
+
+    @staticmethod
+    def _join_lines(lines):
+        return b'\n'.join(lines) + b'\n' if len(lines) > 0 else b''
+
+    def _spill(self, spill_dir, number, chunk):
+        run = os.path.join(spill_dir, 'run_{:06d}.tsv.gz'.format(number))
+        writer = GzipOutputWriter(run, 1)
+        writer.write(self._join_lines(chunk[-1]))
+        writer.close()
+        return run
+
+    @staticmethod
+    def _key(chunk, row):
+        return tuple(column[row] for column in chunk)
+
+    def _count_until(self, chunk, bound):
+        """
+        Method to count the lines of a sorted chunk with a key up to bound.
+        """
+        low = 0
+        high = len(chunk[-1])
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(chunk, middle) <= bound:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _merge(self, runs, writer):
+        """
+        Method to merge the sorted spill files into the writer.
+        :return: tuple of the amount of lines written and the amount of
+        duplicated lines dropped.
+        """
+        buffer_size = max(self.chunk_size // len(runs),
+                          self.minimal_chunk_size)
+        buffers = []
+        for run in runs:
+            reader = self._read_chunks(run, buffer_size)
+            chunk = next(reader, None)
+            if chunk is not None:
+                buffers.append([chunk, reader])
+        last_line = None
+        written = 0
+        dropped = 0
+        while len(buffers) > 0:
+            bound = min(self._key(chunk, len(chunk[-1]) - 1)
+                        for chunk, _ in buffers)
+            taken = []
+            for entry in buffers:
+                count = self._count_until(entry[0], bound)
+                taken.append([column[:count] for column in entry[0]])
+                entry[0] = [column[count:] for column in entry[0]]
+                if len(entry[0][-1]) == 0:
+                    entry[0] = next(entry[1], None)
+            buffers = [entry for entry in buffers if entry[0] is not None]
+            merged, duplicates = self._sort_chunk(
+                [np.concatenate(columns) for columns in zip(*taken)])
+            lines = merged[-1]
+            dropped += duplicates
+            if last_line is not None and len(lines) > 0 and \
+                    lines[0] == last_line:
+                lines = lines[1:]
+                dropped += 1
+            if len(lines) > 0:
+                last_line = lines[-1]
+                writer.write(self._join_lines(lines))
+                writer.flush()
+                written += len(lines)
+        return written, dropped
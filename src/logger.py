@@ -1,23 +1,60 @@
 from src.utilities.utilities import Utilities
+import atexit
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+_LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING',
+                ERROR: 'ERROR'}
+
 
 class Logger:
     class __Logger:
         """
         Class to make a logfile on the progress being made.
+        Messages below the set level are dropped before they are formatted.
+        The others are handed to a background thread that keeps the logfile
+        open and flushes it every flush_interval seconds, so logging never
+        waits on the filesystem. Counts of noisy per-batch events are
+        summed and written as one summary every summary_interval seconds.
         """
+        flush_interval = 1.0
+        summary_interval = 60.0
+
         def __init__(self):
             self.output_dir = None
             self.logfile = None
             self.utilities = Utilities()
+            self.level = INFO
+            self.queue = None
+            self.thread = None
+            self.pid = None
+            self.counts = {}
+            self.counts_lock = threading.Lock()
+            self.last_summary = time.time()
+            atexit.register(self.close)
 
         def set_output_dir(self, output_loc):
             self.output_dir = output_loc
             self._check_if_dir_exist()
             self._check_if_log_file_exist()
 
+        def set_level(self, level):
+            """
+            Method to set the lowest level of the messages to write.
+            :param level: DEBUG, INFO, WARNING or ERROR, or its name.
+            """
+            if isinstance(level, str):
+                level = {name: value for value, name in
+                         _LEVEL_NAMES.items()}[level.upper()]
+            self.level = level
+
         def _check_if_dir_exist(self):
             output_dir = os.path.join(self.output_dir, 'log_output')
             self.utilities.check_if_dir_exists(output_dir)
@@ -30,11 +67,132 @@ class Logger:
             self.utilities.check_if_file_exists(joined_path)
             self.logfile = joined_path
 
-        def log(self, message):
+        def is_enabled_for(self, level):
+            return level >= self.level
+
+        def log(self, message, *args, level=INFO):
+            """
+            Method to log a message.
+            :param message: str, formatted with args through str.format, but
+            only when the message is written.
+            :param args: values to format the message with.
+            :param level: DEBUG, INFO (default), WARNING or ERROR.
+            """
+            if level < self.level or self.logfile is None:
+                return
+            if args:
+                message = message.format(*args)
             timestamp = datetime.now().strftime("%H:%M:%S_%f")
-            timed_message = '[{}]: {}\n'.format(timestamp, message)
-            with open(self.logfile, 'a') as logfile:
-                logfile.write(timed_message)
+            if level == INFO:
+                timed_message = '[{}]: {}\n'.format(timestamp, message)
+            else:
+                timed_message = '[{}] {}: {}\n'.format(
+                    timestamp, _LEVEL_NAMES[level], message)
+            self._get_queue().put((self.logfile, timed_message))
+
+        def debug(self, message, *args):
+            self.log(message, *args, level=DEBUG)
+
+        def info(self, message, *args):
+            self.log(message, *args, level=INFO)
+
+        def warning(self, message, *args):
+            self.log(message, *args, level=WARNING)
+
+        def error(self, message, *args):
+            self.log(message, *args, level=ERROR)
+
+        def count(self, event, amount=1):
+            """
+            Method to count a noisy event instead of logging it every time.
+            The counts are written as a summary every summary_interval
+            seconds and when the logger is closed.
+            :param event: str, description of what is counted.
+            :param amount: the amount to add.
+            """
+            with self.counts_lock:
+                total, times = self.counts.get(event, (0, 0))
+                self.counts[event] = (total + amount, times + 1)
+            if time.time() - self.last_summary >= self.summary_interval:
+                self.write_summary()
+
+        def write_summary(self):
+            with self.counts_lock:
+                counts = self.counts
+                self.counts = {}
+                since = self.last_summary
+                self.last_summary = time.time()
+            if len(counts) == 0:
+                return
+            self.log('Summary of the last {} seconds: {}.',
+                     int(round(self.last_summary - since)),
+                     ', '.join('{}: {} (in {} batches)'.format(
+                         event, total, times)
+                         for event, (total, times) in counts.items()))
+
+        def _get_queue(self):
+            # A forked worker process inherits the queue but not the
+            # thread writing it, so it starts a writer of its own.
+            if self.thread is None or self.pid != os.getpid():
+                self.queue = queue.Queue()
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._write_messages,
+                                               args=(self.queue,),
+                                               daemon=True)
+                self.thread.start()
+            return self.queue
+
+        def _write_messages(self, messages):
+            logfile_path = None
+            logfile = None
+            last_flush = time.time()
+            while True:
+                try:
+                    item = messages.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    item = None
+                if isinstance(item, tuple):
+                    path, timed_message = item
+                    if path != logfile_path:
+                        if logfile is not None:
+                            logfile.close()
+                        logfile = open(path, 'a')
+                        logfile_path = path
+                    logfile.write(timed_message)
+                    if time.time() - last_flush < self.flush_interval:
+                        continue
+                if logfile is not None:
+                    logfile.flush()
+                last_flush = time.time()
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is not None and not isinstance(item, tuple):
+                    if logfile is not None:
+                        logfile.close()
+                    return
+
+        def flush(self):
+            """
+            Method to wait until every message logged so far is written.
+            """
+            if self.thread is None or self.pid != os.getpid() or \
+                    not self.thread.is_alive():
+                return
+            written = threading.Event()
+            self.queue.put(written)
+            written.wait()
+
+        def close(self):
+            """
+            Method to write the last summary and stop the writer thread.
+            """
+            self.write_summary()
+            if self.thread is None or self.pid != os.getpid() or \
+                    not self.thread.is_alive():
+                return
+            self.queue.put(False)
+            self.thread.join()
+            self.thread = None
 
     instance = None
 
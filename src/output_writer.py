@@ -0,0 +1,600 @@
+import os
+import re
+import shutil
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from src.utilities.bgzf import BGZF_BLOCK_SIZE, BGZF_EOF, compress_block, \
+    split_blocks
+
+_GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+# Bytes at the end of an output file its checksum is taken over.
+_TAIL_SIZE = 64
+
+
+def _sync_directory(path):
+    """
+    Function to force the entries of a directory to disk, after a file in
+    it was created or replaced.
+    :param path: path of the directory.
+    """
+    directory = os.open(path or '.', os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class GzipOutputWriter:
+    """
+    Class to write an output file as gzip. Compressed data is kept in
+    memory and only written, as one complete gzip member, on flush. A crash
+    can therefore never leave half a member behind. The last bytes written
+    are kept, for the checksum that tells a resumed run whether the file is
+    still the one its checkpoint describes.
+    """
+
+    def __init__(self, path, compression_level):
+        self.path = path
+        self.compression_level = compression_level
+        self.is_new = not os.path.isfile(path)
+        self.is_dirty = False
+        self.tail = b''
+        if not self.is_new:
+            self.tail = self.read_tail(path, os.path.getsize(path))
+        self.file = open(path, 'ab')
+        self.compressor = None
+        self.crc = 0
+        self.size = 0
+        self.pending = []
+
+    def write_variants(self, variants_df):
+        data = variants_df.to_csv(sep='\t', index=False, header=False)
+        self.write(data.encode('utf-8'))
+
+    def write(self, data):
+        if self.compressor is None:
+            self.compressor = zlib.compressobj(self.compression_level,
+                                               zlib.DEFLATED, -15)
+            self.crc = 0
+            self.size = 0
+            self.pending.append(_GZIP_HEADER)
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.pending.append(self.compressor.compress(data))
+
+    def flush(self):
+        if self.compressor is not None:
+            self.pending.append(self.compressor.flush())
+            self.pending.append(struct.pack('<II', self.crc & 0xffffffff,
+                                            self.size & 0xffffffff))
+            self.compressor = None
+        self._write_pending()
+
+    def write_compressed(self, data):
+        """
+        Method to append data that is compressed already, as complete gzip
+        members or BGZF blocks.
+        :param data: bytes
+        """
+        self.flush()
+        self.file.write(data)
+        self._set_tail(data)
+        self.is_dirty = True
+
+    def _write_pending(self):
+        if len(self.pending) > 0:
+            data = b''.join(self.pending)
+            self.file.write(data)
+            self._set_tail(data)
+            self.pending = []
+            self.is_dirty = True
+        self.file.flush()
+
+    def _set_tail(self, data):
+        self.tail = (self.tail + data[-_TAIL_SIZE:])[-_TAIL_SIZE:]
+
+    @staticmethod
+    def read_tail(path, size):
+        """
+        Method to read the bytes of a file a checksum is taken over.
+        :param path: path of the file.
+        :param size: int, the size of the file at the checkpoint.
+        :return: bytes, the last bytes before size.
+        """
+        with open(path, 'rb') as output_file:
+            output_file.seek(max(size - _TAIL_SIZE, 0))
+            return output_file.read(min(size, _TAIL_SIZE))
+
+    @classmethod
+    def get_file_checksum(cls, path, size):
+        """
+        Method to get the checksum of a file as it was at a given size.
+        :param path: path of the file.
+        :param size: int, the size of the file at the checkpoint.
+        :return: int
+        """
+        return zlib.crc32(cls.read_tail(path, size))
+
+    def get_checksum(self):
+        """
+        Method to get the checksum of the file as written by the last flush.
+        :return: int, the CRC-32 of its last bytes.
+        """
+        return zlib.crc32(self.tail)
+
+    def sync(self):
+        """
+        Method to force the data written by the last flush to disk, so a
+        checkpoint saved after it never counts output a crash can lose.
+        """
+        if self.is_dirty:
+            os.fsync(self.file.fileno())
+            self.is_dirty = False
+        if self.is_new:
+            _sync_directory(os.path.dirname(self.path))
+            self.is_new = False
+
+    def get_size(self):
+        """
+        Method to get the size of the file as written by the last flush.
+        :return: int, bytes.
+        """
+        return self.file.tell()
+
+    def close(self, discard=False):
+        if not discard:
+            self.flush()
+        self.file.close()
+
+
+class BgzfOutputWriter(GzipOutputWriter):
+    """
+    Class to write an output file as BGZF: independent gzip blocks of at
+    most 64 KB that can be indexed. Blocks are compressed on the given
+    executor when there is one.
+    """
+
+    def __init__(self, path, compression_level, executor=None):
+        super().__init__(path, compression_level)
+        self.executor = executor
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= BGZF_BLOCK_SIZE:
+            full = len(self.buffer) - len(self.buffer) % BGZF_BLOCK_SIZE
+            self._compress(bytes(self.buffer[:full]))
+            del self.buffer[:full]
+
+    def _compress(self, data):
+        blocks = split_blocks(data)
+        levels = [self.compression_level] * len(blocks)
+        if self.executor is not None and len(blocks) > 1:
+            self.pending.extend(self.executor.map(compress_block, blocks,
+                                                  levels))
+        else:
+            self.pending.extend(map(compress_block, blocks, levels))
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self._compress(bytes(self.buffer))
+            self.buffer = bytearray()
+        self._write_pending()
+
+    def close(self, discard=False):
+        if not discard:
+            self.flush()
+            self.file.write(BGZF_EOF)
+        self.file.close()
+
+
+class ParquetOutputWriter:
+    """
+    Class to write an output file as Parquet, with a row group per
+    checkpoint. Positions are stored as integers, the allele, gene and
+    transcript columns dictionary encoded and the predictions as float32.
+    A Parquet file can only be read once its footer is written, so while a
+    run is going every row group is written as a complete file of its own
+    in a parts directory next to the output, synced before the checkpoint
+    that counts it. Every parts_per_segment row groups the parts are
+    combined into a segment. Once the run is done, merge combines the
+    segments and parts into the single output file.
+    """
+    dictionary_columns = ['#Chr', 'Ref', 'Alt', 'GeneID', 'CCDS', 'FeatureID']
+    parts_suffix = '.parts'
+    parts_per_segment = 1000
+
+    def __init__(self, path, keep_existing=True):
+        """
+        :param path: path of the Parquet file.
+        :param keep_existing: continue the output at path when it exists,
+        instead of replacing it.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Writing Parquet output requires pyarrow.')
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        self.path = path
+        self.parts_loc = path + self.parts_suffix
+        if not keep_existing:
+            self.truncate(path, 0)
+        self.is_new = not os.path.isdir(self.parts_loc)
+        if self.is_new:
+            os.makedirs(self.parts_loc)
+        # Tuples of the first row group, the amount of row groups and the
+        # path of every file in the parts directory, in order.
+        self.files = self._recover_files(path)
+        self.row_groups = sum(count for _, count, _ in self.files)
+        self.parts = 0
+        for _, count, _ in reversed(self.files):
+            if count > 1:
+                break
+            self.parts += 1
+        self.unsynced = []
+        self.pending = []
+
+    @classmethod
+    def find_unmerged(cls, directory):
+        """
+        Method to find the Parquet outputs within a directory that are still
+        written as parts.
+        :param directory: str
+        :return: list of the paths of the outputs.
+        """
+        return sorted(str(parts_loc)[:-len(cls.parts_suffix)]
+                      for parts_loc in Path(directory).rglob(
+                          'whole_genome_SNVs_*.parquet' + cls.parts_suffix))
+
+    @classmethod
+    def _get_file_loc(cls, path, first, count):
+        return os.path.join(path + cls.parts_suffix,
+                            '{:012d}_{}.parquet'.format(first, count))
+
+    @classmethod
+    def _recover_files(cls, path):
+        """
+        Method to list the files holding the row groups of an output, after
+        cleaning up after a run that stopped while writing them: unfinished
+        files are removed, as are parts already combined into a segment and
+        a merged file of which the parts still exist.
+        :param path: path of the Parquet output.
+        :return: list of tuples of the first row group, the amount of row
+        groups and the path of every file, in order.
+        """
+        parts_loc = path + cls.parts_suffix
+        if not os.path.isdir(parts_loc):
+            if os.path.isfile(path):
+                import pyarrow.parquet
+                return [(0, pyarrow.parquet.read_metadata(
+                    path).num_row_groups, path)]
+            return []
+        found = []
+        for name in os.listdir(parts_loc):
+            match = re.match(r'^(\d+)_(\d+)\.parquet$', name)
+            if match is None:
+                os.remove(os.path.join(parts_loc, name))
+            else:
+                found.append((int(match.group(1)), int(match.group(2)),
+                              os.path.join(parts_loc, name)))
+        if len(found) == 0:
+            if os.path.isfile(path):
+                # Stopped while moving a merged file into its parts.
+                import pyarrow.parquet
+                count = pyarrow.parquet.read_metadata(path).num_row_groups
+                os.replace(path, cls._get_file_loc(path, 0, count))
+                return [(0, count, cls._get_file_loc(path, 0, count))]
+            return []
+        if os.path.isfile(path):
+            # Stopped while merging, the parts hold all row groups.
+            os.remove(path)
+        files = []
+        end = 0
+        # Segments sort before the parts they were combined from.
+        for first, count, file_loc in sorted(
+                found, key=lambda found_file: (found_file[0],
+                                               -found_file[1])):
+            if first < end:
+                os.remove(file_loc)
+                continue
+            if first > end:
+                raise ValueError('Row groups {} to {} of {} are'
+                                 ' missing.'.format(end, first - 1, path))
+            files.append((first, count, file_loc))
+            end = first + count
+        return files
+
+    @classmethod
+    def count_row_groups(cls, path):
+        return sum(count for _, count, _ in cls._recover_files(path))
+
+    @classmethod
+    def count_rows(cls, path):
+        import pyarrow.parquet
+        return sum(pyarrow.parquet.read_metadata(file_loc).num_rows
+                   for _, _, file_loc in cls._recover_files(path))
+
+    @staticmethod
+    def _write_file(file_loc, tables, schema):
+        """
+        Method to write tables as the row groups of a complete file, synced
+        to disk before it replaces file_loc.
+        """
+        import pyarrow.parquet
+        temporary_loc = file_loc + '.tmp'
+        writer = pyarrow.parquet.ParquetWriter(temporary_loc, schema)
+        for table in tables:
+            writer.write_table(table)
+        writer.close()
+        with open(temporary_loc, 'rb') as temporary_file:
+            os.fsync(temporary_file.fileno())
+        os.replace(temporary_loc, file_loc)
+
+    @staticmethod
+    def _read_row_groups(files):
+        import pyarrow.parquet
+        for _, _, file_loc in files:
+            source = pyarrow.parquet.ParquetFile(file_loc)
+            for row_group in range(source.num_row_groups):
+                yield source.read_row_group(row_group)
+
+    @classmethod
+    def truncate(cls, path, row_groups):
+        """
+        Method to cut a Parquet output back to its first row groups. Only
+        the file holding the last row group kept is rewritten.
+        :param path: path of the Parquet output.
+        :param row_groups: int, the amount of row groups to keep.
+        """
+        import pyarrow.parquet
+        if row_groups == 0:
+            if os.path.isdir(path + cls.parts_suffix):
+                shutil.rmtree(path + cls.parts_suffix)
+            if os.path.isfile(path):
+                os.remove(path)
+            return
+        for first, count, file_loc in cls._recover_files(path):
+            if first >= row_groups:
+                os.remove(file_loc)
+            elif first + count > row_groups:
+                source = pyarrow.parquet.ParquetFile(file_loc)
+                tables = [source.read_row_group(row_group) for row_group in
+                          range(row_groups - first)]
+                if file_loc == path:
+                    cls._write_file(path, tables, source.schema_arrow)
+                else:
+                    cls._write_file(cls._get_file_loc(
+                        path, first, row_groups - first), tables,
+                        source.schema_arrow)
+                    os.remove(file_loc)
+        _sync_directory(os.path.dirname(path))
+        if os.path.isdir(path + cls.parts_suffix):
+            _sync_directory(path + cls.parts_suffix)
+
+    @classmethod
+    def merge(cls, path):
+        """
+        Method to combine the parts of a Parquet output into the single
+        output file, keeping every row group.
+        :param path: path of the Parquet output.
+        """
+        import pyarrow.parquet
+        files = cls._recover_files(path)
+        if len(files) > 0 and files[0][2] != path:
+            schema = pyarrow.parquet.read_schema(files[0][2])
+            cls._write_file(path, cls._read_row_groups(files), schema)
+            _sync_directory(os.path.dirname(path))
+        if os.path.isdir(path + cls.parts_suffix):
+            shutil.rmtree(path + cls.parts_suffix)
+
+    @classmethod
+    def read_tail(cls, path, nrows):
+        """
+        Method to read the last rows of a Parquet output.
+        :param path: path of the Parquet output.
+        :param nrows: the amount of rows to read.
+        :return: pandas DataFrame
+        """
+        import pyarrow.parquet
+        frames = []
+        total = 0
+        for _, _, file_loc in reversed(cls._recover_files(path)):
+            source = pyarrow.parquet.ParquetFile(file_loc)
+            for row_group in reversed(range(source.num_row_groups)):
+                frames.insert(0, source.read_row_group(row_group).to_pandas())
+                total += frames[0].shape[0]
+                if total >= nrows:
+                    break
+            if total >= nrows:
+                break
+        if len(frames) == 0:
+            return pd.DataFrame()
+        tail = pd.concat(frames, ignore_index=True).tail(nrows)
+        for column in cls.dictionary_columns:
+            tail[column] = tail[column].astype(object)
+        return tail
+
+    def write_variants(self, variants_df):
+        self.pending.append(variants_df)
+
+    def _to_table(self, variants_df):
+        # Declared types, so every row group has the same schema whatever
+        # the amount of distinct values in a batch.
+        arrays = []
+        for column in variants_df.columns:
+            values = variants_df[column]
+            if column in self.dictionary_columns:
+                array = self.pyarrow.array(
+                    values.astype(str).where(values.notnull()),
+                    type=self.pyarrow.string(),
+                    from_pandas=True).dictionary_encode()
+            elif column == 'Pos':
+                array = self.pyarrow.array(values.values.astype(np.int32))
+            elif column.startswith('prediction'):
+                array = self.pyarrow.array(values.values.astype(np.float32))
+            else:
+                array = self.pyarrow.array(values, from_pandas=True)
+            arrays.append(array)
+        return self.pyarrow.Table.from_arrays(
+            arrays, names=list(variants_df.columns))
+
+    def write_table(self, table):
+        """
+        Method to append a pyarrow Table as a row group, for tables read
+        from another output file.
+        :param table: pyarrow Table with the schema of the output.
+        """
+        file_loc = self._get_file_loc(self.path, self.row_groups, 1)
+        temporary_loc = file_loc + '.tmp'
+        writer = self.parquet.ParquetWriter(temporary_loc, table.schema)
+        writer.write_table(table)
+        writer.close()
+        os.replace(temporary_loc, file_loc)
+        self.files.append((self.row_groups, 1, file_loc))
+        self.unsynced.append(file_loc)
+        self.row_groups += 1
+        self.parts += 1
+        if self.parts >= self.parts_per_segment:
+            self._combine_parts()
+
+    def _combine_parts(self):
+        """
+        Method to combine the last parts into a segment, to keep the amount
+        of files in the parts directory down. The parts are only removed
+        once the segment is on disk.
+        """
+        parts = self.files[-self.parts:]
+        first = parts[0][0]
+        segment_loc = self._get_file_loc(self.path, first, len(parts))
+        self._write_file(segment_loc, self._read_row_groups(parts),
+                         self.parquet.read_schema(parts[0][2]))
+        _sync_directory(self.parts_loc)
+        for _, _, file_loc in parts:
+            os.remove(file_loc)
+        self.files[-self.parts:] = [(first, len(parts), segment_loc)]
+        self.unsynced = []
+        self.parts = 0
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        variants_df = pd.concat(self.pending, ignore_index=True)
+        self.pending = []
+        self.write_table(self._to_table(variants_df))
+
+    def sync(self):
+        """
+        Method to force the parts written since the last sync to disk, so a
+        checkpoint saved after it never counts a row group a crash can lose.
+        """
+        for file_loc in self.unsynced:
+            with open(file_loc, 'rb') as part_file:
+                os.fsync(part_file.fileno())
+        if len(self.unsynced) > 0:
+            _sync_directory(self.parts_loc)
+            self.unsynced = []
+        if self.is_new:
+            _sync_directory(os.path.dirname(self.path))
+            self.is_new = False
+
+    def get_size(self):
+        """
+        Method to get the size of the output as written by the last flush.
+        :return: int, the amount of row groups.
+        """
+        return self.row_groups
+
+    def get_checksum(self):
+        # Parts are never changed once written, only added or removed.
+        return None
+
+    def close(self, discard=False):
+        if not discard:
+            self.flush()
+            self.sync()
+        self.pending = []
+
+
+class OutputWriterPool:
+    """
+    Class to keep one output handle per output file open for the whole run.
+    Paths ending in .parquet are written as Parquet files, all other paths
+    as gzip or BGZF. Written batches are buffered until flush, which has to
+    be called at every checkpoint, before the progression is updated, and
+    forces them to disk.
+    """
+
+    def __init__(self, compression_level=6, bgzf=False, threads=1):
+        self.compression_level = compression_level
+        self.bgzf = bgzf
+        self.executor = None
+        if bgzf and threads > 1:
+            self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.writers = {}
+
+    def write(self, path, variants_df):
+        self._get_writer(path).write_variants(variants_df)
+
+    def _get_writer(self, path):
+        if path not in self.writers:
+            if path.endswith('.parquet'):
+                self.writers[path] = ParquetOutputWriter(path)
+            elif self.bgzf:
+                self.writers[path] = BgzfOutputWriter(path,
+                                                      self.compression_level,
+                                                      self.executor)
+            else:
+                self.writers[path] = GzipOutputWriter(path,
+                                                      self.compression_level)
+        return self.writers[path]
+
+    def flush(self):
+        for writer in self.writers.values():
+            writer.flush()
+        # All files are written before any is synced, so the disk can write
+        # them out together.
+        for writer in self.writers.values():
+            writer.sync()
+
+    def get_sizes(self):
+        """
+        Method to get the sizes of all files written this run, to be saved
+        with the checkpoint so a resumed run can cut off anything written
+        after it.
+        :return: dict of path and size.
+        """
+        return {path: writer.get_size()
+                for path, writer in self.writers.items()}
+
+    def get_checksums(self):
+        """
+        Method to get the checksums of the last bytes of all gzip files
+        written this run, to be saved with the checkpoint so a resumed run
+        only cuts off files that still hold what it wrote.
+        :return: dict of path and checksum.
+        """
+        checksums = {}
+        for path, writer in self.writers.items():
+            checksum = writer.get_checksum()
+            if checksum is not None:
+                checksums[path] = checksum
+        return checksums
+
+    def close(self, discard=False):
+        """
+        Method to close all handles.
+        :param discard: drop data written since the last flush instead of
+        writing it, for when the run stops before its next checkpoint.
+        """
+        for writer in self.writers.values():
+            writer.close(discard=discard)
+        self.writers = {}
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
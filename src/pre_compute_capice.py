@@ -1,12 +1,23 @@
-import pickle
 import pandas as pd
-from src.utilities.impute_preprocess import impute, preprocess
 import gzip
 import time
 import os
-from src.logger import Logger
+from src.logger import Logger, DEBUG
 from src.utilities.utilities import Utilities
 from src.progress_tracker import ProgressTracker
+from src.cadd_reader import CaddReader
+from src.scoring_pipeline import ScoringPipeline
+from src.batch_scorer import BatchScorer
+from src.worker_pool import WorkerPool
+from src.output_writer import OutputWriterPool, ParquetOutputWriter
+from src.deduplicator import VariantDeduplicator
+from src.run_metrics import RunMetrics
+from src.adaptive_batch_size import AdaptiveBatchSize
+from src.run_profiler import RunProfiler
+from src.region_filter import RegionFilter
+from src.utilities.bgzf import is_bgzf
+from src.utilities.tabix import TabixIndex
+from src.sharding import ShardChromosomes, get_shard_range
 
 
 class CalculateCapiceScores:
@@ -16,25 +27,101 @@ class CalculateCapiceScores:
     """
 
     def __init__(self, filepath, model_loc, output_loc,
-                 batch_size):
+                 batch_size, pipeline=False, workers=1,
+                 compression_level=6, compression_threads=1, bgzf=False,
+                 output_format='tsv', model_threads=None,
+                 prediction_cache=0, metrics_format='jsonl',
+                 memory_limit=None, regions=None, chromosomes=None,
+                 shard=None, profile=None):
         self.log = Logger()
         self.filepath = filepath
         self.titles = None
         self.get_header()
+        if isinstance(model_loc, str):
+            model_loc = [model_loc]
+        self.prediction_columns = BatchScorer.get_prediction_columns(
+            model_loc)
+        self.features_of_interest = ['#Chr', 'Pos', 'Ref', 'Alt',
+                                     'GeneID', 'CCDS', 'FeatureID'] + \
+            self.prediction_columns
+        self.model_loc = model_loc
+        self.scorer = None
         self.model = None
         self.model_feats = None
+        self.model_threads = model_threads
+        self.prediction_cache = prediction_cache
         self.load_model(model_loc)
         self.not_done = True
         self.batch_size = batch_size
+        self.memory_limit = memory_limit
+        self.region_filter = None
+        if regions or chromosomes:
+            self._set_region_filter(regions, chromosomes)
+        self.shard_filter = None
+        self.input_range = None
+        if shard is not None:
+            self._set_shard(shard)
+        self.pipeline = pipeline
+        self.workers = workers
         self.output_loc = output_loc
+        self.output_extensions = {'tsv': ['tsv.gz'],
+                                  'parquet': ['parquet'],
+                                  'both': ['tsv.gz', 'parquet']}[output_format]
         self.utilities = Utilities()
         self.utilities.check_if_dir_exists(output_loc)
         self.progress_track = ProgressTracker(self.output_loc)
-        self.features_of_interest = ['#Chr', 'Pos', 'Ref', 'Alt',
-                                     'GeneID', 'CCDS', 'FeatureID',
-                                     'prediction']
-        self.previous_iteration_df = pd.DataFrame(
-            columns=self.features_of_interest)
+        if compression_threads > 1 and not bgzf:
+            self.log.warning('Compression threads are only used for BGZF'
+                             ' output, compressing gzip output in a single'
+                             ' thread.')
+        self.output_writers = OutputWriterPool(
+            compression_level=compression_level,
+            bgzf=bgzf,
+            threads=compression_threads)
+        dedup_window = self.progress_track.get_dedup_window()
+        # Progressions saved before the window was checkpointed seed it from
+        # the tail of the output files instead.
+        self.seed_dedup_window = dedup_window is None
+        self.deduplicator = VariantDeduplicator(state=dedup_window)
+        input_start = 0
+        input_end = os.path.getsize(self.filepath)
+        if self.input_range is not None:
+            if self.input_range[0] is not None:
+                input_start = self.input_range[0] >> 16
+            if self.input_range[1] is not None:
+                input_end = self.input_range[1] >> 16
+        self.metrics = RunMetrics(self.output_loc, input_end, metrics_format,
+                                  input_start)
+        self.profiler = None
+        if profile is not None:
+            self.profiler = RunProfiler(self.output_loc, profile)
+
+    def _set_region_filter(self, regions, chromosomes):
+        self.region_filter = RegionFilter(regions, chromosomes)
+        self.log.log('Only scoring {}.'.format(
+            self.region_filter.describe()))
+        if is_bgzf(self.filepath) and os.path.isfile(
+                TabixIndex.index_path(self.filepath)):
+            self.log.log('Seeking to the regions through {}.'.format(
+                TabixIndex.index_path(self.filepath)))
+        else:
+            self.log.log('The input is not BGZF with a tabix index, reading'
+                         ' all of it and dropping the variants outside the'
+                         ' regions before scoring.')
+
+    def _set_shard(self, shard):
+        if is_bgzf(self.filepath):
+            self.input_range = get_shard_range(self.filepath, shard)
+            self.log.log('Shard {}/{}: scoring the lines between virtual'
+                         ' offsets {} and {}.'.format(
+                            shard[0], shard[1], self.input_range[0],
+                            self.input_range[1]))
+        else:
+            self.shard_filter = ShardChromosomes(shard)
+            self.log.log('Shard {}/{}: the input is not BGZF, scoring the'
+                         ' chromosomes {}.'.format(
+                            shard[0], shard[1],
+                            self.shard_filter.get_chromosomes()))
 
     def get_header(self):
         if not self.titles:
@@ -48,128 +135,219 @@ class CalculateCapiceScores:
                     else:
                         continue
 
-    def calculate_save_capice_score(self, skip_rows, batch_size):
-        variants_df = pd.read_csv(self.filepath, sep='\t', skiprows=skip_rows,
-                                  nrows=batch_size, names=self.titles,
-                                  comment='#', compression='gzip',
-                                  low_memory=False)
-        if variants_df.shape[0] < batch_size:
+    def calculate_save_capice_score(self, batch, batch_size):
+        self.scorer.score_batch(batch)
+        self.save_batch(batch, batch_size)
+
+    def save_batch(self, batch, batch_size):
+        variants_df = batch.variants_df
+        skip_rows = batch.skip_rows
+        if batch.position - skip_rows < batch_size:
             self.not_done = False
             self.log.log('Processing the last entries! '
                          'Total variants processed:'
-                         ' {}.'.format(skip_rows + variants_df.shape[0] - 1))
-
-        variants_df_preprocessed = preprocess(impute(variants_df),
-                                              model_features=self.model_feats)
-        variants_df['prediction'] = self.model.predict_proba(
-            variants_df_preprocessed[self.model_feats])[:, 1]
-        variants_df = variants_df[self.features_of_interest]
-        if variants_df['prediction'].isnull().any():
-            self.log.log('NaN encounter in chunk: {}+'
-                         '{}!'.format(skip_rows,
-                                      batch_size))
-        if variants_df[variants_df.duplicated()].shape[0] > 0:
-            duplicate = variants_df[variants_df.duplicated()]
-            self.log.log('Duplicate encountered in CADD dataset!: \nIndex:{},'
-                         '\nEntry:{}'.format(duplicate.index, duplicate))
+                         ' {}.'.format(batch.position))
+        if variants_df[self.prediction_columns].isnull().values.any():
+            self.log.warning('NaN encounter in chunk: {}+{}!', skip_rows,
+                             batch_size)
+        duplicated = variants_df.duplicated()
+        if duplicated.any():
+            self.log.count('duplicate entries in the CADD dataset',
+                           int(duplicated.sum()))
+            if self.log.is_enabled_for(DEBUG):
+                duplicate = variants_df[duplicated]
+                self.log.debug('Duplicate encountered in CADD dataset!:'
+                               ' \nIndex:{},\nEntry:{}', duplicate.index,
+                               duplicate)
+        written_rows = {}
+        dedup_seconds = 0.0
+        write_seconds = 0.0
+        batch.rows_out = 0
         for unique_chr in variants_df['#Chr'].unique():
             subset_variants_df = variants_df[variants_df['#Chr'] == unique_chr]
             output_dir = os.path.join(self.output_loc, 'chr{}'.format(
                 unique_chr))
             self.utilities.check_if_dir_exists(output_dir)
-            output_filename = 'whole_genome_SNVs_chr_{}.tsv.gz'.format(
-                unique_chr)
-            final_destination = os.path.join(output_dir, output_filename)
-            self.utilities.check_if_file_exists(final_destination,
-                                                capice_ouput=True)
-            subset_variants_df = self._get_and_check_last_entries(
-                final_destination, subset_variants_df)
-            with gzip.open(final_destination, 'at') as f:
-                subset_variants_df.to_csv(f, sep="\t",
-                                          index=False,
-                                          header=None)
+            destinations = [
+                os.path.join(output_dir,
+                             'whole_genome_SNVs_chr_{}.{}'.format(unique_chr,
+                                                                  extension))
+                for extension in self.output_extensions]
+            started = time.perf_counter()
+            subset_variants_df = self._remove_dupes(
+                unique_chr, destinations[0], subset_variants_df)
+            dedup_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            for final_destination in destinations:
+                self.output_writers.write(final_destination,
+                                          subset_variants_df)
+                written_rows[final_destination] = subset_variants_df.shape[0]
+            write_seconds += time.perf_counter() - started
+            batch.rows_out += subset_variants_df.shape[0]
+        started = time.perf_counter()
+        self.output_writers.flush()
+        batch.timings['dedup'] = dedup_seconds
+        batch.timings['write'] = write_seconds + time.perf_counter() - started
+        batch.output_rows = {}
+        for final_destination, nrows in written_rows.items():
             total_processed_rows = 0
             if self.progress_track.is_in_progression_json(final_destination):
                 total_processed_rows = \
                     self.progress_track.get_progression_json_value(
                         final_destination)
-            total_processed_rows += subset_variants_df.shape[0]
-            self.progress_track.update_progression(final_destination,
-                                                   total_processed_rows)
-        self.previous_iteration_df = variants_df.tail(100)
+            batch.output_rows[final_destination] = \
+                total_processed_rows + nrows
+        batch.output_sizes = self.output_writers.get_sizes()
+        batch.output_checksums = self.output_writers.get_checksums()
+        batch.dedup_window = self.deduplicator.get_state(
+            variants_df['#Chr'].unique())
 
     def load_model(self, model_loc):
-        try:
-            self.model = pickle.load(open(model_loc, "rb")).best_estimator_
-        except AttributeError:
-            self.model = pickle.load(open(model_loc, "rb"))
-        self.model_feats = self.model.get_booster().feature_names
+        self.scorer = BatchScorer(model_loc, self.features_of_interest,
+                                  self.model_threads, self.prediction_cache)
+        self.model = self.scorer.model
+        self.model_feats = self.scorer.model_feats
 
-    def _merge_and_remove_dupes(self, subset_df):
+    def _remove_dupes(self, chromosome, output_filename, subset_df):
+        if self.seed_dedup_window and \
+                not self.deduplicator.has_window(chromosome):
+            self._seed_dedup_window(chromosome, output_filename)
         nrows_before = subset_df.shape[0]
-        self.previous_iteration_df['iter'] = 'p'
-        subset_df['iter'] = 'c'
-
-        merge = self.previous_iteration_df.append(subset_df,
-                                                  ignore_index=True)
-
-        merge.drop_duplicates(subset=self.features_of_interest[:-1],
-                              inplace=True,
-                              ignore_index=True)
-
-        merge = merge[merge['iter'] == 'c']
-        merge.drop('iter', axis=1, inplace=True)
-        nrows_after = merge.shape[0]
-        self.log.log('Removed {} duplicated rows.'.format(
-            nrows_before - nrows_after))
-        return merge
-
-    def _get_and_check_last_entries(self, output_filename, subset_df):
-        if self.previous_iteration_df.shape[0] == 0:
-            if self.progress_track.is_in_progression_json(output_filename):
-                self.log.log('No progression dataframe found, loading in'
-                             ' from file: {}.'.format(output_filename))
-                lines_processed = \
-                    self.progress_track.get_progression_json_value(
-                        output_filename
-                    )
-                if lines_processed < 100:
-                    start = None
-                    get_nrows = lines_processed
-                else:
-                    start = lines_processed - 99
-                    get_nrows = 100
-                self.previous_iteration_df = pd.read_csv(
-                    output_filename,
-                    compression='gzip',
-                    sep='\t',
-                    names=self.features_of_interest,
-                    nrows=get_nrows,
-                    skiprows=start)
-            else:
-                self.log.log(
-                    'No progression dataframe found nor progression file.'
-                    ' Skipping duplicate check for file: {}.'.format(
-                        output_filename
-                    )
+        subset_df = self.deduplicator.drop_duplicates(chromosome, subset_df)
+        self.log.count('duplicated rows removed',
+                       nrows_before - subset_df.shape[0])
+        return subset_df
+
+    def _seed_dedup_window(self, chromosome, output_filename):
+        if not self.progress_track.is_in_progression_json(output_filename):
+            self.log.log(
+                'No deduplication window found nor progression file.'
+                ' Skipping duplicate check for file: {}.'.format(
+                    output_filename
                 )
-        return_df = self._merge_and_remove_dupes(subset_df)
-        return return_df
+            )
+            return
+        self.log.log('No deduplication window found, loading in'
+                     ' from file: {}.'.format(output_filename))
+        lines_processed = self.progress_track.get_progression_json_value(
+            output_filename
+        )
+        if lines_processed < 100:
+            start = None
+            get_nrows = lines_processed
+        else:
+            start = lines_processed - 99
+            get_nrows = 100
+        if output_filename.endswith('.parquet'):
+            last_entries = ParquetOutputWriter.read_tail(output_filename,
+                                                         get_nrows)
+        else:
+            last_entries = pd.read_csv(
+                output_filename,
+                compression='gzip',
+                sep='\t',
+                names=self.features_of_interest,
+                nrows=get_nrows,
+                skiprows=start)
+        if last_entries.shape[0] > 0:
+            self.deduplicator.add(chromosome, last_entries)
 
     def calc_capice(self):
+        self._check_prediction_columns()
         start, batch_size = self.progress_track.get_start_and_batchsize()
         if batch_size is None:
             batch_size = self.batch_size
             self.progress_track.update_progression('batch_size', batch_size)
+        elif self.memory_limit is not None:
+            self.log.log('Continuing with the adapted batch size {}.'.format(
+                batch_size))
         elif batch_size != self.batch_size:
             batch_size = self.batch_size
             self.progress_track.update_progression('batch_size', batch_size)
         self._calc_capice(start, batch_size)
 
+    def _check_prediction_columns(self):
+        if self.progress_track.is_in_progression_json('prediction_columns'):
+            saved_columns = self.progress_track.get_progression_json_value(
+                'prediction_columns')
+        elif self.progress_track.get_start_and_batchsize()[0]:
+            # Progressions of before several models were supported.
+            saved_columns = ['prediction']
+        else:
+            saved_columns = self.prediction_columns
+        if saved_columns != self.prediction_columns:
+            raise ValueError(
+                'The output in {} holds the columns {}, it can not be'
+                ' continued with the columns {}. Use a new output directory'
+                ' for other models.'.format(self.output_loc, saved_columns,
+                                            self.prediction_columns))
+        self.progress_track.update_progression('prediction_columns',
+                                               self.prediction_columns)
+
     def _calc_capice(self, start, batch_size):
+        try:
+            self._process_batches(start, batch_size)
+        except BaseException:
+            self.output_writers.close(discard=True)
+            self.metrics.close()
+            raise
+        self.output_writers.close()
+        if not self.not_done:
+            # Parquet output is written as a part per checkpoint until the
+            # run is done.
+            for path in ParquetOutputWriter.find_unmerged(self.output_loc):
+                self.log.log('Merging the parts of {}.'.format(path))
+                ParquetOutputWriter.merge(path)
+            self.progress_track.update_progression('done', True)
+        self.progress_track.close()
+        self.metrics.close()
+
+    def create_reader(self, start, batch_size):
+        return CaddReader(self.filepath, self.titles, batch_size, start,
+                          key_columns=self.features_of_interest[:-1],
+                          input_offsets=self.progress_track.get_input_offsets(),
+                          region_filter=self.region_filter,
+                          shard_filter=self.shard_filter,
+                          input_range=self.input_range)
+
+    def _process_batches(self, start, batch_size):
         start_time = time.time()
         reset_timer = time.time()
-        while self.not_done:
+        if self.profiler is not None:
+            self.log.log('Profiling the first {} batches.'.format(
+                self.profiler.batches))
+            if self.workers > 1 or self.pipeline:
+                self.log.warning('Scoring in this process while profiling,'
+                                 ' the worker processes and pipeline are'
+                                 ' not used.')
+            self.profiler.start()
+        reader = self.create_reader(start, batch_size)
+        scored_elsewhere = True
+        if self.profiler is not None:
+            scored_elsewhere = False
+            batches = reader
+        elif self.workers > 1:
+            self.log.log('Scoring batches on {} worker processes.'.format(
+                self.workers))
+            batches = WorkerPool(self.model_loc, self.features_of_interest,
+                                 self.workers, self.model_threads,
+                                 self.prediction_cache).run(reader)
+        elif self.pipeline:
+            self.log.log('Running the scoring stages as a pipeline.')
+            batches = ScoringPipeline(
+                [self.scorer.impute_preprocess_batch,
+                 self.scorer.predict_batch]
+            ).run(reader)
+        else:
+            scored_elsewhere = False
+            batches = reader
+        batch_sizer = None
+        if self.memory_limit is not None:
+            self.log.log('Adapting the batch size to a memory limit of {}'
+                         ' MB.'.format(self.memory_limit))
+            batch_sizer = AdaptiveBatchSize(batch_size, self.memory_limit)
+        batch_end_time = time.time()
+        for batch in batches:
             time_iwl = time.time()
             if time_iwl - reset_timer > (60 * 60):
                 # Seconds times the amount of minutes.
@@ -187,13 +365,47 @@ class CalculateCapiceScores:
                 )
                 self.log.log('Memory usage: {} MB.'.format(
                     self.utilities.get_ram_usage()))
+                if self.metrics.last_record is not None:
+                    self.log.log(
+                        'Processing {:.0f} rows per second, projected'
+                        ' completion: {}.'.format(
+                            self.metrics.last_record[
+                                'average_rows_per_second'],
+                            self.metrics.last_record['projected_completion']))
                 if start:
                     self.log.log('Currently working on rows {} -'
                                  ' {}.'.format(start, start + batch_size))
                 reset_timer = time.time()
 
-            self.calculate_save_capice_score(start, batch_size)
-            if not start:
-                start = 0
-            start += batch_size - 1
-            self.progress_track.update_progression('start', start)
+            if scored_elsewhere:
+                self.save_batch(batch, batch.batch_size)
+            else:
+                self.calculate_save_capice_score(batch, batch.batch_size)
+            start = batch.position
+            new_batch_size = None
+            if batch_sizer is not None:
+                previous_end_time = batch_end_time
+                batch_end_time = time.time()
+                new_batch_size = batch_sizer.update(
+                    batch.position - batch.skip_rows,
+                    batch_end_time - previous_end_time)
+                if new_batch_size == batch_size:
+                    new_batch_size = None
+                else:
+                    batch_size = new_batch_size
+                    reader.batch_size = batch_size
+            started = time.perf_counter()
+            self.progress_track.save_checkpoint(start, batch.input_offsets,
+                                                batch.output_rows,
+                                                batch.output_sizes,
+                                                batch.dedup_window,
+                                                new_batch_size,
+                                                batch.output_checksums)
+            batch.timings['checkpoint'] = time.perf_counter() - started
+            self.metrics.record(batch)
+            if self.profiler is not None and self.profiler.record(batch):
+                self.profiler.stop()
+                return
+        self.not_done = False
+        if self.profiler is not None:
+            self.profiler.stop()
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+class PredictionCache:
+    """
+    Class to remember the predictions of feature rows that were scored
+    before. CADD has a row for every overlapping transcript, and these rows
+    often share all of the model's features. Rows are keyed on a 64 bit hash
+    of their features, the least recently used rows are evicted once the
+    cache holds more than `size` rows. The features of every cached row are
+    kept with its prediction and compared on a hit, so rows that only share
+    their hash are never given each other's prediction.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.predictions = OrderedDict()
+        self.rows = 0
+        self.scored = 0
+        self.hits = 0
+
+    @staticmethod
+    def hash_rows(feature_matrix):
+        return pd.util.hash_pandas_object(
+            pd.DataFrame(feature_matrix, copy=False), index=False).values
+
+    @staticmethod
+    def get_row_bytes(feature_matrix):
+        """
+        Method to view every row of a feature matrix as a single value
+        holding its bytes, to compare rows by.
+        :param feature_matrix: C-contiguous numpy array.
+        :return: numpy array of numpy.void, a value per row.
+        """
+        return feature_matrix.view(np.dtype(
+            (np.void, feature_matrix.dtype.itemsize *
+             feature_matrix.shape[1]))).ravel()
+
+    def predict(self, feature_matrix, predict):
+        """
+        Method to predict a feature matrix, scoring only the rows that
+        neither occur earlier in the matrix nor in the cache.
+        :param feature_matrix: numpy array with a row per variant.
+        :param predict: function to predict a feature matrix with.
+        :return: numpy array of float32
+        """
+        feature_matrix = np.ascontiguousarray(feature_matrix)
+        row_bytes = self.get_row_bytes(feature_matrix)
+        hashes = self.hash_rows(feature_matrix)
+        unique_hashes, first_rows, inverse = np.unique(
+            hashes, return_index=True, return_inverse=True)
+        if not (row_bytes[first_rows][inverse] == row_bytes).all():
+            # Different rows with the same hash, tell them apart by their
+            # bytes instead.
+            _, first_rows, inverse = np.unique(
+                row_bytes, return_index=True, return_inverse=True)
+            unique_hashes = hashes[first_rows]
+        unique_predictions = np.empty(len(unique_hashes), dtype=np.float32)
+        missing = []
+        for index, key in enumerate(unique_hashes.tolist()):
+            cached = self.predictions.get(key)
+            if cached is None or cached[0] != \
+                    row_bytes[first_rows[index]].tobytes():
+                missing.append(index)
+            else:
+                self.predictions.move_to_end(key)
+                unique_predictions[index] = cached[1]
+        if len(missing) > 0:
+            missing = np.array(missing, dtype=np.int64)
+            unique_predictions[missing] = predict(
+                feature_matrix[first_rows[missing]])
+            for index, key, prediction in zip(
+                    missing.tolist(), unique_hashes[missing].tolist(),
+                    unique_predictions[missing].tolist()):
+                # Rows with the same hash replace each other.
+                self.predictions[key] = (
+                    row_bytes[first_rows[index]].tobytes(), prediction)
+                self.predictions.move_to_end(key)
+            while len(self.predictions) > self.size:
+                self.predictions.popitem(last=False)
+        self.rows += feature_matrix.shape[0]
+        self.scored += len(missing)
+        self.hits += len(unique_hashes) - len(missing)
+        return unique_predictions[inverse]
+
+    def get_statistics(self):
+        """
+        Method to get the statistics of all predictions made so far.
+        :return: dict with the amount of rows predicted, the amount of rows
+        actually scored, the amount of unique rows found in the cache and
+        the fraction of rows that did not have to be scored.
+        """
+        saved = 0.0
+        if self.rows > 0:
+            saved = 1 - self.scored / self.rows
+        return {'rows': self.rows, 'scored': self.scored, 'hits': self.hits,
+                'saved': saved}
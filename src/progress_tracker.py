@@ -1,5 +1,6 @@
 from src.logger import Logger
 from src.utilities.utilities import Utilities
+from src.output_writer import GzipOutputWriter, ParquetOutputWriter
 import json
 from pathlib import Path
 import gzip
@@ -9,7 +10,12 @@ import os
 class ProgressTracker:
     """
     Class to check for existing files in terms of progress.
+    Checkpoints are appended to a journal next to progression.json, one line
+    per batch. progression.json itself is only ever replaced atomically, when
+    the journal is compacted into it.
     """
+    journal_compaction_interval = 1000
+
     def __init__(self, output_loc):
         self.output = output_loc
         self.log = Logger()
@@ -18,35 +24,49 @@ class ProgressTracker:
         self.start = None
         self.batch_size = None
         self.progress_json_loc = None
+        self.journal_loc = None
+        self.journal = None
+        self.journal_entries = 0
         self._check_for_progress_json()
+        if self.progress_json.get('finalized', False):
+            raise ValueError('The output in {} was finalized by'
+                             ' FinalizeCapice.py, which rewrites the output'
+                             ' files, so it can not be continued. Use a new'
+                             ' output directory.'.format(self.output))
+        self._restore_checkpoint()
         self._check_for_processed_files()
+        self._check_for_output_sizes()
 
     def _check_for_progress_json(self):
         progress_json = os.path.join(self.output, 'log_output',
                                      'progression.json')
         self.progress_json_loc = progress_json
+        self.journal_loc = os.path.join(self.output, 'log_output',
+                                        'progression.journal')
         is_json = self.utilities.check_if_file_exists(progress_json,
                                                       return_value=True)
         if is_json:
             with open(self.progress_json_loc) as json_file:
                 json_data = json.load(json_file)
+            self._replay_journal(json_data)
             self.log.log('Progression json found! Continuing from {}'.format(
                 json_data['start']))
             self.progress_json = json_data
             self.start = json_data['start']
             self.batch_size = json_data['batch_size']
+            if os.path.isfile(self.journal_loc):
+                # Start this run with an empty journal.
+                self._save()
         else:
             self.log.log('No progression json found,'
                          ' checking for processed files.')
             self.progress_json = {'start': None, 'batch_size': None}
-            with open(self.progress_json_loc, 'w+') as json_file:
-                json.dump(self.progress_json, json_file)
+            self._save()
 
     def _check_for_processed_files(self):
         need_to_process = []
         processed_file_nlines = self.progress_json
-        for path in Path(self.output).rglob('whole_genome_SNVs_*.tsv.gz'):
-            path = str(path)
+        for path in self._find_output_files():
             if path not in processed_file_nlines.keys():
                 self.log.log('Found progress file!: {}'.format(path))
                 processed_file_nlines[path] = 0
@@ -55,25 +75,112 @@ class ProgressTracker:
             self.log.log('Attempting to track back'
                          ' the amount of processed lines.')
             for file in need_to_process:
-                if os.path.isfile(file):
+                if file.endswith('.parquet'):
+                    processed_file_nlines[file] = \
+                        ParquetOutputWriter.count_rows(file)
+                else:
                     for line in gzip.open(file):
                         processed_file_nlines[file] += 1
-            total_lines = -10
+            tsv_lines = 0
+            parquet_lines = 0
             for key, nline in processed_file_nlines.items():
-                if os.path.isfile(key):
-                    total_lines += nline
+                if key.endswith('.parquet') and (
+                        os.path.isfile(key) or os.path.isdir(
+                            key + ParquetOutputWriter.parts_suffix)):
+                    parquet_lines += nline
+                elif os.path.isfile(key):
+                    tsv_lines += nline
+            # Both formats hold the same rows when both are written.
+            total_lines = max(tsv_lines, parquet_lines) - 10
             self.log.log('Amount of lines found: {}'.format(total_lines))
             self.start = total_lines
             processed_file_nlines['start'] = self.start
-            with open(self.progress_json_loc, 'w') as progress_json:
-                json.dump(processed_file_nlines,
-                          progress_json)
+            processed_file_nlines.pop('input_offsets', None)
+            processed_file_nlines.pop('dedup_window', None)
+            self.progress_json = processed_file_nlines
+            self._save()
             self.log.log('Start {} has been saved in:'
                          ' {}'.format(self.start, self.progress_json_loc))
         with open(self.progress_json_loc) as p_json:
             self.progress_json = json.load(p_json)
             p_json.close()
 
+    def _find_output_files(self):
+        paths = list(Path(self.output).rglob('whole_genome_SNVs_*.tsv.gz'))
+        paths += list(Path(self.output).rglob('whole_genome_SNVs_*.parquet'))
+        paths = [str(path) for path in paths]
+        return paths + [path for path in ParquetOutputWriter.find_unmerged(
+            self.output) if path not in paths]
+
+    @staticmethod
+    def _get_output_size(path):
+        if path.endswith('.parquet'):
+            return ParquetOutputWriter.count_row_groups(path)
+        return os.path.getsize(path)
+
+    @staticmethod
+    def _truncate_output(path, size):
+        if path.endswith('.parquet'):
+            ParquetOutputWriter.truncate(path, size)
+        elif size == 0:
+            os.remove(path)
+        else:
+            with open(path, 'r+b') as output_file:
+                output_file.truncate(size)
+                os.fsync(output_file.fileno())
+
+    def _restore_checkpoint(self):
+        """
+        Method to bring the output files back to the last checkpoint. Output
+        written after it is cut off, output files created after it are
+        removed, so the run can continue from the checkpoint without
+        recounting any lines. An output smaller than at the checkpoint lost
+        rows that were counted as written, and an output of which the bytes
+        before the checkpoint size no longer match the checksum saved with
+        it was changed after the run wrote it. Both stop the run rather than
+        cutting the file. The output of a run that is done is left alone.
+        """
+        output_sizes = self.progress_json.get('output_sizes')
+        if output_sizes is None or self.progress_json.get('done', False):
+            return
+        output_checksums = self.progress_json.get('output_checksums', {})
+        for path in self._find_output_files():
+            size = self._get_output_size(path)
+            checkpoint_size = output_sizes.get(path, 0)
+            if size >= checkpoint_size > 0 and path in output_checksums and \
+                    GzipOutputWriter.get_file_checksum(
+                        path, checkpoint_size) != output_checksums[path]:
+                raise ValueError('Output {} does not end in what was written'
+                                 ' at the last checkpoint, it was changed'
+                                 ' after the run wrote it. Use a new output'
+                                 ' directory, or remove {} to recount the'
+                                 ' processed lines from the output'
+                                 ' files.'.format(path,
+                                                  self.progress_json_loc))
+            if size > checkpoint_size:
+                self.log.log('Output {} is larger than at the last'
+                             ' checkpoint, truncating from {} to {}.'.format(
+                                path, size, checkpoint_size))
+                self._truncate_output(path, checkpoint_size)
+            elif size < checkpoint_size:
+                raise ValueError('Output {} is smaller than at the last'
+                                 ' checkpoint ({} < {}), so rows counted as'
+                                 ' written are lost. Remove {} to recount'
+                                 ' the processed lines from the output'
+                                 ' files.'.format(path, size, checkpoint_size,
+                                                  self.progress_json_loc))
+
+    def _check_for_output_sizes(self):
+        if 'output_sizes' not in self.progress_json:
+            self.progress_json['output_sizes'] = {
+                path: self._get_output_size(path)
+                for path in self._find_output_files()}
+            self.progress_json['output_checksums'] = {
+                path: GzipOutputWriter.get_file_checksum(path, size)
+                for path, size in self.progress_json['output_sizes'].items()
+                if not path.endswith('.parquet')}
+            self._save()
+
     def is_in_progression_json(self, key):
         return_value = False
         if key in self.progress_json.keys():
@@ -83,6 +190,12 @@ class ProgressTracker:
     def get_start_and_batchsize(self):
         return self.start, self.batch_size
 
+    def get_input_offsets(self):
+        return self.progress_json.get('input_offsets')
+
+    def get_dedup_window(self):
+        return self.progress_json.get('dedup_window')
+
     def get_progression_loc(self):
         return self.progress_json_loc
 
@@ -101,5 +214,133 @@ class ProgressTracker:
             self.progress_json[key] = value
             self.log.log('No progression found on {}, adding'
                          ' to progression json.'.format(key))
-        with open(self.progress_json_loc, 'w') as json_file:
-            json.dump(self.progress_json, json_file)
+        self._save()
+
+    def save_checkpoint(self, start, input_offsets, output_rows,
+                        output_sizes, dedup_window=None, batch_size=None,
+                        output_checksums=None):
+        """
+        Method to save the progress after a batch as a single journal entry.
+        :param start: the amount of input lines processed.
+        :param input_offsets: dict of the input offsets after the batch.
+        :param output_rows: dict of output path and its total amount of rows.
+        :param output_sizes: dict of output path and its size on disk.
+        :param dedup_window: dict of chromosome and its deduplication window,
+        for the chromosomes of the batch.
+        :param batch_size: the batch size to continue with, when it changed.
+        :param output_checksums: dict of output path and the checksum of its
+        last bytes.
+        """
+        entry = {'start': start, 'input_offsets': input_offsets,
+                 'output_rows': output_rows, 'output_sizes': output_sizes,
+                 'dedup_window': dedup_window}
+        if batch_size is not None:
+            entry['batch_size'] = batch_size
+            self.batch_size = batch_size
+        if output_checksums is not None:
+            entry['output_checksums'] = output_checksums
+        self._apply_entry(self.progress_json, entry)
+        if self.journal is None:
+            self.journal = open(self.journal_loc, 'a')
+        self.journal.write(json.dumps(entry) + '\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.journal_entries += 1
+        if self.journal_entries >= self.journal_compaction_interval:
+            self._save()
+
+    @staticmethod
+    def _apply_entry(progress_json, entry):
+        progress_json['start'] = entry['start']
+        progress_json['input_offsets'] = entry['input_offsets']
+        progress_json.update(entry['output_rows'])
+        progress_json.setdefault('output_sizes', {}).update(
+            entry['output_sizes'])
+        if entry.get('batch_size') is not None:
+            progress_json['batch_size'] = entry['batch_size']
+        if entry.get('output_checksums') is not None:
+            progress_json.setdefault('output_checksums', {}).update(
+                entry['output_checksums'])
+        if entry.get('dedup_window') is not None:
+            progress_json.setdefault('dedup_window', {}).update(
+                entry['dedup_window'])
+
+    def _replay_journal(self, progress_json):
+        """
+        Method to apply the journal entries written since the last
+        compaction. Entries hold absolute values, so replaying an entry that
+        is already part of progression.json does no harm. A last line cut
+        off by a crash is ignored.
+        :param progress_json: dict loaded from progression.json.
+        """
+        if not os.path.isfile(self.journal_loc):
+            return
+        with open(self.journal_loc) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    self.log.warning('Ignoring incomplete progression'
+                                     ' journal entry.')
+                    break
+                self._apply_entry(progress_json, entry)
+                self.journal_entries += 1
+
+    @classmethod
+    def mark_finalized(cls, output_loc):
+        """
+        Method to mark an output directory as finalized, before its output
+        files are rewritten. The sizes and checksums of the last checkpoint
+        no longer describe the files, so they are dropped, and the
+        directory can no longer be continued.
+        :param output_loc: the output directory of PreComputeCapice.py.
+        :return: bool, whether the run was done.
+        """
+        log_loc = os.path.join(output_loc, 'log_output')
+        Utilities.check_if_dir_exists(log_loc)
+        progress_json_loc = os.path.join(log_loc, 'progression.json')
+        journal_loc = os.path.join(log_loc, 'progression.journal')
+        progress_json = {}
+        if os.path.isfile(progress_json_loc):
+            with open(progress_json_loc) as json_file:
+                progress_json = json.load(json_file)
+        if os.path.isfile(journal_loc):
+            with open(journal_loc) as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    cls._apply_entry(progress_json, entry)
+        progress_json.pop('output_sizes', None)
+        progress_json.pop('output_checksums', None)
+        progress_json['finalized'] = True
+        cls._write_json(progress_json_loc, progress_json)
+        if os.path.isfile(journal_loc):
+            os.remove(journal_loc)
+        return progress_json.get('done', False)
+
+    @staticmethod
+    def _write_json(path, data):
+        temporary_loc = path + '.tmp'
+        with open(temporary_loc, 'w') as json_file:
+            json.dump(data, json_file)
+            json_file.flush()
+            os.fsync(json_file.fileno())
+        os.replace(temporary_loc, path)
+
+    def _save(self):
+        """
+        Method to compact the progression into progression.json, replacing
+        it atomically, after which the journal is emptied.
+        """
+        self._write_json(self.progress_json_loc, self.progress_json)
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if os.path.isfile(self.journal_loc):
+            os.remove(self.journal_loc)
+        self.journal_entries = 0
+
+    def close(self):
+        self._save()
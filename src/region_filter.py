@@ -0,0 +1,137 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+class RegionFilter:
+    """
+    Class to restrict scoring to a set of regions and whole chromosomes.
+    Overlapping regions are merged, so every position is looked up with a
+    single binary search. Chromosomes are stored without a chr prefix, the
+    way CADD names them.
+    """
+
+    def __init__(self, regions=None, chromosomes=None):
+        self.chromosomes = set()
+        self.starts = {}
+        self.ends = {}
+        for chromosome in chromosomes or []:
+            self.chromosomes.add(self._strip_prefix(chromosome))
+        parsed = {}
+        for region in regions or []:
+            if os.path.isfile(region):
+                found = self._read_bed(region)
+            else:
+                found = [self._parse_region(region)]
+            for chromosome, start, end in found:
+                parsed.setdefault(chromosome, []).append((start, end))
+        for chromosome, intervals in parsed.items():
+            if chromosome in self.chromosomes:
+                continue
+            self._merge(chromosome, intervals)
+
+    @staticmethod
+    def _strip_prefix(chromosome):
+        chromosome = str(chromosome).strip()
+        if chromosome.lower().startswith('chr'):
+            chromosome = chromosome[3:]
+        return chromosome
+
+    def _parse_region(self, region):
+        """
+        Method to parse a region written as chr:start-end, chr:pos or chr,
+        with 1-based inclusive positions.
+        :param region: str
+        :return: tuple of chromosome, start and end.
+        """
+        chromosome, _, positions = region.replace(',', '').partition(':')
+        chromosome = self._strip_prefix(chromosome)
+        try:
+            if positions == '':
+                return chromosome, 1, np.iinfo(np.int64).max
+            start, _, end = positions.partition('-')
+            start = int(start)
+            end = int(end) if end != '' else start
+        except ValueError:
+            raise ValueError('Region {} is not a BED file nor formatted as'
+                             ' chr:start-end.'.format(region))
+        if end < start:
+            raise ValueError('Region {} ends before it starts.'.format(
+                region))
+        return chromosome, start, end
+
+    def _read_bed(self, path):
+        """
+        Method to read the regions of a BED file, which are 0-based and
+        exclude their end, as 1-based inclusive regions.
+        :param path: path to the BED file, optionally gzipped.
+        :return: list of tuples of chromosome, start and end.
+        """
+        bed = pd.read_csv(path, sep='\t', header=None, usecols=[0, 1, 2],
+                          names=['chrom', 'start', 'end'],
+                          dtype={'chrom': str}, comment='#')
+        bed = bed[~bed['chrom'].str.startswith(('track', 'browser'))]
+        return [(self._strip_prefix(chromosome), int(start) + 1, int(end))
+                for chromosome, start, end in bed.itertuples(index=False)]
+
+    def _merge(self, chromosome, intervals):
+        intervals.sort()
+        starts = []
+        ends = []
+        for start, end in intervals:
+            if len(ends) > 0 and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+                continue
+            starts.append(start)
+            ends.append(end)
+        self.starts[chromosome] = np.array(starts, dtype=np.int64)
+        self.ends[chromosome] = np.array(ends, dtype=np.int64)
+
+    def get_chromosomes(self):
+        return self.chromosomes | set(self.starts.keys())
+
+    def describe(self):
+        return '{} whole chromosomes and {} regions on {} chromosomes'.format(
+            len(self.chromosomes),
+            sum(len(starts) for starts in self.starts.values()),
+            len(self.starts))
+
+    def select(self, variants_df):
+        """
+        Method to mark the variants within the regions or chromosomes.
+        :param variants_df: pandas DataFrame with #Chr and Pos columns.
+        :return: numpy array of bools.
+        """
+        chromosomes = variants_df['#Chr'].astype(str).values
+        positions = variants_df['Pos'].values
+        selected = np.isin(chromosomes, list(self.chromosomes))
+        for chromosome, starts in self.starts.items():
+            on_chromosome = chromosomes == chromosome
+            if not on_chromosome.any():
+                continue
+            chromosome_positions = positions[on_chromosome]
+            region = np.searchsorted(starts, chromosome_positions,
+                                     side='right') - 1
+            selected[on_chromosome] = (region >= 0) & (
+                chromosome_positions <= self.ends[chromosome][
+                    np.maximum(region, 0)])
+        return selected
+
+    def spans(self, file_chromosomes):
+        """
+        Method to list the parts of the input to read, in the order of the
+        chromosomes in the input.
+        :param file_chromosomes: list of the chromosome names in the input.
+        :return: list of tuples of the chromosome name in the input, start
+        and end.
+        """
+        spans = []
+        for name in file_chromosomes:
+            chromosome = self._strip_prefix(name)
+            if chromosome in self.chromosomes:
+                spans.append((name, 1, np.iinfo(np.int64).max))
+            elif chromosome in self.starts:
+                spans += [(name, int(start), int(end)) for start, end in
+                          zip(self.starts[chromosome],
+                              self.ends[chromosome])]
+        return spans
@@ -0,0 +1,150 @@
+import json
+import os
+import time
+from datetime import datetime
+from src.utilities.utilities import Utilities
+
+
+class RunMetrics:
+    """
+    Class to record after every batch the time spent in every stage, the
+    rows going in and out, the throughput, the memory usage and the
+    projected completion time. Records are appended to metrics.jsonl in
+    log_output, or written to capice_metrics.prom in the Prometheus text
+    format, which is replaced atomically so it can be scraped at any time.
+    """
+    stages = ['read', 'impute', 'preprocess', 'predict', 'dedup', 'write',
+              'checkpoint']
+
+    def __init__(self, output_loc, input_size, metrics_format='jsonl',
+                 input_start=0):
+        log_dir = os.path.join(output_loc, 'log_output')
+        Utilities.check_if_dir_exists(log_dir)
+        self.jsonl_loc = None
+        self.prometheus_loc = None
+        if metrics_format in ('jsonl', 'both'):
+            self.jsonl_loc = os.path.join(log_dir, 'metrics.jsonl')
+        if metrics_format in ('prometheus', 'both'):
+            self.prometheus_loc = os.path.join(log_dir, 'capice_metrics.prom')
+        # Compressed offsets the part of the input this run scores ends and
+        # starts at.
+        self.input_size = input_size
+        self.input_start = input_start
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        self.first_offset = None
+        self.first_offset_time = None
+        self.batches = 0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.stage_seconds = dict.fromkeys(self.stages, 0.0)
+        self.last_record = None
+        self.jsonl_file = None
+
+    def _projected_completion(self, compressed_offset, now):
+        if compressed_offset is None or \
+                self.input_size <= self.input_start:
+            return None, None
+        progress = min(max(compressed_offset - self.input_start, 0) /
+                       (self.input_size - self.input_start), 1.0)
+        if self.first_offset is None:
+            self.first_offset = compressed_offset
+            self.first_offset_time = now
+            return progress, None
+        elapsed = now - self.first_offset_time
+        processed = compressed_offset - self.first_offset
+        if elapsed <= 0 or processed <= 0:
+            return progress, None
+        remaining = (self.input_size - compressed_offset) * elapsed / processed
+        return progress, now + max(remaining, 0)
+
+    def record(self, batch):
+        """
+        Method to record the metrics of a batch that has been checkpointed.
+        :param batch: CaddBatch with its stage timings.
+        :return: dict of the recorded metrics.
+        """
+        now = time.time()
+        rows_in = batch.position - batch.skip_rows
+        rows_out = batch.rows_out or 0
+        self.batches += 1
+        self.rows_in += rows_in
+        self.rows_out += rows_out
+        for stage in self.stages:
+            self.stage_seconds[stage] += batch.timings.get(stage, 0.0)
+        batch_seconds = now - self.last_time
+        self.last_time = now
+        progress, completion = self._projected_completion(
+            batch.compressed_offset, now)
+        record = {
+            'time': datetime.fromtimestamp(now).isoformat(),
+            'batch': self.batches,
+            'position': batch.position,
+            'rows_in': rows_in,
+            'rows_out': rows_out,
+            'seconds': {stage: batch.timings.get(stage, 0.0)
+                        for stage in self.stages},
+            'batch_seconds': batch_seconds,
+            'rows_per_second': rows_in / batch_seconds
+            if batch_seconds > 0 else None,
+            'average_rows_per_second': self.rows_in / (now - self.start_time),
+            'rss_mb': Utilities.get_ram_usage(children=True),
+            'progress': progress,
+            'projected_completion': datetime.fromtimestamp(
+                completion).isoformat() if completion is not None else None
+        }
+        self.last_record = record
+        if self.jsonl_loc is not None:
+            self._write_jsonl(record)
+        if self.prometheus_loc is not None:
+            self._write_prometheus(record, now, completion)
+        return record
+
+    def _write_jsonl(self, record):
+        if self.jsonl_file is None:
+            self.jsonl_file = open(self.jsonl_loc, 'a')
+        self.jsonl_file.write(json.dumps(record) + '\n')
+        self.jsonl_file.flush()
+
+    def _write_prometheus(self, record, now, completion):
+        lines = ['# HELP capice_stage_seconds_total Seconds spent in every'
+                 ' stage of the scoring loop.',
+                 '# TYPE capice_stage_seconds_total counter']
+        for stage in self.stages:
+            lines.append('capice_stage_seconds_total{{stage="{}"}} {}'.format(
+                stage, self.stage_seconds[stage]))
+        metrics = [
+            ('capice_batches_total', 'counter',
+             'Batches processed by this run.', self.batches),
+            ('capice_rows_in_total', 'counter',
+             'CADD rows read by this run.', self.rows_in),
+            ('capice_rows_out_total', 'counter',
+             'Rows written by this run, after deduplication.',
+             self.rows_out),
+            ('capice_rows_per_second', 'gauge',
+             'CADD rows read per second over the last batch.',
+             record['rows_per_second']),
+            ('capice_rss_bytes', 'gauge',
+             'Resident memory of the run and its worker processes.',
+             record['rss_mb'] * 1000000),
+            ('capice_progress_ratio', 'gauge',
+             'Fraction of the CADD file processed.', record['progress']),
+            ('capice_projected_completion_timestamp_seconds', 'gauge',
+             'Projected time the CADD file is done.', completion),
+            ('capice_last_batch_timestamp_seconds', 'gauge',
+             'Time the last batch was checkpointed.', now)]
+        for name, metric_type, description, value in metrics:
+            if value is None:
+                continue
+            lines += ['# HELP {} {}'.format(name, description),
+                      '# TYPE {} {}'.format(name, metric_type),
+                      '{} {}'.format(name, value)]
+        temporary_loc = self.prometheus_loc + '.tmp'
+        with open(temporary_loc, 'w') as prometheus_file:
+            prometheus_file.write('\n'.join(lines) + '\n')
+        os.replace(temporary_loc, self.prometheus_loc)
+
+    def close(self):
+        if self.jsonl_file is not None:
+            self.jsonl_file.close()
+            self.jsonl_file = None
@@ -0,0 +1,130 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from src.logger import Logger
+from src.run_metrics import RunMetrics
+from src.utilities.utilities import Utilities
+
+
+class RunProfiler:
+    """
+    Class to profile the first batches of a run with cProfile and
+    tracemalloc. Once the given amount of batches is checkpointed, a
+    hotspot report, the top allocation sites and a breakdown of the time
+    spent per stage are written to log_output, together with the raw
+    cProfile statistics for tools like snakeviz.
+    """
+    # Functions and allocation sites listed in the reports.
+    top = 40
+    # Frames kept per allocation, to show where in the scoring loop the
+    # allocating pandas or numpy code was called from.
+    frames = 8
+
+    def __init__(self, output_loc, batches):
+        self.log = Logger()
+        self.log_dir = os.path.join(output_loc, 'log_output')
+        Utilities.check_if_dir_exists(self.log_dir)
+        self.batches = batches
+        self.profiled = 0
+        self.rows = 0
+        self.stage_seconds = dict.fromkeys(RunMetrics.stages, 0.0)
+        self.profile = None
+        self.baseline = None
+        self.start_time = None
+
+    def start(self):
+        tracemalloc.start(self.frames)
+        self.baseline = tracemalloc.take_snapshot()
+        self.profile = cProfile.Profile()
+        self.start_time = time.perf_counter()
+        self.profile.enable()
+
+    def record(self, batch):
+        """
+        Method to add the stage timings of a checkpointed batch.
+        :param batch: CaddBatch with its stage timings.
+        :return: bool, True once enough batches are profiled.
+        """
+        self.profiled += 1
+        self.rows += batch.position - batch.skip_rows
+        for stage in self.stage_seconds:
+            self.stage_seconds[stage] += batch.timings.get(stage, 0.0)
+        return self.profiled >= self.batches
+
+    def stop(self):
+        """
+        Method to stop profiling and write the reports.
+        :return: list of the paths of the reports.
+        """
+        self.profile.disable()
+        seconds = time.perf_counter() - self.start_time
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        paths = [self._write_hotspots(), self._write_allocations(
+            snapshot, current, peak), self._write_stages(seconds)]
+        self.log.log('Profiled {} batches, reports written to {}.'.format(
+            self.profiled, ', '.join(paths)))
+        return paths
+
+    def _write(self, name, text):
+        path = os.path.join(self.log_dir, name)
+        with open(path, 'w') as report_file:
+            report_file.write(text)
+        return path
+
+    def _write_hotspots(self):
+        self.profile.dump_stats(os.path.join(self.log_dir, 'profile.prof'))
+        report = io.StringIO()
+        statistics = pstats.Stats(self.profile, stream=report)
+        statistics.strip_dirs()
+        report.write('Functions by time spent in the function itself:\n')
+        statistics.sort_stats('tottime').print_stats(self.top)
+        report.write('Functions by time spent including the functions they'
+                     ' call:\n')
+        statistics.sort_stats('cumulative').print_stats(self.top)
+        return self._write('profile_hotspots.txt', report.getvalue())
+
+    def _write_allocations(self, snapshot, current, peak):
+        filters = (tracemalloc.Filter(False, tracemalloc.__file__),
+                   tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                   tracemalloc.Filter(False, '<unknown>'))
+        snapshot = snapshot.filter_traces(filters)
+        baseline = self.baseline.filter_traces(filters)
+        lines = ['Traced memory: {:.1f} MB at the end, {:.1f} MB at the'
+                 ' peak.'.format(current / 1e6, peak / 1e6), '',
+                 'Allocation sites holding the most memory at the end:']
+        lines += [str(statistic) for statistic in
+                  snapshot.statistics('lineno')[:self.top]]
+        lines += ['', 'Allocation sites that grew the most since the'
+                      ' start:']
+        lines += [str(statistic) for statistic in
+                  snapshot.compare_to(baseline, 'lineno')[:self.top]]
+        lines += ['', 'Call stacks of the largest allocation sites:']
+        for statistic in snapshot.statistics('traceback')[:5]:
+            lines.append('{:.1f} KB in {} blocks'.format(
+                statistic.size / 1e3, statistic.count))
+            lines += ['    ' + line for line in
+                      statistic.traceback.format(most_recent_first=True)]
+        return self._write('profile_allocations.txt', '\n'.join(lines) + '\n')
+
+    def _write_stages(self, seconds):
+        lines = ['Profiled {} batches of {} rows in total in {:.2f}'
+                 ' seconds, {:.0f} rows per second.'.format(
+                     self.profiled, self.rows, seconds,
+                     self.rows / seconds if seconds > 0 else 0), '',
+                 '{:<12}{:>12}{:>16}{:>10}'.format(
+                     'stage', 'seconds', 'per batch', 'share')]
+        stages = list(self.stage_seconds.items())
+        stages.append(('other', max(seconds - sum(self.stage_seconds.values()),
+                                    0.0)))
+        for stage, stage_seconds in stages:
+            lines.append('{:<12}{:>12.3f}{:>16.4f}{:>10.1%}'.format(
+                stage, stage_seconds, stage_seconds / max(self.profiled, 1),
+                stage_seconds / seconds if seconds > 0 else 0))
+        lines += ['', 'Timings include the profiling overhead, other holds'
+                      ' the time outside the stages.']
+        return self._write('profile_stages.txt', '\n'.join(lines) + '\n')
@@ -0,0 +1,283 @@
+import glob
+import gzip
+import io
+import json
+import os
+import numpy as np
+import pandas as pd
+from src.output_writer import BgzfOutputWriter
+from src.utilities.bgzf import BgzfReader, is_bgzf
+
+# Uncompressed bytes to parse at once while building an index.
+_INDEX_GROUP_SIZE = 1 << 22
+
+
+class ScoreIndexBuilder:
+    """
+    Class to build the position index of a chromosome output file: a
+    compact offset table with, for every BGZF block, the virtual offset of
+    the first line starting in that block, the amount of lines starting in
+    it and their lowest and highest position. Output written as plain gzip
+    is rewritten as BGZF first.
+    """
+
+    def __init__(self, compression_level=6):
+        self.compression_level = compression_level
+
+    @staticmethod
+    def index_path(path):
+        return path + '.cpi'
+
+    def finalize(self, path):
+        """
+        Method to convert an output file to BGZF when needed and build its
+        position index.
+        :param path: path to a whole_genome_SNVs_chr_*.tsv.gz file.
+        :return: path to the index.
+        """
+        if not is_bgzf(path):
+            self._convert_to_bgzf(path)
+        return self.build(path)
+
+    def _convert_to_bgzf(self, path):
+        converted = path + '.bgzf.tmp'
+        if os.path.isfile(converted):
+            os.remove(converted)
+        writer = BgzfOutputWriter(converted, self.compression_level)
+        with gzip.open(path, 'rb') as source:
+            while True:
+                data = source.read(_INDEX_GROUP_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+        writer.close()
+        os.replace(converted, path)
+
+    def build(self, path):
+        entries = _IndexEntries()
+        reader = BgzfReader(path)
+        group = []
+        group_size = 0
+        for offset, data in reader.blocks():
+            group.append((offset, data))
+            group_size += len(data)
+            if group_size >= _INDEX_GROUP_SIZE:
+                entries.add_group(group)
+                group = []
+                group_size = 0
+        entries.add_group(group, last=True)
+        reader.close()
+        index_path = self.index_path(path)
+        with open(index_path + '.tmp', 'wb') as index_file:
+            np.savez(index_file, file_size=os.path.getsize(path),
+                     **entries.to_arrays())
+        os.replace(index_path + '.tmp', index_path)
+        return index_path
+
+
+class _IndexEntries:
+    """
+    Class to collect the index entries while the blocks of a file are
+    parsed group by group. A line that continues past the end of a group is
+    carried over to the next one.
+    """
+
+    def __init__(self):
+        self.block_offsets = []
+        self.virtual_offsets = []
+        self.nlines = []
+        self.min_positions = []
+        self.max_positions = []
+        self.carry = b''
+        self.carry_block = None
+        self.carry_virtual_offset = None
+
+    def add_group(self, group, last=False):
+        buffer = self.carry + b''.join(data for _, data in group)
+        block_starts = np.cumsum([len(self.carry)] +
+                                 [len(data) for _, data in group])[:-1]
+        block_offsets = np.array([offset for offset, _ in group],
+                                 dtype=np.int64)
+        newlines = np.flatnonzero(
+            np.frombuffer(buffer, dtype=np.uint8) == ord('\n'))
+        if last and len(buffer) > 0 and (
+                len(newlines) == 0 or newlines[-1] != len(buffer) - 1):
+            buffer += b'\n'
+            newlines = np.append(newlines, len(buffer) - 1)
+        if len(newlines) == 0:
+            self._set_carry(buffer, 0, block_starts, block_offsets)
+            return
+        line_starts = np.concatenate([[0], newlines[:-1] + 1])
+        line_blocks = np.searchsorted(block_starts, line_starts,
+                                      side='right') - 1
+        line_block_offsets = block_offsets[np.maximum(line_blocks, 0)]
+        line_virtual_offsets = (line_block_offsets << 16) | (
+            line_starts - block_starts[np.maximum(line_blocks, 0)])
+        if len(self.carry) > 0:
+            line_block_offsets[0] = self.carry_block
+            line_virtual_offsets[0] = self.carry_virtual_offset
+        positions = pd.read_csv(io.BytesIO(buffer[:newlines[-1] + 1]),
+                                sep='\t', header=None, usecols=[1],
+                                skip_blank_lines=False)[1].values
+        self._add_lines(line_block_offsets, line_virtual_offsets,
+                        positions.astype(np.int64))
+        self._set_carry(buffer, newlines[-1] + 1, block_starts,
+                        block_offsets)
+
+    def _set_carry(self, buffer, start, block_starts, block_offsets):
+        if start == 0 and len(self.carry) > 0:
+            self.carry = buffer
+            return
+        self.carry = buffer[start:]
+        if len(self.carry) > 0:
+            block = np.searchsorted(block_starts, start, side='right') - 1
+            self.carry_block = int(block_offsets[block])
+            self.carry_virtual_offset = (self.carry_block << 16) | int(
+                start - block_starts[block])
+
+    def _add_lines(self, block_offsets, virtual_offsets, positions):
+        firsts = np.flatnonzero(np.concatenate(
+            [[True], block_offsets[1:] != block_offsets[:-1]]))
+        counts = np.diff(np.append(firsts, len(block_offsets)))
+        minimums = np.minimum.reduceat(positions, firsts)
+        maximums = np.maximum.reduceat(positions, firsts)
+        for entry, first in enumerate(firsts):
+            block_offset = int(block_offsets[first])
+            if len(self.block_offsets) > 0 and \
+                    self.block_offsets[-1] == block_offset:
+                self.nlines[-1] += int(counts[entry])
+                self.min_positions[-1] = min(self.min_positions[-1],
+                                             int(minimums[entry]))
+                self.max_positions[-1] = max(self.max_positions[-1],
+                                             int(maximums[entry]))
+                continue
+            self.block_offsets.append(block_offset)
+            self.virtual_offsets.append(int(virtual_offsets[first]))
+            self.nlines.append(int(counts[entry]))
+            self.min_positions.append(int(minimums[entry]))
+            self.max_positions.append(int(maximums[entry]))
+
+    def to_arrays(self):
+        return {
+            'virtual_offsets': np.array(self.virtual_offsets,
+                                        dtype=np.uint64),
+            'nlines': np.array(self.nlines, dtype=np.int64),
+            'min_positions': np.array(self.min_positions, dtype=np.int64),
+            'max_positions': np.array(self.max_positions, dtype=np.int64)
+        }
+
+
+class ScoreLookup:
+    """
+    Class to look up precomputed CAPICE scores in the output directory
+    through the position index of every chromosome output file. Output
+    scored with several models has the prediction columns saved in the
+    progression.
+    """
+    key_columns = ['#Chr', 'Pos', 'Ref', 'Alt', 'GeneID', 'CCDS',
+                   'FeatureID']
+
+    def __init__(self, output_loc, cache_size=64):
+        self.output_loc = output_loc
+        self.cache_size = cache_size
+        self.indexes = {}
+        self.readers = {}
+        self.columns = self.key_columns + self.get_prediction_columns(
+            output_loc)
+
+    @staticmethod
+    def get_prediction_columns(output_loc):
+        """
+        Method to get the prediction columns of the output directory.
+        :param output_loc: the output directory of PreComputeCapice.py.
+        :return: list of str
+        """
+        # Merged shards have their progressions in the shard directories.
+        progression_locs = [os.path.join(output_loc, 'log_output',
+                                         'progression.json')] + sorted(
+            glob.glob(os.path.join(output_loc, 'shard_*', 'log_output',
+                                   'progression.json')))
+        for progression_loc in progression_locs:
+            if os.path.isfile(progression_loc):
+                with open(progression_loc) as progression_file:
+                    return json.load(progression_file).get(
+                        'prediction_columns', ['prediction'])
+        return ['prediction']
+
+    def _output_path(self, chromosome):
+        return os.path.join(self.output_loc, 'chr{}'.format(chromosome),
+                            'whole_genome_SNVs_chr_{}.tsv.gz'.format(
+                                chromosome))
+
+    def _load(self, chromosome):
+        chromosome = str(chromosome)
+        if chromosome not in self.indexes:
+            path = self._output_path(chromosome)
+            index_path = ScoreIndexBuilder.index_path(path)
+            if not os.path.isfile(index_path):
+                raise FileNotFoundError(
+                    'No index found for {}, run FinalizeCapice.py'
+                    ' first.'.format(path))
+            index = dict(np.load(index_path))
+            if int(index['file_size']) != os.path.getsize(path):
+                raise ValueError('Index {} is out of date, run'
+                                 ' FinalizeCapice.py again.'.format(
+                                     index_path))
+            max_positions = index['max_positions']
+            index['is_sorted'] = bool(np.all(
+                max_positions[1:] >= max_positions[:-1]) and np.all(
+                index['min_positions'][1:] >= max_positions[:-1]))
+            self.indexes[chromosome] = index
+            self.readers[chromosome] = BgzfReader(path, self.cache_size)
+        return self.indexes[chromosome], self.readers[chromosome]
+
+    def lookup(self, chromosome, pos, ref=None, alt=None):
+        """
+        Method to look up the scores of a single variant.
+        :param chromosome: str, chromosome without the chr prefix.
+        :param pos: int, position.
+        :param ref: optional str, reference allele.
+        :param alt: optional str, alternative allele.
+        :return: pandas DataFrame with one row per transcript.
+        """
+        found = self.lookup_region(chromosome, pos, pos)
+        if ref is not None:
+            found = found[found['Ref'] == ref]
+        if alt is not None:
+            found = found[found['Alt'] == alt]
+        return found.reset_index(drop=True)
+
+    def lookup_region(self, chromosome, start, end):
+        """
+        Method to look up the scores of all variants in a region.
+        :param chromosome: str, chromosome without the chr prefix.
+        :param start: int, first position, inclusive.
+        :param end: int, last position, inclusive.
+        :return: pandas DataFrame
+        """
+        index, reader = self._load(chromosome)
+        min_positions = index['min_positions']
+        max_positions = index['max_positions']
+        if index['is_sorted']:
+            first = np.searchsorted(max_positions, start, side='left')
+            last = np.searchsorted(min_positions, end, side='right')
+            candidates = np.arange(first, last)
+        else:
+            candidates = np.flatnonzero((min_positions <= end) &
+                                        (max_positions >= start))
+        pieces = [reader.read_lines(int(index['virtual_offsets'][entry]),
+                                    int(index['nlines'][entry]))
+                  for entry in candidates]
+        if len(pieces) == 0:
+            return pd.DataFrame(columns=self.columns)
+        found = pd.read_csv(io.BytesIO(b''.join(pieces)), sep='\t',
+                            header=None, names=self.columns,
+                            dtype={'#Chr': str})
+        found = found[(found['Pos'] >= start) & (found['Pos'] <= end)]
+        return found.reset_index(drop=True)
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
+        self.indexes = {}
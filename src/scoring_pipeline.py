@@ -0,0 +1,95 @@
+import queue
+import threading
+
+
+class ScoringPipeline:
+    """
+    Class to run the reading, impute/preprocess and prediction stages of the
+    scoring loop concurrently. Every stage runs in its own thread and is
+    connected to the next stage through a bounded queue, so a fast stage
+    blocks instead of piling up batches in memory.
+    """
+    _end_of_stream = object()
+
+    def __init__(self, stages, queue_size=2):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.threads = []
+        self.error = None
+        self.stopped = threading.Event()
+
+    def run(self, batches):
+        """
+        Generator to push the batches through all stages.
+        :param batches: iterable of CaddBatch, read in its own thread.
+        :return: generator of processed batches, in input order.
+        """
+        in_queue = queue.Queue(maxsize=self.queue_size)
+        self._start_thread(self._feed, batches, in_queue)
+        for stage in self.stages:
+            out_queue = queue.Queue(maxsize=self.queue_size)
+            self._start_thread(self._run_stage, stage, in_queue, out_queue)
+            in_queue = out_queue
+        try:
+            while True:
+                batch = self._get(in_queue)
+                if batch is self._end_of_stream:
+                    break
+                yield batch
+        finally:
+            self.stopped.set()
+            for thread in self.threads:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _feed(self, batches, out_queue):
+        try:
+            for batch in batches:
+                if not self._put(out_queue, batch):
+                    return
+        except Exception as error:
+            self._fail(error)
+            return
+        self._put(out_queue, self._end_of_stream)
+
+    def _run_stage(self, stage, in_queue, out_queue):
+        while True:
+            batch = self._get(in_queue)
+            if batch is self._end_of_stream:
+                self._put(out_queue, self._end_of_stream)
+                return
+            try:
+                batch = stage(batch)
+            except Exception as error:
+                self._fail(error)
+                return
+            if not self._put(out_queue, batch):
+                return
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stopped.set()
+
+    def _put(self, out_queue, item):
+        while not self.stopped.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, in_queue):
+        while not self.stopped.is_set():
+            try:
+                return in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return self._end_of_stream
@@ -0,0 +1,251 @@
+import io
+import json
+import os
+import re
+import zlib
+import numpy as np
+import pandas as pd
+from src.logger import Logger
+from src.deduplicator import VariantDeduplicator
+from src.output_writer import GzipOutputWriter, BgzfOutputWriter, \
+    ParquetOutputWriter
+from src.utilities.bgzf import BGZF_EOF, is_bgzf
+from src.utilities.utilities import Utilities
+
+# Compressed bytes to copy at once.
+_COPY_SIZE = 1 << 22
+
+
+class ShardMerger:
+    """
+    Class to merge the output of the shards of a run, written with
+    --shard i/N, into the usual chromosome output files of the output
+    directory. Shards are appended in input order by copying their gzip
+    members, or Parquet row groups, as they are. Only the first rows of
+    every shard, up to the last position the shards before it wrote on that
+    chromosome, are decompressed and compared to the deduplication window of
+    those shards.
+    """
+
+    def __init__(self, output_loc, compression_level=6):
+        self.log = Logger()
+        self.utilities = Utilities()
+        self.output_loc = output_loc
+        self.compression_level = compression_level
+        self.shard_locs = []
+        self.progressions = []
+        self.deduplicator = None
+        self._find_shards()
+
+    def _find_shards(self):
+        shards = {}
+        counts = set()
+        for name in os.listdir(self.output_loc):
+            match = re.match(r'^shard_(\d+)_of_(\d+)$', name)
+            if match is not None and os.path.isdir(
+                    os.path.join(self.output_loc, name)):
+                shards[int(match.group(1))] = name
+                counts.add(int(match.group(2)))
+        if len(shards) == 0:
+            return
+        if len(counts) > 1:
+            raise ValueError('Found shards of runs split in {} shards, merge'
+                             ' the shards of a single run.'.format(
+                                 sorted(counts)))
+        count = counts.pop()
+        for number in range(1, count + 1):
+            if number not in shards:
+                raise ValueError('Shard {}/{} not found in {}.'.format(
+                    number, count, self.output_loc))
+            shard_loc = os.path.join(self.output_loc, shards[number])
+            progression_loc = os.path.join(shard_loc, 'log_output',
+                                           'progression.json')
+            progression = {}
+            if os.path.isfile(progression_loc):
+                with open(progression_loc) as progression_file:
+                    progression = json.load(progression_file)
+            if not progression.get('done', False):
+                raise ValueError('Shard {}/{} is not done yet.'.format(
+                    number, count))
+            self.shard_locs.append(shard_loc)
+            self.progressions.append(progression)
+        columns = [progression.get('prediction_columns', ['prediction'])
+                   for progression in self.progressions]
+        if any(shard_columns != columns[0] for shard_columns in columns):
+            raise ValueError('The shards were scored with different'
+                             ' models: {}.'.format(columns))
+
+    def has_shards(self):
+        return len(self.shard_locs) > 0
+
+    def merge(self):
+        """
+        Method to merge the chromosome output files of all shards.
+        :return: list of the paths of the merged files.
+        """
+        names = set()
+        for shard_loc in self.shard_locs:
+            for name in os.listdir(shard_loc):
+                if re.match(r'^chr(.+)$', name) is None:
+                    continue
+                for output_name in os.listdir(os.path.join(shard_loc, name)):
+                    if re.match(r'^whole_genome_SNVs_chr_.+\.(tsv\.gz|'
+                                r'parquet)$', output_name) is not None:
+                        names.add((name, output_name))
+        return [self._merge_chromosome(chromosome_dir, name)
+                for chromosome_dir, name in sorted(names)]
+
+    def _merge_chromosome(self, chromosome_dir, name):
+        chromosome = chromosome_dir[len('chr'):]
+        shards = [(os.path.join(shard_loc, chromosome_dir, name),
+                   progression.get('dedup_window', {}).get(chromosome))
+                  for shard_loc, progression in zip(self.shard_locs,
+                                                    self.progressions)]
+        shards = [(path, window) for path, window in shards
+                  if os.path.isfile(path)]
+        output_dir = os.path.join(self.output_loc, chromosome_dir)
+        self.utilities.check_if_dir_exists(output_dir)
+        destination = os.path.join(output_dir, name)
+        # Every file gets its own window, the tsv and Parquet output of a
+        # chromosome hold the same rows.
+        self.deduplicator = VariantDeduplicator()
+        if name.endswith('.parquet'):
+            writer = ParquetOutputWriter(destination, keep_existing=False)
+            append = self._append_parquet
+        else:
+            temporary = destination + '.tmp'
+            if os.path.isfile(temporary):
+                os.remove(temporary)
+            if all(is_bgzf(path) for path, _ in shards):
+                writer = BgzfOutputWriter(temporary, self.compression_level)
+            else:
+                writer = GzipOutputWriter(temporary, self.compression_level)
+            append = self._append
+        removed = 0
+        for path, window in shards:
+            removed += append(writer, chromosome, path)
+            if window is not None:
+                self.deduplicator.add_state({chromosome: window})
+            else:
+                self.log.warning('No deduplication window saved for {},'
+                                 ' duplicates at the start of the next'
+                                 ' shard are not removed.', path)
+        writer.close()
+        if name.endswith('.parquet'):
+            ParquetOutputWriter.merge(destination)
+        else:
+            os.replace(temporary, destination)
+        self.log.log('Merged {} shards into {}, {} duplicated rows'
+                     ' removed.'.format(len(shards), destination, removed))
+        return destination
+
+    def _append_parquet(self, writer, chromosome, path):
+        """
+        Method to append the row groups of the Parquet output of a shard to
+        the merged file. Row groups up to the first one past the last
+        position of the window are deduplicated, the others copied.
+        :return: int, the amount of duplicated rows removed.
+        """
+        source = writer.parquet.ParquetFile(path)
+        last_position = None
+        if self.deduplicator.has_window(chromosome):
+            last_position = max(self.deduplicator.get_state(
+                [chromosome])[chromosome]['positions'] or [0])
+        removed = 0
+        for row_group in range(source.num_row_groups):
+            table = source.read_row_group(row_group)
+            if last_position is None:
+                writer.write_table(table)
+                continue
+            variants_df = table.to_pandas()
+            for column in ParquetOutputWriter.dictionary_columns:
+                variants_df[column] = variants_df[column].astype(object)
+            kept = self.deduplicator.drop_duplicates(chromosome, variants_df)
+            removed += variants_df.shape[0] - kept.shape[0]
+            writer.write_variants(kept)
+            writer.flush()
+            if variants_df['Pos'].values[-1] > last_position:
+                last_position = None
+        return removed
+
+    def _append(self, writer, chromosome, path):
+        """
+        Method to append the output of a shard to the merged file.
+        :return: int, the amount of duplicated rows removed.
+        """
+        removed = 0
+        with open(path, 'rb') as source:
+            head_end = 0
+            if self.deduplicator.has_window(chromosome):
+                last_position = max(self.deduplicator.get_state(
+                    [chromosome])[chromosome]['positions'] or [0])
+                head, head_end = self._read_head(source, last_position)
+                removed = self._write_head(writer, chromosome, head)
+            source.seek(0, os.SEEK_END)
+            end = source.tell()
+            # Drop the end of file marker, the merged file gets its own.
+            if end - head_end >= len(BGZF_EOF):
+                source.seek(end - len(BGZF_EOF))
+                if source.read() == BGZF_EOF:
+                    end -= len(BGZF_EOF)
+            source.seek(head_end)
+            while source.tell() < end:
+                writer.write_compressed(source.read(
+                    min(_COPY_SIZE, end - source.tell())))
+        writer.flush()
+        return removed
+
+    @staticmethod
+    def _read_head(source, last_position):
+        """
+        Method to decompress the first gzip members of a file, up to the
+        first member that ends with a line past a position.
+        :param source: file opened in binary mode, at its start.
+        :param last_position: int
+        :return: tuple of the decompressed bytes and the compressed offset
+        of the member after them.
+        """
+        pieces = []
+        offset = 0
+        buffer = b''
+        while True:
+            decompressor = zlib.decompressobj(31)
+            while not decompressor.eof:
+                if len(buffer) == 0:
+                    buffer = source.read(_COPY_SIZE)
+                    if len(buffer) == 0:
+                        return b''.join(pieces), offset
+                data = decompressor.decompress(buffer)
+                if len(data) > 0:
+                    pieces.append(data)
+                offset += len(buffer) - len(decompressor.unused_data)
+                buffer = decompressor.unused_data
+            if len(pieces) == 0 or not pieces[-1].endswith(b'\n'):
+                continue
+            line_start = pieces[-1].rfind(b'\n', 0, len(pieces[-1]) - 1)
+            if line_start == -1:
+                pieces = [b''.join(pieces)]
+                line_start = pieces[-1].rfind(b'\n', 0,
+                                              len(pieces[-1]) - 1)
+            last_line = pieces[-1][line_start + 1:]
+            if int(last_line.split(b'\t', 2)[1]) > last_position:
+                return b''.join(pieces), offset
+
+    def _write_head(self, writer, chromosome, head):
+        if len(head) == 0:
+            return 0
+        lines = head.split(b'\n')
+        if lines[-1] == b'':
+            lines.pop()
+        variants_df = pd.read_csv(
+            io.BytesIO(head), sep='\t', header=None,
+            usecols=list(range(len(VariantDeduplicator.key_columns))),
+            names=VariantDeduplicator.key_columns,
+            dtype={column: str for column in VariantDeduplicator.key_columns
+                   if column != 'Pos'})
+        kept = self.deduplicator.drop_duplicates(chromosome, variants_df)
+        keep = np.zeros(len(lines), dtype=bool)
+        keep[kept.index.values] = True
+        writer.write(b''.join(line + b'\n' for line, is_kept in
+                              zip(lines, keep) if is_kept))
+        return len(lines) - kept.shape[0]
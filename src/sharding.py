@@ -0,0 +1,110 @@
+import os
+import zlib
+import numpy as np
+from src.utilities.bgzf import BgzfReader
+
+# Lengths of the GRCh37 chromosomes in Mbp, to spread the chromosomes of a
+# plain gzip input evenly over the shards.
+chromosome_lengths = {
+    '1': 249, '2': 243, '3': 198, '4': 191, '5': 181, '6': 171, '7': 159,
+    '8': 146, '9': 141, '10': 136, '11': 135, '12': 134, '13': 115,
+    '14': 107, '15': 103, '16': 90, '17': 81, '18': 78, '19': 59, '20': 63,
+    '21': 48, '22': 51, 'X': 155, 'Y': 59, 'MT': 0
+}
+
+
+def parse_shard(shard):
+    """
+    Function to parse a shard given as i/N, with i from 1 to N.
+    :param shard: str
+    :return: tuple of the shard number and the amount of shards.
+    """
+    try:
+        number, count = [int(part) for part in shard.split('/')]
+    except ValueError:
+        raise ValueError('Shard {} is not formatted as i/N.'.format(shard))
+    if not 1 <= number <= count:
+        raise ValueError('Shard {} does not lie between 1/{} and'
+                         ' {}/{}.'.format(shard, count, count, count))
+    return number, count
+
+
+def get_shard_output_loc(output_loc, shard):
+    """
+    Function to get the output directory of a shard within the output
+    directory of the whole run.
+    :param output_loc: the output directory given for the run.
+    :param shard: tuple of the shard number and the amount of shards.
+    :return: str
+    """
+    return os.path.join(output_loc, 'shard_{}_of_{}'.format(*shard))
+
+
+def get_shard_range(filepath, shard):
+    """
+    Function to get the part of a BGZF input a shard scores. The file is
+    split at even compressed offsets, moved on to the next block and then
+    to the line after the first line ending in it, so every line belongs to
+    exactly one shard whichever node computes the split.
+    :param filepath: path to the BGZF input.
+    :param shard: tuple of the shard number and the amount of shards.
+    :return: tuple of the virtual offsets to start and stop at. The start
+    is None for the first shard, which reads from the start of the file, the
+    stop is None for the last shard, which reads to the end.
+    """
+    number, count = shard
+    file_size = os.path.getsize(filepath)
+    reader = BgzfReader(filepath, cache_size=0)
+    offsets = []
+    for boundary in [number - 1, number]:
+        if boundary == 0 or boundary == count:
+            offsets.append(None)
+            continue
+        offset = reader.next_line_offset(reader.find_block(
+            file_size * boundary // count))
+        offsets.append(offset if offset is not None else file_size << 16)
+    reader.close()
+    return tuple(offsets)
+
+
+class ShardChromosomes:
+    """
+    Class to select the variants of the chromosomes a shard scores, for
+    inputs that can not be split on offsets. Chromosomes are spread over
+    the shards largest first, every chromosome going to the shard with the
+    least Mbp so far. Chromosomes of unknown length go to a shard picked by
+    a checksum of their name.
+    """
+
+    def __init__(self, shard):
+        self.number, self.count = shard
+        self.shards = {}
+        totals = [0] * self.count
+        for chromosome, length in sorted(chromosome_lengths.items(),
+                                         key=lambda item: -item[1]):
+            smallest = totals.index(min(totals))
+            self.shards[chromosome] = smallest + 1
+            totals[smallest] += length
+
+    def get_shard(self, chromosome):
+        chromosome = str(chromosome)
+        if chromosome.lower().startswith('chr'):
+            chromosome = chromosome[3:]
+        if chromosome not in self.shards:
+            return zlib.crc32(chromosome.encode('utf-8')) % self.count + 1
+        return self.shards[chromosome]
+
+    def get_chromosomes(self):
+        return [chromosome for chromosome, number in self.shards.items()
+                if number == self.number]
+
+    def select(self, variants_df):
+        """
+        Method to mark the variants on the chromosomes of this shard.
+        :param variants_df: pandas DataFrame with a #Chr column.
+        :return: numpy array of bools.
+        """
+        chromosomes = variants_df['#Chr'].astype(str)
+        shards = {chromosome: self.get_shard(chromosome)
+                  for chromosome in chromosomes.unique()}
+        return np.asarray(chromosomes.map(shards).values == self.number)
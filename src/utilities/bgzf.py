@@ -0,0 +1,201 @@
+import os
+import struct
+import zlib
+from collections import OrderedDict
+
+# Maximum amount of uncompressed bytes in one block, the same as bgzip uses.
+BGZF_BLOCK_SIZE = 0xff00
+# The empty block that marks the end of a BGZF file.
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000'
+                         '000000')
+_BGZF_HEADER = struct.Struct('<4BI2BH2BHH')
+_BGZF_HEADER_SIZE = 18
+
+
+def compress_block(data, compression_level=6):
+    """
+    Function to compress data into a single BGZF block.
+    :param data: bytes, at most BGZF_BLOCK_SIZE long.
+    :param compression_level: zlib compression level.
+    :return: bytes of the BGZF block.
+    """
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    block_size = _BGZF_HEADER_SIZE + len(compressed) + 8
+    header = _BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+                               block_size - 1)
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+    return header + compressed + trailer
+
+
+def split_blocks(data):
+    """
+    Function to split data into pieces that fit in a single BGZF block.
+    :param data: bytes
+    :return: list of bytes
+    """
+    return [data[start:start + BGZF_BLOCK_SIZE]
+            for start in range(0, len(data), BGZF_BLOCK_SIZE)]
+
+
+def is_bgzf(path):
+    """
+    Function to check whether a file starts with a BGZF block.
+    :param path: path to the file.
+    :return: bool
+    """
+    with open(path, 'rb') as file:
+        header = file.read(_BGZF_HEADER_SIZE)
+    return (len(header) == _BGZF_HEADER_SIZE and header[:4] ==
+            b'\x1f\x8b\x08\x04' and header[12:14] == b'BC')
+
+
+class BgzfReader:
+    """
+    Class to read a BGZF file block by block. Decompressed blocks are kept
+    in a small LRU cache, so looking up neighbouring positions does not
+    decompress the same block twice.
+    """
+
+    def __init__(self, path, cache_size=64):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def _read_block_at(self, offset):
+        self.file.seek(offset)
+        header = self.file.read(12)
+        if len(header) < 12:
+            return None, offset
+        if header[:4] != b'\x1f\x8b\x08\x04':
+            raise ValueError('{} is not a BGZF file, no BGZF block at'
+                             ' offset {}.'.format(self.path, offset))
+        extra_length = struct.unpack('<H', header[10:12])[0]
+        extra = self.file.read(extra_length)
+        block_size = None
+        position = 0
+        while position < extra_length:
+            subfield = extra[position:position + 2]
+            subfield_length = struct.unpack(
+                '<H', extra[position + 2:position + 4])[0]
+            if subfield == b'BC':
+                block_size = struct.unpack(
+                    '<H', extra[position + 4:position + 6])[0] + 1
+            position += 4 + subfield_length
+        if block_size is None:
+            raise ValueError('{} is not a BGZF file, no block size at'
+                             ' offset {}.'.format(self.path, offset))
+        remainder = self.file.read(block_size - 12 - extra_length)
+        data = zlib.decompress(remainder[:-8], -15)
+        return data, offset + block_size
+
+    def read_block(self, offset):
+        """
+        Method to read and decompress the block at a compressed offset.
+        :param offset: int, compressed offset of the block.
+        :return: tuple of the decompressed bytes and the offset of the next
+        block. The bytes are None past the end of the file.
+        """
+        if offset in self.cache:
+            self.cache.move_to_end(offset)
+            return self.cache[offset]
+        block = self._read_block_at(offset)
+        self.cache[offset] = block
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return block
+
+    def blocks(self):
+        """
+        Generator over all blocks of the file, bypassing the cache.
+        :return: tuples of compressed offset and decompressed bytes.
+        """
+        offset = 0
+        while True:
+            data, next_offset = self._read_block_at(offset)
+            if data is None:
+                return
+            yield offset, data
+            offset = next_offset
+
+    def read_lines(self, virtual_offset, nlines):
+        """
+        Method to read lines starting at a virtual offset, crossing block
+        boundaries where needed.
+        :param virtual_offset: int, compressed block offset shifted left 16
+        bits, plus the offset of the first line within that block.
+        :param nlines: the amount of lines to read.
+        :return: bytes holding the lines.
+        """
+        offset = virtual_offset >> 16
+        data, offset = self.read_block(offset)
+        data = data[virtual_offset & 0xffff:]
+        pieces = []
+        while data is not None:
+            found = 0
+            end = -1
+            while found < nlines:
+                end = data.find(b'\n', end + 1)
+                if end == -1:
+                    break
+                found += 1
+            if found == nlines:
+                pieces.append(data[:end + 1])
+                break
+            pieces.append(data)
+            nlines -= found
+            data, offset = self.read_block(offset)
+        return b''.join(pieces)
+
+    def find_block(self, offset):
+        """
+        Method to find the first block starting at or after a compressed
+        offset. Candidates are found by their header and only accepted when
+        they decompress and are followed by another block or the end of the
+        file.
+        :param offset: int, compressed offset to start looking at.
+        :return: int, compressed offset of the block, the file size when
+        there is none.
+        """
+        file_size = os.path.getsize(self.path)
+        while offset < file_size:
+            self.file.seek(offset)
+            data = self.file.read(1 << 17)
+            found = data.find(b'\x1f\x8b\x08\x04')
+            if found == -1:
+                offset += max(len(data) - 3, 1)
+                continue
+            candidate = offset + found
+            try:
+                _, next_offset = self._read_block_at(candidate)
+                if next_offset >= file_size or \
+                        self._read_block_at(next_offset)[0] is not None:
+                    return candidate
+            except (ValueError, struct.error, zlib.error):
+                pass
+            offset = candidate + 1
+        return file_size
+
+    def next_line_offset(self, offset):
+        """
+        Method to find where the first line starting after the first line
+        ending at or after a block starts.
+        :param offset: int, compressed offset of a block.
+        :return: int, the virtual offset of that line, None when no line
+        ends after the block starts.
+        """
+        while True:
+            data, next_offset = self._read_block_at(offset)
+            if data is None:
+                return None
+            newline = data.find(b'\n')
+            if newline == len(data) - 1:
+                return next_offset << 16
+            if newline != -1:
+                return (offset << 16) | (newline + 1)
+            offset = next_offset
+
+    def close(self):
+        self.file.close()
+        self.cache.clear()
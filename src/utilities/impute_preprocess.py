@@ -30,6 +30,9 @@ cadd_vars_withConsequence = ['Ref', 'Alt', 'Type', 'Length','GC', 'CpG', 'motifE
            'Rare100bp', 'Sngl100bp', 'Freq1000bp', 'Rare1000bp', 'Sngl1000bp', 'Freq10000bp', 'Rare10000bp',
            'Sngl10000bp', 'dbscSNV-ada_score', 'dbscSNV-rf_score', 'RawScore', 'PHRED', "Consequence"]
 
+cadd_object_vars = ['Ref', 'Alt', 'Type', 'oAA', 'nAA', 'Domain', 'Dst2SplType', 'SIFTcat', 'PolyPhenCat', 'Segway',
+                    'Consequence']
+
 impute_values = {'Ref':'N', 'Alt':'N', 'Consequence':'UNKNOWN', 'GC':0.42, 'CpG':0.02, 'motifECount':0,
                  'motifEScoreChng':0, 'motifEHIPos':0,  'oAA': 'unknown', 'nAA': 'unknown', 'cDNApos': 0,
                  'relcDNApos':0,'CDSpos':0, 'relCDSpos':0, 'protPos':0, 'relProtPos':0, 'Domain':'UD', 'Dst2Splice':0,
@@ -77,27 +80,44 @@ def replace_nas(df, Dict):
     return df
 
 
-def impute(df, imputed_savepath=None, print_messages=False):
+def impute(df, imputed_savepath=None, print_messages=False, inplace=False):
+    """
+    imputation, vectorized: one pass to find the samples to drop and a single fillna with impute_values.
+    :param df: pandas DataFrame of CADD variants
+    :param imputed_savepath: optional path to save the imputed data to
+    :param print_messages: print the shapes and null ratios on the way
+    :param inplace: fill df itself instead of a copy, only possible when no samples are dropped
+    :return: imputed pandas DataFrame
+    """
     if print_messages:
         print(type(df))
         print("Readin data shape: ", df.shape)
         print(df.head())
-    df = df.dropna(subset=cadd_vars, how="all")
+    rf_score = df["dbscSNV-rf_score"]
+    if rf_score.dtype == object:
+        rf_score = rf_score.where(~rf_score.isin([".", "NA"]))
+    # float64 whatever it was parsed as, like the row by row float() did.
+    rf_score = rf_score.astype(float)
+    cadd_notna = df[cadd_vars].notna()
+    keep = cadd_notna.any(axis=1)
+    cadd_notna["dbscSNV-rf_score"] = rf_score.notna()
+    other_vars = df.columns.difference(cadd_vars)
+    keep &= cadd_notna.any(axis=1) | df[other_vars].notna().any(axis=1)
+    if not keep.all():
+        rows = np.flatnonzero(keep.values)
+        df = df.take(rows)
+        rf_score = rf_score.take(rows)
+    elif not inplace:
+        df = df.copy()
+    df["dbscSNV-rf_score"] = rf_score
     if print_messages:
         print("Remove samples with no parameters, shape: ", df.shape)
-    func = lambda x: np.nan if pd.isnull(x) or x == "." or x == 'NA' else float(x)
-    values = df["dbscSNV-rf_score"].values
-    df["dbscSNV-rf_score"] = [func(item) for item in values]
-    df = df.dropna(how="all")
-    if print_messages:
-        print("Raw data loaded, shape: ", df.shape)
         print("Before imputation, null ratio: \n")
-    _ = examine_nas(df[cadd_vars], print_messages)
-    # save null ratios
-    df = replace_nas(df, impute_values)
+        _ = examine_nas(df[cadd_vars], print_messages)
+    df.fillna(impute_values, inplace=True)
     if print_messages:
         print("After imputation, there shouldn't be any nulls, but check below: \n")
-    _ = examine_nas(df, print_messages)
+        _ = examine_nas(df, print_messages)
     if imputed_savepath:
         df.to_csv(imputed_savepath, index=False)
         if print_messages:
@@ -181,6 +201,55 @@ def preprocess(imputed_data, processed_savepath=None, isTrain=False, model_path=
     return processed_data
 
 
+class PreprocessPlan:
+    """
+    One-hot layout of the model features, built once per model. Maps every
+    categorical level straight to its column index so batches can be
+    encoded into a preallocated float32 matrix in model feature order,
+    without get_dummies or adding the missing model columns one by one.
+    Categorical levels are derived the same way preprocess does.
+    """
+    def __init__(self, model_features):
+        self.model_features = list(model_features)
+        column_index = {feature: index for index, feature in enumerate(self.model_features)}
+        self.categorical_features = {}
+        claimed = set()
+        for feature in cadd_vars:
+            if feature in column_index:
+                continue
+            level_index = {}
+            for feature_expandedname in self.model_features:
+                if feature in feature_expandedname:
+                    expandedname = '_'.join(feature_expandedname.split('_')[1:])
+                    level_index[expandedname] = column_index.get('{}_{}'.format(feature, expandedname), -1)
+            if level_index:
+                other_index = column_index.get('{}_other'.format(feature), -1)
+                self.categorical_features[feature] = (level_index, other_index)
+                claimed.update(index for index in level_index.values() if index >= 0)
+                if other_index >= 0:
+                    claimed.add(other_index)
+        self.numeric_features = [(feature, index) for feature, index in column_index.items()
+                                 if index not in claimed]
+
+    def transform(self, imputed_data):
+        """
+        Encode an imputed batch.
+        :param imputed_data: pandas DataFrame as returned by impute.
+        :return: float32 numpy array, columns in model feature order.
+        """
+        matrix = np.zeros((imputed_data.shape[0], len(self.model_features)), dtype=np.float32)
+        for feature, index in self.numeric_features:
+            if feature in imputed_data:
+                matrix[:, index] = pd.to_numeric(imputed_data[feature], errors='coerce').values
+        for feature, (level_index, other_index) in self.categorical_features.items():
+            if feature not in imputed_data:
+                continue
+            indexes = imputed_data[feature].map(level_index).fillna(other_index).values.astype(np.int64)
+            rows = np.flatnonzero(indexes >= 0)
+            matrix[rows, indexes[rows]] = 1
+        return matrix
+
+
 def preprocess_withConsequence(imputed_data, processed_savepath=None, isTrain=False, model_path=None):
     feat_cadd_object = [feat for feat in imputed_data.select_dtypes(include=["O"]).columns
                         if feat in cadd_vars_withConsequence]
@@ -0,0 +1,63 @@
+import gzip
+import struct
+
+# Tabix splits every chromosome into windows of 2^14 positions for its
+# linear index.
+_TABIX_LINEAR_SHIFT = 14
+
+
+class TabixIndex:
+    """
+    Class to read the linear index of a tabix (.tbi) index. For every window
+    of 16 kbp of a chromosome it holds the virtual offset of the first
+    record overlapping that window, which is where reading a region of a
+    position sorted BGZF file can start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.names = []
+        self.linear_offsets = {}
+        self._read()
+
+    @staticmethod
+    def index_path(path):
+        return path + '.tbi'
+
+    def _read(self):
+        with gzip.open(self.path, 'rb') as index_file:
+            data = index_file.read()
+        if data[:4] != b'TBI\x01':
+            raise ValueError('{} is not a tabix index.'.format(self.path))
+        n_ref = struct.unpack_from('<i', data, 4)[0]
+        names_length = struct.unpack_from('<i', data, 32)[0]
+        names = data[36:36 + names_length].split(b'\x00')
+        self.names = [name.decode('utf-8') for name in names[:n_ref]]
+        position = 36 + names_length
+        for name in self.names:
+            n_bin = struct.unpack_from('<i', data, position)[0]
+            position += 4
+            for _ in range(n_bin):
+                n_chunk = struct.unpack_from('<i', data, position + 4)[0]
+                position += 8 + 16 * n_chunk
+            n_intv = struct.unpack_from('<i', data, position)[0]
+            position += 4
+            self.linear_offsets[name] = struct.unpack_from(
+                '<{}Q'.format(n_intv), data, position)
+            position += 8 * n_intv
+
+    def get_offset(self, name, start):
+        """
+        Method to get the virtual offset to start reading a region at.
+        :param name: str, the chromosome name as used in the input.
+        :param start: int, 1-based first position of the region.
+        :return: int, the virtual offset, or None when the chromosome has no
+        records at or after start.
+        """
+        offsets = self.linear_offsets.get(name, ())
+        # Windows without records are stored as 0.
+        for window in range(max(start - 1, 0) >> _TABIX_LINEAR_SHIFT,
+                            len(offsets)):
+            if offsets[window] > 0:
+                return offsets[window]
+        return None
@@ -5,10 +5,16 @@ import gzip
 
 class Utilities:
     @staticmethod
-    def get_ram_usage():
+    def get_ram_usage(children=False):
         process = psutil.Process(os.getpid())
-        memory_usage = process.memory_info().rss / 1000000  # Megabytes
-        return memory_usage
+        memory_usage = process.memory_info().rss
+        if children:
+            for child in process.children(recursive=True):
+                try:
+                    memory_usage += child.memory_info().rss
+                except psutil.NoSuchProcess:
+                    continue
+        return memory_usage / 1000000  # Megabytes
 
     @staticmethod
     def check_if_dir_exists(path):
@@ -0,0 +1,241 @@
+import gzip
+import io
+import os
+import numpy as np
+import pandas as pd
+from src.logger import Logger
+from src.output_writer import BgzfOutputWriter
+from src.score_index import ScoreLookup
+
+
+class VcfAnnotator:
+    """
+    Class to annotate a VCF with the precomputed CAPICE scores of an output
+    directory. The VCF and the chromosome output files are both read in
+    position order and merge-joined a batch of records at a time, so memory
+    stays constant and time grows linearly with the size of both. Every
+    prediction column gets an INFO field with a score per alternative
+    allele: the highest score over the transcripts of the variant, or . when
+    the variant was not scored.
+    """
+    # Records to join at once, records at the same position are never split.
+    batch_size = 10000
+    # Uncompressed bytes of a chromosome output file to parse at once.
+    chunk_size = 1 << 22
+
+    def __init__(self, output_loc, compression_level=6):
+        self.log = Logger()
+        self.output_loc = output_loc
+        self.compression_level = compression_level
+        self.prediction_columns = ScoreLookup.get_prediction_columns(
+            output_loc)
+        self.info_keys = [self.get_info_key(column).encode('utf-8')
+                          for column in self.prediction_columns]
+        self.stream = None
+        self.chromosomes = set()
+        self.last_position = 0
+        self.records = 0
+        self.annotated = 0
+
+    @staticmethod
+    def get_info_key(column):
+        """
+        Method to name the INFO field of a prediction column: CAPICE for
+        prediction, CAPICE_ followed by the model name for the others.
+        :param column: str
+        :return: str
+        """
+        if column == 'prediction':
+            return 'CAPICE'
+        return 'CAPICE_{}'.format(column[len('prediction_'):])
+
+    def _get_info_headers(self):
+        return b''.join(
+            '##INFO=<ID={},Number=A,Type=Float,Description="Precomputed'
+            ' CAPICE score of {}, the highest over the transcripts of the'
+            ' variant">\n'.format(key.decode('utf-8'), column).encode('utf-8')
+            for key, column in zip(self.info_keys, self.prediction_columns))
+
+    def annotate(self, vcf_path, annotated_path):
+        """
+        Method to annotate a VCF.
+        :param vcf_path: path to the VCF, gzipped when it ends with .gz. The
+        records of a chromosome have to be together and sorted by position.
+        :param annotated_path: path to write the annotated VCF to, as BGZF
+        when it ends with .gz.
+        :return: tuple of the amount of records and the amount of records
+        with at least one score.
+        """
+        if vcf_path.endswith('.gz'):
+            source = gzip.open(vcf_path, 'rb')
+        else:
+            source = open(vcf_path, 'rb')
+        if annotated_path.endswith('.gz'):
+            if os.path.isfile(annotated_path):
+                os.remove(annotated_path)
+            writer = BgzfOutputWriter(annotated_path, self.compression_level)
+        else:
+            writer = open(annotated_path, 'wb')
+        info_headers = tuple(b'##INFO=<ID=' + key + b',' for key in
+                             self.info_keys)
+        batch = []
+        for line in source:
+            if line.startswith(b'##'):
+                if not line.startswith(info_headers):
+                    writer.write(line)
+                continue
+            if line.startswith(b'#'):
+                writer.write(self._get_info_headers() + line)
+                continue
+            fields = line.rstrip(b'\r\n').split(b'\t')
+            if len(batch) > 0 and (fields[0] != batch[-1][0] or (
+                    len(batch) >= self.batch_size and
+                    fields[1] != batch[-1][1])):
+                self._annotate_batch(batch, writer, vcf_path)
+                batch = []
+            batch.append(fields)
+        if len(batch) > 0:
+            self._annotate_batch(batch, writer, vcf_path)
+        source.close()
+        writer.close()
+        self.log.log('Annotated {} of {} records of {}.'.format(
+            self.annotated, self.records, vcf_path))
+        return self.records, self.annotated
+
+    def _get_stream(self, vcf_chromosome, vcf_path):
+        chromosome = vcf_chromosome.decode('utf-8')
+        if chromosome.lower().startswith('chr'):
+            chromosome = chromosome[3:]
+        if self.stream is None or self.stream.chromosome != chromosome:
+            if chromosome in self.chromosomes:
+                raise ValueError('The records of chromosome {} of {} are not'
+                                 ' together.'.format(chromosome, vcf_path))
+            self.chromosomes.add(chromosome)
+            path = os.path.join(self.output_loc, 'chr{}'.format(chromosome),
+                                'whole_genome_SNVs_chr_{}.tsv.gz'.format(
+                                    chromosome))
+            if not os.path.isfile(path):
+                self.log.warning('No scores found for chromosome {} in {}.',
+                                 chromosome, self.output_loc)
+            self.stream = _ScoreStream(chromosome, path,
+                                       self.prediction_columns,
+                                       self.chunk_size)
+            self.last_position = 0
+        return self.stream
+
+    def _annotate_batch(self, batch, writer, vcf_path):
+        stream = self._get_stream(batch[0][0], vcf_path)
+        positions = np.array([int(fields[1]) for fields in batch],
+                             dtype=np.int64)
+        if positions[0] < self.last_position or np.any(
+                positions[1:] < positions[:-1]):
+            raise ValueError('The records of chromosome {} of {} are not'
+                             ' sorted by position.'.format(
+                                 stream.chromosome, vcf_path))
+        self.last_position = positions[-1]
+        scores = stream.take(positions)
+        found = {}
+        if scores.shape[0] > 0:
+            scores = scores.groupby(['Pos', 'Ref', 'Alt'])[
+                self.prediction_columns].max()
+            values = [scores[column].values.astype(np.float32).astype(str)
+                      for column in self.prediction_columns]
+            found = dict(zip(scores.index, zip(*values)))
+        missing = ('.',) * len(self.prediction_columns)
+        lines = []
+        for position, fields in zip(positions, batch):
+            ref = fields[3].decode('utf-8')
+            alleles = [found.get((position, ref, alt), missing)
+                       for alt in fields[4].decode('utf-8').split(',')]
+            if any(allele is not missing for allele in alleles):
+                self._set_info(fields, alleles)
+                self.annotated += 1
+            lines.append(b'\t'.join(fields) + b'\n')
+        self.records += len(batch)
+        writer.write(b''.join(lines))
+        writer.flush()
+
+    def _set_info(self, fields, alleles):
+        entries = [entry for entry in fields[7].split(b';')
+                   if entry != b'.' and
+                   entry.split(b'=', 1)[0] not in self.info_keys]
+        for number, key in enumerate(self.info_keys):
+            entries.append(key + b'=' + ','.join(
+                allele[number] for allele in alleles).encode('utf-8'))
+        fields[7] = b';'.join(entries)
+
+
+class _ScoreStream:
+    """
+    Class to read the scores of a chromosome output file in position order,
+    a chunk at a time. Only the rows past the positions asked for so far are
+    kept between batches.
+    """
+
+    def __init__(self, chromosome, path, prediction_columns, chunk_size):
+        self.chromosome = chromosome
+        self.path = path
+        self.prediction_columns = prediction_columns
+        self.chunk_size = chunk_size
+        self.last_position = 0
+        self.carry = None
+        if os.path.isfile(path):
+            self.chunks = self._read_chunks()
+        else:
+            self.chunks = iter(())
+
+    def _read_chunks(self):
+        rest = b''
+        with gzip.open(self.path, 'rb') as source:
+            while True:
+                data = source.read(self.chunk_size)
+                if len(data) == 0:
+                    break
+                data = rest + data
+                end = data.rfind(b'\n') + 1
+                rest = data[end:]
+                if end > 0:
+                    yield self._parse(data[:end])
+        if len(rest) > 0:
+            yield self._parse(rest)
+
+    def _parse(self, data):
+        chunk = pd.read_csv(
+            io.BytesIO(data), sep='\t', header=None,
+            names=ScoreLookup.key_columns + self.prediction_columns,
+            usecols=['Pos', 'Ref', 'Alt'] + self.prediction_columns,
+            dtype={'Ref': str, 'Alt': str})
+        positions = chunk['Pos'].values
+        if positions[0] < self.last_position or np.any(
+                positions[1:] < positions[:-1]):
+            raise ValueError('{} is not sorted by position, run'
+                             ' FinalizeCapice.py with --sort first.'.format(
+                                 self.path))
+        self.last_position = positions[-1]
+        return chunk
+
+    def take(self, positions):
+        """
+        Method to take the scores at the given positions, which have to lie
+        past the positions of the batches before.
+        :param positions: sorted numpy array of positions.
+        :return: pandas DataFrame
+        """
+        last = positions[-1]
+        found = []
+        while True:
+            if self.carry is None:
+                self.carry = next(self.chunks, None)
+                if self.carry is None:
+                    break
+            is_before = self.carry['Pos'].values <= last
+            before = self.carry[is_before]
+            found.append(before[before['Pos'].isin(positions)])
+            if not is_before.all():
+                self.carry = self.carry[~is_before]
+                break
+            self.carry = None
+        if len(found) == 0:
+            return pd.DataFrame(columns=['Pos', 'Ref', 'Alt'] +
+                                self.prediction_columns)
+        return pd.concat(found)
@@ -0,0 +1,75 @@
+import multiprocessing
+import multiprocessing.util
+from collections import deque
+from src.batch_scorer import BatchScorer
+from src.cadd_reader import CaddBatch
+from src.logger import Logger
+
+_scorer = None
+
+
+def _init_worker(model_loc, features_of_interest, model_threads,
+                 prediction_cache):
+    global _scorer
+    _scorer = BatchScorer(model_loc, features_of_interest, model_threads,
+                          prediction_cache)
+    # Worker processes do not run exit handlers, write the last log
+    # messages and summary when the worker stops instead.
+    multiprocessing.util.Finalize(None, Logger().close, exitpriority=10)
+
+
+def _score_variants(variants_df):
+    batch = _scorer.score_batch(CaddBatch(variants_df, None, None))
+    return batch.variants_df, batch.timings
+
+
+class WorkerPool:
+    """
+    Class to score batches of the CADD file on a pool of worker processes.
+    Every worker loads the model once, batches are handed back in the
+    order they were read.
+    """
+
+    def __init__(self, model_loc, features_of_interest, workers,
+                 model_threads=None, prediction_cache=0):
+        self.model_loc = model_loc
+        self.features_of_interest = features_of_interest
+        self.workers = workers
+        self.model_threads = model_threads
+        self.prediction_cache = prediction_cache
+        self.max_pending = workers * 2
+
+    def run(self, batches):
+        """
+        Generator to score the batches on the worker processes.
+        :param batches: iterable of CaddBatch.
+        :return: generator of scored batches, in input order.
+        """
+        pool = multiprocessing.Pool(
+            processes=self.workers,
+            initializer=_init_worker,
+            initargs=(self.model_loc, self.features_of_interest,
+                      self.model_threads, self.prediction_cache))
+        pending = deque()
+        try:
+            for batch in batches:
+                pending.append(
+                    (batch, pool.apply_async(_score_variants,
+                                             (batch.variants_df,))))
+                batch.variants_df = None
+                if len(pending) >= self.max_pending:
+                    yield self._collect(pending.popleft())
+            while len(pending) > 0:
+                yield self._collect(pending.popleft())
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @staticmethod
+    def _collect(pending_batch):
+        batch, result = pending_batch
+        batch.variants_df, timings = result.get()
+        batch.timings.update(timings)
+        return batch
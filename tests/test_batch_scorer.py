@@ -0,0 +1,62 @@
+import pickle
+import warnings
+import numpy as np
+import pytest
+import xgboost as xgb
+from benchmarks.synthetic_cadd import generate_variants
+from src.batch_scorer import ScoringModel
+from src.capice_scorer import CapiceScorer
+from src.utilities.impute_preprocess import impute, preprocess, \
+    PreprocessPlan, cadd_vars
+
+
+def _get_imputed(nrows, seed):
+    # The dtypes CaddReader parses a CADD file with.
+    return impute(CapiceScorer._to_frame(generate_variants(nrows,
+                                                           seed=seed)))
+
+
+@pytest.fixture(scope='module', params=[False, True],
+                ids=['all_trees', 'early_stopping'])
+def model_loc(request, tmp_path_factory):
+    """
+    A small model with features made the same way as for training the
+    CAPICE model, trained with or without early stopping.
+    """
+    processed = preprocess(_get_imputed(3000, 0), isTrain=True)
+    features = [column for column in processed.columns
+                if column in cadd_vars or column.split('_')[0] in cadd_vars]
+    rng = np.random.RandomState(0)
+    risk = (processed['verPhyloP'] + 2 * processed['PolyPhenVal'] -
+            processed['SIFTval'] + rng.normal(0, 1, processed.shape[0]))
+    labels = (risk > risk.median()).astype(int)
+    data = processed[features].astype(np.float32)
+    if request.param:
+        model = xgb.XGBClassifier(n_estimators=200, max_depth=4, n_jobs=1,
+                                  random_state=0, early_stopping_rounds=5)
+        model.fit(data[:2000], labels[:2000],
+                  eval_set=[(data[2000:], labels[2000:])], verbose=False)
+        assert model.best_iteration + 1 < 200
+    else:
+        model = xgb.XGBClassifier(n_estimators=20, max_depth=4, n_jobs=1,
+                                  random_state=0)
+        model.fit(data, labels)
+    path = str(tmp_path_factory.mktemp('model') / 'model.dat')
+    with open(path, 'wb') as model_file:
+        pickle.dump(model, model_file)
+    return path
+
+
+def test_predict_equals_predict_proba(model_loc):
+    scoring_model = ScoringModel(model_loc)
+    imputed = _get_imputed(2000, 1)
+    feature_matrix = PreprocessPlan(scoring_model.model_feats).transform(
+        imputed)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', UserWarning)
+        predictions = scoring_model.predict(feature_matrix)
+    expected = scoring_model.model.predict_proba(preprocess(
+        imputed.copy(), model_features=scoring_model.model_feats)[
+        scoring_model.model_feats])[:, 1]
+    assert predictions.dtype == np.float32
+    np.testing.assert_array_equal(predictions, expected)
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.synthetic_cadd import generate_variants
+from src.utilities.impute_preprocess import impute, preprocess, \
+    PreprocessPlan, cadd_vars, cadd_object_vars, examine_nas, impute_values
+
+
+def _previous_impute(df):
+    """
+    The row by row impute that the vectorized impute replaced, to compare
+    against.
+    """
+    df = df.dropna(subset=cadd_vars, how="all")
+    func = lambda x: np.nan if pd.isnull(x) or x == "." or x == 'NA' \
+        else float(x)
+    values = df["dbscSNV-rf_score"].values
+    df["dbscSNV-rf_score"] = [func(item) for item in values]
+    df = df.dropna(how="all")
+    _ = examine_nas(df[cadd_vars], False)
+    for value in df.columns:
+        if df[value].isna().any() and value in impute_values:
+            df[value].fillna(impute_values[value], inplace=True)
+    _ = examine_nas(df, False)
+    return df
+
+
+def _as_read(variants_df):
+    """
+    Set the dtypes CaddReader parses a CADD file with: numeric CADD columns
+    as float32, all other columns but Pos as str.
+    """
+    variants_df = variants_df.copy()
+    for column in variants_df.columns:
+        if column in cadd_vars and column not in cadd_object_vars:
+            variants_df[column] = pd.to_numeric(
+                variants_df[column]).astype(np.float32)
+        elif column != 'Pos':
+            variants_df[column] = variants_df[column].where(
+                variants_df[column].isnull(),
+                variants_df[column].astype(str))
+    return variants_df
+
+
+def _get_variants(drop_rows, rf_score_as_text=False):
+    variants_df = _as_read(generate_variants(3000, seed=1))
+    if rf_score_as_text:
+        # As read by pandas without declared dtypes, with . for missing.
+        variants_df['dbscSNV-rf_score'] = variants_df[
+            'dbscSNV-rf_score'].map(lambda x: '.' if pd.isnull(x) else
+                                    str(x)).astype(object)
+    if drop_rows:
+        # Variants without any CADD annotation are dropped by impute.
+        variants_df.loc[variants_df.index[::7], cadd_vars] = np.nan
+    return variants_df
+
+
+def _get_model_features(seed=0):
+    """
+    Model features made the same way as for training the CAPICE model.
+    """
+    imputed = impute(_as_read(generate_variants(3000, seed=seed)))
+    processed = preprocess(imputed, isTrain=True)
+    return [column for column in processed.columns
+            if column in cadd_vars or column.split('_')[0] in cadd_vars]
+
+
+@pytest.mark.parametrize('inplace', [False, True])
+@pytest.mark.parametrize('drop_rows', [False, True])
+@pytest.mark.parametrize('rf_score_as_text', [False, True])
+def test_impute_equals_previous_impute(inplace, drop_rows, rf_score_as_text):
+    variants_df = _get_variants(drop_rows, rf_score_as_text)
+    expected = _previous_impute(variants_df.copy())
+    imputed = impute(variants_df, inplace=inplace)
+    if drop_rows:
+        assert imputed.shape[0] < variants_df.shape[0]
+    pd.testing.assert_frame_equal(imputed, expected)
+    if inplace and not drop_rows:
+        assert imputed is variants_df
+    else:
+        assert imputed is not variants_df
+
+
+def test_impute_without_inplace_leaves_variants_as_they_are():
+    variants_df = _get_variants(drop_rows=False)
+    original = variants_df.copy()
+    impute(variants_df)
+    pd.testing.assert_frame_equal(variants_df, original)
+
+
+@pytest.mark.parametrize('drop_rows', [False, True])
+def test_preprocess_plan_equals_preprocess(drop_rows):
+    model_features = _get_model_features()
+    imputed = impute(_get_variants(drop_rows))
+    expected = preprocess(imputed.copy(), model_features=model_features)[
+        model_features]
+    matrix = PreprocessPlan(model_features).transform(imputed)
+    assert matrix.dtype == np.float32
+    np.testing.assert_array_equal(
+        matrix, expected.values.astype(np.float32))
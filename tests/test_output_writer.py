@@ -0,0 +1,86 @@
+import os
+import pandas as pd
+import pytest
+from src.output_writer import ParquetOutputWriter
+
+pytest.importorskip('pyarrow')
+
+
+def _get_variants(first, nrows):
+    return pd.DataFrame({
+        '#Chr': ['1'] * nrows,
+        'Pos': list(range(first, first + nrows)),
+        'Ref': ['A'] * nrows,
+        'Alt': ['C'] * nrows,
+        'GeneID': ['ENSG1'] * nrows,
+        'CCDS': [None] * nrows,
+        'FeatureID': ['ENST1'] * nrows,
+        'prediction': [0.5] * nrows})
+
+
+def _write(path, batches, parts_per_segment=3, keep_existing=True):
+    writer = ParquetOutputWriter(path, keep_existing=keep_existing)
+    writer.parts_per_segment = parts_per_segment
+    for batch in batches:
+        writer.write_variants(_get_variants(batch * 10, 10))
+        writer.flush()
+        writer.sync()
+    size = writer.get_size()
+    writer.close()
+    return size
+
+
+def test_every_flush_is_a_row_group_readable_before_close(tmp_path):
+    path = str(tmp_path / 'whole_genome_SNVs_chr_1.parquet')
+    assert _write(path, range(7)) == 7
+    assert ParquetOutputWriter.count_row_groups(path) == 7
+    assert ParquetOutputWriter.count_rows(path) == 70
+    assert ParquetOutputWriter.find_unmerged(str(tmp_path)) == [path]
+    tail = ParquetOutputWriter.read_tail(path, 15)
+    assert tail['Pos'].tolist() == list(range(55, 70))
+
+
+def test_resume_truncates_and_continues(tmp_path):
+    path = str(tmp_path / 'whole_genome_SNVs_chr_1.parquet')
+    _write(path, range(7))
+    # Back to the checkpoint after row group 5, within the second segment.
+    ParquetOutputWriter.truncate(path, 5)
+    assert ParquetOutputWriter.count_row_groups(path) == 5
+    assert _write(path, range(5, 9)) == 9
+    ParquetOutputWriter.merge(path)
+    assert not os.path.isdir(path + ParquetOutputWriter.parts_suffix)
+    variants_df = pd.read_parquet(path)
+    assert variants_df['Pos'].tolist() == list(range(90))
+    assert ParquetOutputWriter.count_row_groups(path) == 9
+
+
+def test_parts_left_by_an_interrupted_segment_are_removed(tmp_path):
+    path = str(tmp_path / 'whole_genome_SNVs_chr_1.parquet')
+    _write(path, range(2), parts_per_segment=10)
+    parts_loc = path + ParquetOutputWriter.parts_suffix
+    writer = ParquetOutputWriter(path)
+    writer.parts_per_segment = 2
+    writer.write_variants(_get_variants(20, 10))
+    writer.flush()
+    writer.close()
+    assert sorted(os.listdir(parts_loc)) == ['000000000000_3.parquet']
+    _write(path, [3], parts_per_segment=10)
+    # Parts left by a run stopped after writing the segment that combines
+    # them, before removing them.
+    segment = os.path.join(parts_loc, '000000000000_3.parquet')
+    for part in ['000000000001_1.parquet', '000000000002_1.parquet']:
+        with open(segment, 'rb') as source, \
+                open(os.path.join(parts_loc, part), 'wb') as copy:
+            copy.write(source.read())
+    assert ParquetOutputWriter.count_row_groups(path) == 4
+    assert sorted(os.listdir(parts_loc)) == ['000000000000_3.parquet',
+                                              '000000000003_1.parquet']
+
+
+def test_existing_output_is_replaced_without_keep_existing(tmp_path):
+    path = str(tmp_path / 'whole_genome_SNVs_chr_1.parquet')
+    _write(path, range(3))
+    ParquetOutputWriter.merge(path)
+    assert _write(path, [5], keep_existing=False) == 1
+    ParquetOutputWriter.merge(path)
+    assert pd.read_parquet(path)['Pos'].tolist() == list(range(50, 60))
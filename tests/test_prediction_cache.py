@@ -0,0 +1,33 @@
+import numpy as np
+from src.prediction_cache import PredictionCache
+
+
+def _predict(feature_matrix):
+    return feature_matrix[:, 0] * 2
+
+
+def _get_feature_matrix():
+    feature_matrix = np.random.RandomState(0).rand(50, 4).astype(np.float32)
+    feature_matrix[10:20] = feature_matrix[0]
+    return feature_matrix
+
+
+def test_cache_scores_unique_rows_once():
+    feature_matrix = _get_feature_matrix()
+    cache = PredictionCache(100)
+    for _ in range(2):
+        np.testing.assert_array_equal(cache.predict(feature_matrix, _predict),
+                                      _predict(feature_matrix))
+    assert cache.get_statistics()['scored'] == 40
+
+
+def test_rows_with_the_same_hash_keep_their_own_prediction():
+    feature_matrix = _get_feature_matrix()
+    cache = PredictionCache(100)
+    # Every row collides.
+    cache.hash_rows = lambda rows: np.zeros(rows.shape[0], dtype=np.uint64)
+    np.testing.assert_array_equal(cache.predict(feature_matrix, _predict),
+                                  _predict(feature_matrix))
+    reversed_matrix = feature_matrix[::-1].copy()
+    np.testing.assert_array_equal(cache.predict(reversed_matrix, _predict),
+                                  _predict(reversed_matrix))
@@ -0,0 +1,61 @@
+import gzip
+import os
+import pytest
+from src.output_writer import GzipOutputWriter
+from src.progress_tracker import ProgressTracker
+
+
+def _checkpoint(output_loc, path, lines):
+    """
+    Write lines to an output file, checkpoint it and write past the
+    checkpoint, as a run stopped before its next checkpoint does.
+    """
+    os.makedirs(os.path.join(output_loc, 'log_output'), exist_ok=True)
+    tracker = ProgressTracker(output_loc)
+    writer = GzipOutputWriter(path, 6)
+    writer.write(lines)
+    writer.flush()
+    tracker.save_checkpoint(len(lines), {}, {path: 1},
+                            {path: writer.get_size()},
+                            output_checksums={path: writer.get_checksum()})
+    writer.write(b'after the checkpoint\n')
+    writer.flush()
+    writer.close()
+    return tracker
+
+
+def test_restore_cuts_output_back_to_the_checkpoint(tmp_path):
+    path = str(tmp_path / 'whole_genome_SNVs_chr_1.tsv.gz')
+    _checkpoint(str(tmp_path), path, b'1\t10\n')
+    ProgressTracker(str(tmp_path))
+    assert gzip.open(path).read() == b'1\t10\n'
+
+
+def test_restore_refuses_output_changed_after_the_checkpoint(tmp_path):
+    path = str(tmp_path / 'whole_genome_SNVs_chr_1.tsv.gz')
+    _checkpoint(str(tmp_path), path, b'1\t10\n')
+    # Rewritten, as FinalizeCapice.py does, to a different size.
+    with gzip.open(path, 'wb', compresslevel=1) as output_file:
+        output_file.write(b'1\t10\nafter the checkpoint\n' * 2)
+    changed = open(path, 'rb').read()
+    with pytest.raises(ValueError):
+        ProgressTracker(str(tmp_path))
+    assert open(path, 'rb').read() == changed
+
+
+def test_restore_leaves_the_output_of_a_done_run_alone(tmp_path):
+    path = str(tmp_path / 'whole_genome_SNVs_chr_1.tsv.gz')
+    tracker = _checkpoint(str(tmp_path), path, b'1\t10\n')
+    tracker.update_progression('done', True)
+    written = open(path, 'rb').read()
+    ProgressTracker(str(tmp_path))
+    assert open(path, 'rb').read() == written
+
+
+def test_finalized_output_can_not_be_continued(tmp_path):
+    path = str(tmp_path / 'whole_genome_SNVs_chr_1.tsv.gz')
+    tracker = _checkpoint(str(tmp_path), path, b'1\t10\n')
+    tracker.update_progression('done', True)
+    assert ProgressTracker.mark_finalized(str(tmp_path))
+    with pytest.raises(ValueError):
+        ProgressTracker(str(tmp_path))